@@ -1,11 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
-from supabase import create_client, Client
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify, Response, stream_with_context, get_flashed_messages
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 import random
 import string
 import os
+import abc
+import bisect
+import heapq
 import json
-from datetime import datetime, timezone
+import sqlite3
+import stat
+import sys
+import tempfile
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
+from markupsafe import Markup
 from functools import wraps
 
 load_dotenv()
@@ -17,13 +32,804 @@ app.secret_key = os.environ.get('SECRET_KEY', 'domcredsys-secret-key-2026')
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 
+# Database access: DATABASE_BACKEND 'postgrest' (default) goes through
+# supabase-py and the Supabase REST API; 'postgres' connects straight to
+# PostgreSQL at DATABASE_URL with a pool of DATABASE_POOL_SIZE connections
+# per process (see pgbackend.py)
+DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'postgrest').lower()
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', '10'))
+
 # Validate required environment variables
-if not SUPABASE_URL or not SUPABASE_KEY:
+if DATABASE_BACKEND == 'postgres':
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is required with DATABASE_BACKEND=postgres")
+elif not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables are required")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Give up on a database request after SUPABASE_TIMEOUT seconds, so one slow
+# response ties up a worker thread for a bounded time
+SUPABASE_TIMEOUT = float(os.environ.get('SUPABASE_TIMEOUT', '10'))
+
+def connect_database(url, key, dsn=None):
+    """Return a client for one database through DATABASE_BACKEND"""
+    if DATABASE_BACKEND == 'postgres':
+        # psycopg is only needed for the direct backend
+        from pgbackend import PostgresClient
+        return PostgresClient(dsn, DATABASE_POOL_SIZE, SUPABASE_TIMEOUT)
+    return create_client(url, key, options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT))
+
+supabase: Client = connect_database(SUPABASE_URL, SUPABASE_KEY, DATABASE_URL)
+
+# Store sharding: SUPABASE_SHARDS names extra databases as
+# {"name": {"url": ..., "key": ...}} (or {"name": {"dsn": ...}} with
+# DATABASE_BACKEND=postgres) and STORE_SHARDS maps store IDs to shard
+# names. Credits (and their rollups) live on their store's shard; stores
+# without a mapping stay on the primary. Users, stores and assignments live
+# on the primary, and user and store rows are mirrored to every shard so
+# credits' foreign keys and the creator name embed keep working there.
+SUPABASE_SHARDS = json.loads(os.environ.get('SUPABASE_SHARDS') or '{}')
+STORE_SHARDS = json.loads(os.environ.get('STORE_SHARDS') or '{}')
+
+shard_clients = {
+    name: connect_database(config.get('url'), config.get('key'), config.get('dsn'))
+    for name, config in SUPABASE_SHARDS.items()
+}
+
+unknown_shards = set(STORE_SHARDS.values()) - set(shard_clients)
+if unknown_shards:
+    raise ValueError(f"STORE_SHARDS refers to shards missing from SUPABASE_SHARDS: {', '.join(sorted(unknown_shards))}")
+
+# Credit code format: 'legacy' issues 3-character codes, 'checked' issues
+# 6-character codes whose last character is a Luhn mod 36 check character.
+# Both formats are always accepted when claiming.
+CREDIT_CODE_FORMAT = os.environ.get('CREDIT_CODE_FORMAT', 'legacy').lower()
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+LEGACY_CODE_LENGTH = 3
+CHECKED_CODE_LENGTH = 6
+
+# Column projections shared by the routes. Each lists only the fields the
+# route or its template reads, so passwords and long text columns are never
+# transferred when they are not used.
+USER_PROFILE_COLUMNS = 'code, display_name, is_admin'
+USER_ADMIN_CHECK_COLUMNS = 'code, is_admin'
+USER_EXISTS_COLUMNS = 'code'
+STORE_COLUMNS = 'store_id, name'
+CREDIT_TILE_COLUMNS = (
+    'code, status, items, reason, date_of_issue, customer_name, customer_phone, '
+    'claimed_at, claimed_by, claimed_by_user, created_by, '
+    'users!credits_created_by_fkey(display_name)'
+)
+CREDIT_LIST_COLUMNS = (
+    'code, store_id, status, items, date_of_issue, customer_name, customer_phone, '
+    'claimed_by, created_by, created_at, users!credits_created_by_fkey(display_name)'
+)
+CREDIT_PAGE_COLUMNS = 'id, created_at, ' + CREDIT_TILE_COLUMNS
+CREDIT_CLAIM_CHECK_COLUMNS = 'code, customer_name, created_at'
+CREDIT_UNCLAIM_CHECK_COLUMNS = 'code, claimed_by_user, created_at'
+
+# Largest batch of queued offline actions accepted by one /api/sync request
+SYNC_BATCH_LIMIT = 100
+
+# Server-sent events: each subscriber buffers at most SSE_BUFFER_SIZE events
+# before it is evicted as a slow consumer; idle streams get a keepalive
+# comment every SSE_KEEPALIVE_SECONDS
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', '100'))
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+
+# Every open stream holds a server thread, so at most SSE_MAX_STREAMS are
+# served per process (default: half of GUNICORN_THREADS) and each ends after
+# SSE_MAX_STREAM_SECONDS; the browser reconnects and resumes where it left off
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', '16')) // 2)))
+SSE_MAX_STREAM_SECONDS = float(os.environ.get('SSE_MAX_STREAM_SECONDS', '300'))
+# How long a terminal turned away because every stream slot is taken waits
+# before trying again
+SSE_BUSY_RETRY_SECONDS = 30
+
+# Create and claim submissions carry an idempotency key; outcomes are kept
+# for IDEMPOTENCY_TTL_SECONDS, for at most IDEMPOTENCY_MAX_KEYS keys, in each
+# server process. Resubmissions that reach another process are caught by the
+# database instead (see create_credit and claim_credit)
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+
+# Cached data lives in CACHE_BACKEND: 'local' keeps it in each process,
+# 'sqlite' shares it between the workers on one host through the SQLite
+# file at CACHE_PATH, so invalidations made by one worker reach them all.
+# CACHE_PATH defaults to a file in a per-user directory only that user can open
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local').lower()
+CACHE_PATH = os.environ.get('CACHE_PATH')
+
+# The dashboard waits DASHBOARD_LATENCY_BUDGET seconds for fresh data
+# before showing the last good copy for the store (0 always shows the copy
+# when there is one). Copies are kept for at most DASHBOARD_CACHE_MAX_ENTRIES
+# stores and users, and refreshed by DASHBOARD_REFRESH_THREADS threads. A
+# process rewrites a copy whose data has not changed at most every
+# DASHBOARD_CACHE_REWRITE_SECONDS
+DASHBOARD_LATENCY_BUDGET = float(os.environ.get('DASHBOARD_LATENCY_BUDGET', '2'))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get('DASHBOARD_CACHE_MAX_ENTRIES', '1000'))
+DASHBOARD_REFRESH_THREADS = int(os.environ.get('DASHBOARD_REFRESH_THREADS', '8'))
+DASHBOARD_CACHE_REWRITE_SECONDS = float(os.environ.get('DASHBOARD_CACHE_REWRITE_SECONDS', '60'))
+
+# Logging in or switching stores starts loading the store's credits; the
+# user's next dashboard uses that load if it comes within
+# DASHBOARD_PREFETCH_SECONDS
+DASHBOARD_PREFETCH_SECONDS = float(os.environ.get('DASHBOARD_PREFETCH_SECONDS', '10'))
+
+# With STREAM_RENDERING on, the dashboard is sent while it renders: the
+# header and create form first, then the credit tiles as they are fetched,
+# STREAM_PAGE_SIZE credits per query, in chunks of about STREAM_CHUNK_BYTES
+STREAM_RENDERING = os.environ.get('STREAM_RENDERING', 'false').lower() in ('1', 'true', 'yes')
+STREAM_PAGE_SIZE = int(os.environ.get('STREAM_PAGE_SIZE', '500'))
+STREAM_CHUNK_BYTES = 32 * 1024
+# Templates output {{ stream_flush }} where a streamed page should be sent
+# on without waiting for a full chunk; plain renders leave it undefined
+STREAM_FLUSH = Markup('<!-- stream-flush -->')
+
+# Admin list pages and the all-stores dashboard show this many rows per
+# page; type-ahead lookups return at most LOOKUP_LIMIT matches
+ADMIN_PAGE_SIZE = 50
+LOOKUP_LIMIT = 10
+
+# Item suggestions are built from a store's ITEM_HISTORY_LIMIT most recent
+# credits and rebuilt after ITEM_INDEX_MAX_AGE seconds, to pick up credits
+# created by other workers
+ITEM_HISTORY_LIMIT = int(os.environ.get('ITEM_HISTORY_LIMIT', '5000'))
+ITEM_INDEX_MAX_AGE = float(os.environ.get('ITEM_INDEX_MAX_AGE', '900'))
+ITEM_NAME_MAX_LENGTH = 100
+
+class CreditEventBroadcaster:
+    """Fan credit create/claim/unclaim events out to per-store subscribers
+
+    Every subscriber gets its own bounded queue of (event id, event) pairs.
+    publish() never blocks: a subscriber whose queue is full is evicted as a
+    slow consumer instead of holding up the request that made the change or
+    buffering without limit. Subscribers only see events published by the
+    same process.
+
+    The last buffer_size events per store are kept, so a stream that ended
+    can resume from the id of the last event it saw. At most max_streams
+    subscribers are open at once; subscribe() returns None beyond that, or
+    once close() has been called.
+    """
+    
+    def __init__(self, buffer_size, max_streams=None):
+        self.buffer_size = buffer_size
+        self.max_streams = max_streams
+        # Ids are only meaningful to the process that issued them
+        self.process_id = uuid.uuid4().hex[:8]
+        self.closed = False
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._history = {}
+        self._sequences = {}
+    
+    def _missed(self, store_id, last_event_id):
+        """Events after last_event_id, or None if they can no longer be replayed"""
+        process_id, _, sequence = last_event_id.partition('-')
+        if process_id != self.process_id or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        current = self._sequences.get(store_id, 0)
+        missed = [entry for entry in self._history.get(store_id, ()) if entry[0] > sequence]
+        if sequence > current or len(missed) < current - sequence:
+            return None
+        return missed
+    
+    def subscribe(self, store_id, last_event_id=None):
+        subscriber = queue.Queue(maxsize=self.buffer_size)
+        subscriber.evicted = False
+        with self._lock:
+            if self.closed or (self.max_streams is not None
+                               and sum(map(len, self._subscribers.values())) >= self.max_streams):
+                return None
+            # Where a stream that ends after this subscriber resumes from
+            subscriber.resume_id = f'{self.process_id}-{self._sequences.get(store_id, 0)}'
+            if last_event_id:
+                missed = self._missed(store_id, last_event_id)
+                if missed is None:
+                    # The client must refresh to catch up
+                    subscriber.evicted = True
+                else:
+                    subscriber.resume_id = last_event_id
+                    for entry in missed:
+                        subscriber.put_nowait(entry)
+            self._subscribers.setdefault(store_id, set()).add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, store_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(store_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[store_id]
+    
+    def subscriber_count(self, store_id):
+        with self._lock:
+            return len(self._subscribers.get(store_id, ()))
+    
+    def publish(self, store_id, event):
+        with self._lock:
+            sequence = self._sequences.get(store_id, 0) + 1
+            self._sequences[store_id] = sequence
+            self._history.setdefault(store_id, deque(maxlen=self.buffer_size)).append((sequence, event))
+            subscribers = list(self._subscribers.get(store_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((sequence, event))
+            except queue.Full:
+                subscriber.evicted = True
+                self.unsubscribe(store_id, subscriber)
+    
+    def close(self):
+        """End every open stream and refuse new ones, so shutdown is not held up"""
+        with self._lock:
+            self.closed = True
+            subscribers = [subscriber for group in self._subscribers.values() for subscriber in group]
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(None)
+            except queue.Full:
+                subscriber.evicted = True
+
+credit_events = CreditEventBroadcaster(SSE_BUFFER_SIZE, SSE_MAX_STREAMS)
+
+class IdempotencyStore:
+    """Remember the outcome of recent submissions by idempotency key
+
+    Entries expire after ttl_seconds, and the oldest are dropped once more
+    than max_keys are held. A second submission with a key that is still
+    being processed waits for the first to finish and gets its outcome.
+    Outcomes are only shared within one process, so with several gunicorn
+    workers a resubmission can reach a process that never saw the key; the
+    create and claim routes then recognise the earlier outcome in the
+    database.
+    """
+    
+    def __init__(self, max_keys, ttl_seconds):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def _expire(self, now):
+        # Every entry has the same TTL, so insertion order is expiry order
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry['expires'] > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+    
+    def begin(self, key):
+        """Claim key for a new submission
+
+        Returns (True, None) when the caller should process the submission,
+        or (False, outcome) with the outcome of the earlier submission.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'done': threading.Event(), 'outcome': None,
+                                      'expires': now + self.ttl_seconds}
+                self._expire(now)
+                return True, None
+        entry['done'].wait(timeout=SUPABASE_TIMEOUT)
+        return False, entry['outcome']
+    
+    def finish(self, key, outcome):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry:
+            entry['outcome'] = outcome
+            entry['done'].set()
+    
+    def discard(self, key):
+        """Forget a key whose submission failed, so a retry runs again"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry:
+            entry['done'].set()
+
+idempotency_keys = IdempotencyStore(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS)
+
+class ItemIndex:
+    """Rank the item names issued at one store by how often they were used
+
+    Names match ignoring case and spacing, and are suggested in their most
+    used spelling. Keys are kept sorted, so the names under a prefix are one
+    bisected slice; the best `limit` of them are remembered per prefix until
+    a name under that prefix is added. Not thread-safe on its own.
+    """
+    
+    # Prefixes whose best names are remembered before the memo is cleared
+    MAX_MEMO_PREFIXES = 4096
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._keys = []
+        self._counts = {}
+        self._spellings = {}
+        self._memo = {}
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    @staticmethod
+    def normalize(name):
+        return ' '.join(name.split()).casefold()[:ITEM_NAME_MAX_LENGTH]
+    
+    def add(self, name):
+        key = self.normalize(name)
+        if not key:
+            return
+        if key not in self._counts:
+            bisect.insort(self._keys, key)
+            self._counts[key] = 0
+            self._spellings[key] = {}
+        self._counts[key] += 1
+        spelling = ' '.join(name.split())[:ITEM_NAME_MAX_LENGTH]
+        spellings = self._spellings[key]
+        spellings[spelling] = spellings.get(spelling, 0) + 1
+        for end in range(len(key) + 1):
+            self._memo.pop(key[:end], None)
+    
+    def suggest(self, prefix):
+        """Return up to limit (name, uses) pairs starting with prefix, most used first"""
+        prefix = self.normalize(prefix)
+        best = self._memo.get(prefix)
+        if best is None:
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', start)
+            best = heapq.nsmallest(self.limit, self._keys[start:end], key=lambda key: (-self._counts[key], key))
+            if len(self._memo) >= self.MAX_MEMO_PREFIXES:
+                self._memo.clear()
+            self._memo[prefix] = best
+        return [(max(self._spellings[key], key=self._spellings[key].get), self._counts[key]) for key in best]
+
+class ItemSuggestions:
+    """Hold an ItemIndex per store, built from its past credits on first use
+
+    Items on credits created through this process are added as they are
+    issued. An index older than max_age seconds is rebuilt on its next use,
+    which picks up credits created by other workers.
+    """
+    
+    def __init__(self, limit, max_age):
+        self.limit = limit
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._building = {}
+    
+    def suggest(self, store_id, prefix, load):
+        """Suggest items for store_id; load(store_id) returns its past item names"""
+        index = self._index(store_id, load)
+        with self._lock:
+            return index.suggest(prefix)
+    
+    def _index(self, store_id, load):
+        with self._lock:
+            entry = self._indexes.get(store_id)
+            if entry and time.monotonic() - entry[1] < self.max_age:
+                return entry[0]
+            building = self._building.setdefault(store_id, threading.Lock())
+        # One thread builds a store's index while the others wait for it
+        with building:
+            with self._lock:
+                entry = self._indexes.get(store_id)
+                if entry and time.monotonic() - entry[1] < self.max_age:
+                    return entry[0]
+            built_at = time.monotonic()
+            index = ItemIndex(self.limit)
+            for name in load(store_id):
+                index.add(name)
+            with self._lock:
+                self._indexes[store_id] = (index, built_at)
+            return index
+    
+    def add(self, store_id, names):
+        """Count the items of a newly issued credit, if the store is indexed"""
+        with self._lock:
+            entry = self._indexes.get(store_id)
+            if entry:
+                for name in names:
+                    entry[0].add(name)
+
+item_suggestions = ItemSuggestions(LOOKUP_LIMIT, ITEM_INDEX_MAX_AGE)
+
+class CacheBackend(abc.ABC):
+    """Storage for cached values, grouped into version-stamped namespaces
+
+    Every value is stored with the version its namespace had when the value
+    started loading. invalidate() bumps the namespace's version, so values
+    loaded before a change are never returned afterwards, even by a load
+    that was still running when the change was made. Hits and misses are
+    counted per process.
+
+    Subclasses implement version(), set(), size() and the storage behind
+    get() and invalidate() in _get() and _invalidate().
+    """
+    
+    name = None
+    
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    @abc.abstractmethod
+    def version(self, namespace):
+        """Return the namespace's current version"""
+    
+    @abc.abstractmethod
+    def _get(self, namespace, key):
+        """Return the value stored for key at the current version, or None"""
+    
+    def get(self, namespace, key):
+        """Return the current value for key, or None"""
+        value = self._get(namespace, key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+    
+    @abc.abstractmethod
+    def set(self, namespace, key, value, version):
+        """Store value for key, loaded at namespace version `version`"""
+    
+    @abc.abstractmethod
+    def _invalidate(self, namespace):
+        """Bump the namespace's version"""
+    
+    @abc.abstractmethod
+    def size(self):
+        """Return the number of values held"""
+    
+    def invalidate(self, namespace):
+        self._invalidate(namespace)
+        with self._stats_lock:
+            self.invalidations += 1
+    
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'entries': self.size()
+            }
+
+class LocalCacheBackend(CacheBackend):
+    """Least recently used cache held in this process"""
+    
+    name = 'local'
+    
+    def __init__(self, max_entries):
+        super().__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+    
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+    
+    def _get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None or entry[0] != self._versions.get(namespace, 0):
+                return None
+            self._entries.move_to_end((namespace, key))
+            return entry[1]
+    
+    def set(self, namespace, key, value, version):
+        with self._lock:
+            self._entries[(namespace, key)] = (version, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def _invalidate(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+    
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+class SQLiteCacheBackend(CacheBackend):
+    """Cache shared by every process on the host through one SQLite file
+
+    WAL mode lets workers read while another writes. Values are stored as
+    JSON, with Credits and datetimes tagged so they come back as such;
+    nothing read from the file is ever executed. The oldest writes are
+    dropped beyond max_entries; values in use are rewritten at least every
+    DASHBOARD_CACHE_REWRITE_SECONDS, so write order tracks use closely
+    enough without a write per hit.
+    """
+    
+    name = 'sqlite'
+    
+    def __init__(self, path, max_entries):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        # One connection per thread, opened on first use so forked
+        # workers never share the parent's
+        self._local = threading.local()
+    
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=SUPABASE_TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache_entries (namespace TEXT, key TEXT, version INTEGER, '
+                       'value BLOB, written INTEGER, PRIMARY KEY (namespace, key))')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_entries_written ON cache_entries (written)')
+            db.execute('CREATE TABLE IF NOT EXISTS cache_versions (namespace TEXT PRIMARY KEY, version INTEGER)')
+            self._local.db = db
+        return db
+    
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, Credit):
+            return {'__credit__': value.as_row()}
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        raise TypeError(f'Cannot cache {type(value).__name__} values')
+    
+    @staticmethod
+    def _decode(obj):
+        if '__credit__' in obj:
+            return Credit(obj['__credit__'])
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        return obj
+    
+    def version(self, namespace):
+        row = self._db().execute('SELECT version FROM cache_versions WHERE namespace = ?', (namespace,)).fetchone()
+        return row[0] if row else 0
+    
+    def _get(self, namespace, key):
+        row = self._db().execute(
+            'SELECT e.value FROM cache_entries e LEFT JOIN cache_versions v ON v.namespace = e.namespace '
+            'WHERE e.namespace = ? AND e.key = ? AND e.version = COALESCE(v.version, 0)',
+            (namespace, key)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0], object_hook=self._decode)
+        except ValueError:
+            # Written in another format, such as by an older version
+            return None
+    
+    def set(self, namespace, key, value, version):
+        db = self._db()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, '
+                       '(SELECT COALESCE(MAX(written), 0) + 1 FROM cache_entries))',
+                       (namespace, key, version, json.dumps(value, default=self._encode)))
+            db.execute('DELETE FROM cache_entries WHERE written <= '
+                       '(SELECT MAX(written) FROM cache_entries) - ?', (self.max_entries,))
+    
+    def _invalidate(self, namespace):
+        self._db().execute('INSERT INTO cache_versions VALUES (?, 1) '
+                           'ON CONFLICT (namespace) DO UPDATE SET version = version + 1', (namespace,))
+    
+    def size(self):
+        return self._db().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+def private_cache_path():
+    """Default CACHE_PATH: a file in a per-user directory no other user can open"""
+    directory = os.path.join(tempfile.gettempdir(), f'domcredsys-{os.getuid()}')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # The temporary directory is shared, so someone else may have made it first
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f'{directory} must be a directory only this user can access; '
+                           'remove it or set CACHE_PATH')
+    return os.path.join(directory, 'cache.db')
+
+def create_cache_backend(kind, max_entries):
+    """Build the CACHE_BACKEND named by kind"""
+    if kind == 'local':
+        return LocalCacheBackend(max_entries)
+    if kind == 'sqlite':
+        return SQLiteCacheBackend(CACHE_PATH or private_cache_path(), max_entries)
+    raise ValueError(f"Unknown CACHE_BACKEND {kind!r}; use 'local' or 'sqlite'")
+
+class StaleWhileRevalidateCache:
+    """Keep the last good result of slow loads to fall back on
+
+    refresh() starts loading a key on the executor, or joins the load already
+    running for it in this process, so a slow database is not sent the same
+    query by every waiting request. get() gives the load until a deadline;
+    when it is late or fails, the last value loaded for the key is returned
+    with the time it was loaded, and the load carries on in the background to
+    replace it. Keys with no value yet wait for their load. Values live in a
+    CacheBackend under a namespace; invalidating the namespace discards them.
+    
+    A load at the namespace version this process last stored the key at,
+    within rewrite_seconds of storing it, is not stored again while that copy
+    is still cached: nothing has been invalidated since, so it holds the same
+    data and rewriting a whole credit list on every dashboard would only load
+    the cache.
+    """
+    
+    def __init__(self, backend, executor, rewrite_seconds=0):
+        self.backend = backend
+        self.rewrite_seconds = rewrite_seconds
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._loading = {}
+        # (namespace, key) -> (version, monotonic time) of this process's last store
+        self._stored = OrderedDict()
+    
+    def refresh(self, namespace, key, load):
+        with self._lock:
+            future = self._loading.get((namespace, key))
+            if future is None:
+                future = self._executor.submit(self._load, namespace, key, load)
+                self._loading[(namespace, key)] = future
+        return future
+    
+    def _load(self, namespace, key, load):
+        try:
+            # Stamp the value with the version from before the query, so
+            # a change made while it runs still invalidates it
+            version = self.backend.version(namespace)
+            value = load()
+            now = time.monotonic()
+            with self._lock:
+                stored = self._stored.get((namespace, key))
+                rewrite = stored is None or stored[0] != version or now - stored[1] >= self.rewrite_seconds
+                if rewrite:
+                    self._stored[(namespace, key)] = (version, now)
+                    self._stored.move_to_end((namespace, key))
+                    while len(self._stored) > self.backend.max_entries:
+                        self._stored.popitem(last=False)
+            if rewrite or self.peek(namespace, key) is None:
+                self.put(namespace, key, value, version)
+            return value
+        finally:
+            # Only one load per key runs at a time, so this is ours
+            with self._lock:
+                self._loading.pop((namespace, key), None)
+    
+    def put(self, namespace, key, value, version):
+        """Store a value loaded at namespace version `version`"""
+        try:
+            self.backend.set(namespace, key, (value, datetime.now(timezone.utc)), version)
+        except sqlite3.Error:
+            pass
+    
+    def peek(self, namespace, key):
+        """Return (value, loaded_at) for key, or None if there is no current value"""
+        try:
+            return self.backend.get(namespace, key)
+        except sqlite3.Error:
+            return None
+    
+    def get(self, namespace, key, future, deadline):
+        """Return (value, as_of), where as_of is None for a fresh value"""
+        entry = self.peek(namespace, key)
+        if entry is None:
+            return future.result(), None
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0)), None
+        except Exception:
+            return entry
+    
+    def invalidate(self, namespace):
+        self.backend.invalidate(namespace)
+
+dashboard_cache = StaleWhileRevalidateCache(create_cache_backend(CACHE_BACKEND, DASHBOARD_CACHE_MAX_ENTRIES),
+                                            ThreadPoolExecutor(max_workers=DASHBOARD_REFRESH_THREADS,
+                                                               thread_name_prefix='dashboard-refresh'),
+                                            DASHBOARD_CACHE_REWRITE_SECONDS)
+
+class DashboardPrefetch:
+    """Hand a user's next dashboard the data loaded as they logged in or switched stores
+
+    start() keeps the store list the login or store switch already fetched,
+    stamped with the stores version read by stores_version() before that
+    fetch, and starts loading the store's credits through the dashboard
+    cache.
+    take() gives both to the same user's next dashboard for that store, once,
+    within ttl_seconds, unless stores or the store's credits changed in the
+    meantime. Prefetches are kept per process; a dashboard served by another
+    worker loads its own data.
+    """
+    
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def stores_version(self, cache):
+        """Read before fetching the store list, so a change made during the fetch invalidates it"""
+        try:
+            return cache.backend.version('stores')
+        except sqlite3.Error:
+            return None
+    
+    def start(self, cache, user_code, is_admin, stores, stores_version, store_id):
+        if stores_version is None:
+            return
+        namespace = f'credits:{store_id}'
+        try:
+            versions = (stores_version, cache.backend.version(namespace))
+        except sqlite3.Error:
+            return
+        cache.put('stores', f'{user_code}:{int(is_admin)}', stores, versions[0])
+        future = cache.refresh(namespace, 'tiles', lambda: fetch_store_credits(store_id))
+        
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(user_code, None)
+            self._entries[user_code] = {'store_id': store_id, 'stores': stores, 'credits': future,
+                                        'versions': versions, 'expires': now + self.ttl_seconds}
+            # Every entry has the same TTL, so insertion order is expiry order
+            while self._entries:
+                entry = next(iter(self._entries.values()))
+                if entry['expires'] > now and len(self._entries) <= self.max_entries:
+                    break
+                self._entries.popitem(last=False)
+    
+    def take(self, cache, user_code, store_id):
+        """Return (stores future, credits future) prefetched for the user and store, or None"""
+        with self._lock:
+            entry = self._entries.pop(user_code, None)
+        if entry is None or entry['store_id'] != store_id or entry['expires'] <= time.monotonic():
+            return None
+        try:
+            if (cache.backend.version('stores'), cache.backend.version(f'credits:{store_id}')) != entry['versions']:
+                return None
+        except sqlite3.Error:
+            return None
+        stores = Future()
+        stores.set_result(entry['stores'])
+        return stores, entry['credits']
+
+dashboard_prefetch = DashboardPrefetch(DASHBOARD_CACHE_MAX_ENTRIES, DASHBOARD_PREFETCH_SECONDS)
+
+def stores_changed():
+    """Drop every cached store list after stores or assignments change"""
+    dashboard_cache.invalidate('stores')
+
+def credits_changed(store_id, event):
+    """Drop the store's cached credits and tell its open dashboards"""
+    dashboard_cache.invalidate(f'credits:{store_id}')
+    credit_events.publish(store_id, event)
 
 # Decorators for authentication and authorization
+def query_budget(calls):
+    """Declare the most database calls one request to a route may make
+
+    The budget includes the session check made by login_required and
+    admin_required and any loads the request starts in the background, and
+    assumes every store is on the primary database.
+    Apply it below those decorators; TestQueryBudgets in test_app.py holds
+    every route to its budget.
+    """
+    def decorate(f):
+        f.query_budget = calls
+        return f
+    return decorate
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -33,13 +839,18 @@ def login_required(f):
         
         # Validate user still exists in database
         try:
-            result = supabase.table('users').select('code').eq('code', session['user_code']).execute()
+            result = supabase.table('users').select(USER_EXISTS_COLUMNS).eq('code', session['user_code']).execute()
             if not result.data:
                 # User no longer exists - clear session and redirect
                 session.clear()
                 flash('Your session has expired. Please login again', 'error')
                 return redirect(url_for('login'))
         except Exception:
+            # During a database outage the dashboard can still show its last good copy
+            if request.endpoint == 'dashboard':
+                response = render_cached_dashboard()
+                if response is not None:
+                    return response
             # On database error, clear session for security
             session.clear()
             flash('Please login to access this page', 'error')
@@ -57,7 +868,7 @@ def admin_required(f):
         
         # Validate user still exists in database and is admin
         try:
-            result = supabase.table('users').select('code', 'is_admin').eq('code', session['user_code']).execute()
+            result = supabase.table('users').select(USER_ADMIN_CHECK_COLUMNS).eq('code', session['user_code']).execute()
             if not result.data:
                 # User no longer exists - clear session and redirect
                 session.clear()
@@ -82,38 +893,420 @@ def admin_required(f):
 
 
 # Helper functions
-def generate_code():
-    """Generate a random 3-character alphanumeric code"""
+def code_check_character(body):
+    """Compute the Luhn mod 36 check character for a code body"""
+    base = len(CODE_ALPHABET)
+    factor = 2
+    total = 0
+    for char in reversed(body):
+        addend = factor * CODE_ALPHABET.index(char)
+        factor = 1 if factor == 2 else 2
+        total += addend // base + addend % base
+    return CODE_ALPHABET[(base - total % base) % base]
+
+def is_valid_credit_code(code):
+    """Check a credit code's format locally, without a database lookup
+
+    Legacy 3-character codes are only checked for length and alphabet.
+    Checked codes must also carry a matching check character, which catches
+    every single-character typo and most swapped adjacent characters.
+    """
+    if not code or any(char not in CODE_ALPHABET for char in code):
+        return False
+    if len(code) == LEGACY_CODE_LENGTH:
+        return True
+    if len(code) == CHECKED_CODE_LENGTH:
+        return code_check_character(code[:-1]) == code[-1]
+    return False
+
+def credits_db(store_id):
+    """Return the database client holding the credits of store_id"""
+    return shard_clients.get(STORE_SHARDS.get(store_id), supabase)
+
+def credit_databases(store_ids=None):
+    """Group stores by the database holding their credits
+
+    Returns [(client, store_ids)]. With store_ids=None every database is
+    returned, each with None meaning all of its stores.
+    """
+    if store_ids is None:
+        return [(supabase, None)] + [(client, None) for client in shard_clients.values()]
+    groups = {}
+    for store_id in store_ids:
+        client = credits_db(store_id)
+        groups.setdefault(id(client), (client, []))[1].append(store_id)
+    return list(groups.values())
+
+def mirror_to_shards(write, shards_first=False):
+    """Apply a users/stores write to the primary and every shard
+
+    write(client) performs the write. Inserts and updates go to the primary
+    first so a rejected write never reaches the shards; deletes go to the
+    shards first, where credits' foreign keys would block them.
+    """
+    if not shards_first:
+        write(supabase)
+    for client in shard_clients.values():
+        write(client)
+    if shards_first:
+        write(supabase)
+
+def generate_code(store_id):
+    """Generate a random alphanumeric code in the configured format
+
+    Codes are unique per store, so each store draws from the whole code
+    space rather than sharing it with the rest of the chain.
+    """
+    db = credits_db(store_id)
     while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=3))
-        # Check if code already exists
-        result = supabase.table('credits').select('code').eq('code', code).execute()
+        if CREDIT_CODE_FORMAT == 'checked':
+            body = ''.join(random.choices(CODE_ALPHABET, k=CHECKED_CODE_LENGTH - 1))
+            code = body + code_check_character(body)
+        else:
+            code = ''.join(random.choices(CODE_ALPHABET, k=LEGACY_CODE_LENGTH))
+        # Check if code already exists in this store
+        result = db.table('credits').select('code').eq('code', code).eq('store_id', store_id).execute()
         if not result.data:
             return code
 
-def get_user_stores(user_code):
-    """Get all stores assigned to a user"""
-    if session.get('is_admin', False):
+def get_user_stores(user_code, is_admin=None):
+    """Get all stores assigned to a user
+
+    is_admin defaults to the session's flag; pass it when there is no
+    request context.
+    """
+    if is_admin is None:
+        is_admin = session.get('is_admin', False)
+    if is_admin:
         # Admin can see all stores
-        result = supabase.table('stores').select('*').order('name').execute()
+        result = supabase.table('stores').select(STORE_COLUMNS).order('name').execute()
         return result.data
     else:
         # Regular users see only assigned stores
         result = supabase.table('user_stores') \
-            .select('store_id, stores(*)') \
+            .select(f'store_id, stores({STORE_COLUMNS})') \
             .eq('user_code', user_code) \
             .execute()
         return [item['stores'] for item in result.data if item['stores']]
 
+def format_items(items_str):
+    """Turn a stored items value into the comma-separated text shown on tiles"""
+    try:
+        # Try to parse as JSON array
+        items_list = json.loads(items_str)
+        if isinstance(items_list, list):
+            return ', '.join(items_list)
+        return items_str
+    except (json.JSONDecodeError, TypeError):
+        # Not JSON, treat as plain string
+        return items_str
+
+def item_names(items_str):
+    """Return the list of item names in a stored items value"""
+    try:
+        items_list = json.loads(items_str)
+    except (json.JSONDecodeError, TypeError):
+        return [items_str] if isinstance(items_str, str) else []
+    if isinstance(items_list, list):
+        return [item for item in items_list if isinstance(item, str)]
+    return [items_str]
+
+class Credit:
+    """A credit row held in __slots__ rather than a dict
+
+    Dashboards hold thousands of credits per request. Repeated values
+    (status, store, user codes, dates) are interned, and items_display is
+    only parsed and formatted when a template first reads it.
+    """
+    
+    __slots__ = ('code', 'store_id', 'status', 'items', 'reason', 'date_of_issue',
+                 'customer_name', 'customer_phone', 'claimed_at', 'claimed_by',
+                 'claimed_by_user', 'created_by', 'created_at', '_creator_name', '_items_display')
+    
+    _SHARED_FIELDS = ('store_id', 'status', 'date_of_issue', 'claimed_by', 'claimed_by_user', 'created_by')
+    _OWN_FIELDS = ('code', 'items', 'reason', 'customer_name', 'customer_phone', 'claimed_at', 'created_at')
+    
+    def __init__(self, row):
+        for field in self._SHARED_FIELDS:
+            value = row.get(field)
+            setattr(self, field, sys.intern(value) if isinstance(value, str) else value)
+        for field in self._OWN_FIELDS:
+            setattr(self, field, row.get(field))
+        creator = row.get('users') or {}
+        self._creator_name = creator.get('display_name')
+        self._items_display = None
+    
+    @property
+    def items_display(self):
+        if self._items_display is None:
+            self._items_display = format_items(self.items or '')
+        return self._items_display
+    
+    @property
+    def creator_display_name(self):
+        return self._creator_name or self.created_by
+    
+    def as_row(self):
+        """The query row this credit was built from"""
+        row = {field: getattr(self, field) for field in self._SHARED_FIELDS + self._OWN_FIELDS}
+        if self._creator_name is not None:
+            row['users'] = {'display_name': self._creator_name}
+        return row
+
+def credits_from_rows(rows):
+    """Convert query rows to Credits"""
+    return [Credit(row) for row in rows]
+
+def fetch_store_credits(store_id):
+    """Fetch a store's credits for the dashboard, newest first, in the order PagedCredits streams them
+
+    Unlike the all-stores dashboard this cannot stop at a month: a store's
+    active credits stay claimable however old they are. On partitioned
+    credits each month's idx_credits_store_created serves its part, so the
+    read stays an index scan per partition rather than a scan of credits.
+    """
+    result = credits_db(store_id).table('credits') \
+        .select(CREDIT_TILE_COLUMNS) \
+        .eq('store_id', store_id) \
+        .order('created_at', desc=True, nullsfirst=True) \
+        .order('id', desc=True) \
+        .execute()
+    return credits_from_rows(result.data)
+
+def fetch_store_item_names(store_id):
+    """Fetch the item names on a store's most recent credits"""
+    result = credits_db(store_id).table('credits') \
+        .select('items') \
+        .eq('store_id', store_id) \
+        .order('created_at', desc=True) \
+        .limit(ITEM_HISTORY_LIMIT) \
+        .execute()
+    return [name for row in result.data for name in item_names(row['items'])]
+
+class PagedCredits:
+    """A store's credits, newest first, fetched page_size rows at a time while iterated
+
+    Credits come in the same created_at order as the other dashboard
+    listings, with id breaking ties and legacy credits without a created_at
+    first, as Postgres sorts them. Each page continues from the last
+    (created_at, id) seen, so deep pages cost the same as the first and only
+    one page is held at once. Testing it for truth fetches the first page.
+    Can be iterated once.
+    """
+    
+    def __init__(self, store_id, page_size):
+        self.store_id = store_id
+        self.page_size = page_size
+        self._pages = self._fetch_pages()
+        self._first = None
+    
+    def _fetch_pages(self):
+        last = None
+        while True:
+            query = credits_db(self.store_id).table('credits') \
+                .select(CREDIT_PAGE_COLUMNS) \
+                .eq('store_id', self.store_id)
+            if last is not None:
+                created_at, last_id = last
+                if created_at is None:
+                    # Still among the undated credits; every dated one follows
+                    query = query.or_(f'and(created_at.is.null,id.lt.{last_id}),created_at.not.is.null')
+                else:
+                    # The lte bounds the index scan; the or_ skips the rows
+                    # already sent at the same created_at
+                    query = query.lte('created_at', created_at) \
+                        .or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})')
+            rows = query.order('created_at', desc=True, nullsfirst=True).order('id', desc=True) \
+                .limit(self.page_size).execute().data
+            if rows:
+                yield rows
+            if len(rows) < self.page_size:
+                return
+            last = (rows[-1]['created_at'], rows[-1]['id'])
+    
+    def __bool__(self):
+        if self._first is None:
+            self._first = next(self._pages, [])
+        return bool(self._first)
+    
+    def __iter__(self):
+        bool(self)
+        first, self._first = self._first, []
+        yield from credits_from_rows(first)
+        for rows in self._pages:
+            yield from credits_from_rows(rows)
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response
+
+    Output is sent in chunks of about STREAM_CHUNK_BYTES, and straight away
+    at the template's {{ stream_flush }} marker, so whatever precedes it
+    reaches the browser before the rows after it have been fetched.
+    """
+    # Flashes must leave the session before the cookie is sent with the headers
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    context['stream_flush'] = STREAM_FLUSH
+    template = app.jinja_env.get_template(template_name)
+    
+    def chunks():
+        buffer, size = [], 0
+        for piece in template.generate(context):
+            if STREAM_FLUSH in piece:
+                before, _, after = piece.partition(STREAM_FLUSH)
+                buffer.append(before)
+                yield ''.join(buffer)
+                buffer, size = [after], len(after)
+                continue
+            buffer.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK_BYTES:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        yield ''.join(buffer)
+    
+    return Response(stream_with_context(chunks()), mimetype='text/html')
+
+def get_search_term(value):
+    """Reduce a search box value to characters safe inside a PostgREST filter"""
+    term = ''.join(char for char in (value or '') if char.isalnum() or char in ' -_')
+    return term.strip()[:50]
+
+def get_page_number():
+    """Read the 1-based ?page= argument"""
+    try:
+        return max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+def fetch_page(query, page, page_size=ADMIN_PAGE_SIZE):
+    """Fetch one page of a query, returning (rows, has_next)
+
+    Asks for one row more than the page size so the next-page link can be
+    shown without a separate COUNT query.
+    """
+    offset = (page - 1) * page_size
+    rows = query.range(offset, offset + page_size).execute().data
+    return rows[:page_size], len(rows) > page_size
+
+def get_store_credit_counts(store_ids=None):
+    """Return {store_id: {'active': n, 'claimed': n}} for the given stores
+
+    One aggregate over credit_daily_rollups (see schema.sql) per database
+    serves every store at once; store_ids=None counts all stores.
+    """
+    counts = {}
+    for db, db_store_ids in credit_databases(store_ids):
+        rows = db.rpc('credit_store_counts', {'p_store_ids': db_store_ids}).execute().data
+        for row in rows:
+            counts[row['store_id']] = {'active': row['active'], 'claimed': row['claimed']}
+    return counts
+
+def fetch_credit_page(store_ids, page, page_size=ADMIN_PAGE_SIZE):
+    """Fetch one page of credits across stores, newest first
+
+    store_ids=None means every store. With a single database this is one
+    ranged query; with shards each database returns its newest rows up to
+    the end of the page and the results are merged.
+    """
+    groups = credit_databases(store_ids)
+    
+    def credits_query(db, db_store_ids):
+        query = db.table('credits').select(CREDIT_LIST_COLUMNS)
+        if db_store_ids is not None:
+            query = query.in_('store_id', db_store_ids)
+        return query.order('created_at', desc=True)
+    
+    if len(groups) == 1:
+        return fetch_page(credits_query(*groups[0]), page, page_size)
+    
+    offset = (page - 1) * page_size
+    rows = []
+    for db, db_store_ids in groups:
+        rows.extend(credits_query(db, db_store_ids).range(0, offset + page_size).execute().data)
+    rows.sort(key=lambda row: row.get('created_at') or '', reverse=True)
+    rows = rows[offset:offset + page_size + 1]
+    return rows[:page_size], len(rows) > page_size
+
+def parse_report_date(value, default):
+    """Parse a YYYY-MM-DD query parameter, falling back to default"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return default
+
+def get_credit_report(args):
+    """Build the per-store daily credit report from the rollup table
+
+    Reads only credit_daily_rollups, so the cost depends on the date range
+    and number of stores rather than on the size of the credits table.
+    """
+    today = datetime.now(timezone.utc).date()
+    end = parse_report_date(args.get('end'), today)
+    start = parse_report_date(args.get('start'), end - timedelta(days=29))
+    store_id = args.get('store_id', '').strip()
+    
+    rows = []
+    for db, db_store_ids in credit_databases([store_id] if store_id else None):
+        query = db.table('credit_daily_rollups') \
+            .select('store_id, day, user_code, issued, claimed') \
+            .gte('day', start.isoformat()) \
+            .lte('day', end.isoformat())
+        if store_id:
+            query = query.eq('store_id', store_id)
+        rows.extend(query.order('day', desc=True).order('store_id').execute().data)
+    if shard_clients:
+        rows.sort(key=lambda row: (row['store_id'], row['user_code']))
+        rows.sort(key=lambda row: row['day'], reverse=True)
+    
+    # Resolve display names for the users that appear in the report
+    user_codes = sorted({row['user_code'] for row in rows if row['user_code']})
+    names = {}
+    if user_codes:
+        users = supabase.table('users').select('code, display_name').in_('code', user_codes).execute().data
+        names = {user['code']: user['display_name'] or user['code'] for user in users}
+    
+    days = {}
+    for row in rows:
+        if not row['issued'] and not row['claimed']:
+            continue
+        key = (row['day'], row['store_id'])
+        day = days.setdefault(key, {
+            'day': row['day'],
+            'store_id': row['store_id'],
+            'issued': 0,
+            'claimed': 0,
+            'users': []
+        })
+        day['issued'] += row['issued']
+        day['claimed'] += row['claimed']
+        day['users'].append({
+            'user_code': row['user_code'],
+            'display_name': names.get(row['user_code'], row['user_code'] or 'Unknown'),
+            'issued': row['issued'],
+            'claimed': row['claimed']
+        })
+    
+    report_days = list(days.values())
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'store_id': store_id,
+        'days': report_days,
+        'total_issued': sum(day['issued'] for day in report_days),
+        'total_claimed': sum(day['claimed'] for day in report_days)
+    }
+
 # Authentication routes
 @app.route('/')
+@query_budget(1)
 def index():
     if 'user_code' not in session:
         return redirect(url_for('login'))
     
     # Validate session before redirecting to dashboard
     try:
-        result = supabase.table('users').select('code').eq('code', session['user_code']).execute()
+        result = supabase.table('users').select(USER_EXISTS_COLUMNS).eq('code', session['user_code']).execute()
         if not result.data:
             # User no longer exists - clear session and redirect to login
             session.clear()
@@ -127,6 +1320,7 @@ def index():
     return redirect(url_for('dashboard'))
 
 @app.route('/login', methods=['GET', 'POST'])
+@query_budget(3)
 def login():
     # Clear any existing session when accessing login page for clean slate
     if request.method == 'GET' and 'user_code' in session:
@@ -142,7 +1336,7 @@ def login():
         
         # Validate against users table
         result = supabase.table('users') \
-            .select('*') \
+            .select(USER_PROFILE_COLUMNS) \
             .eq('code', code) \
             .eq('password', password) \
             .execute()
@@ -154,9 +1348,13 @@ def login():
             session['display_name'] = user.get('display_name', user['code'])
             
             # Set first assigned store as selected_store
+            stores_version = dashboard_prefetch.stores_version(dashboard_cache)
             stores = get_user_stores(user['code'])
             if stores:
                 session['selected_store'] = stores[0]['store_id']
+                if not STREAM_RENDERING:
+                    dashboard_prefetch.start(dashboard_cache, user['code'], user['is_admin'], stores,
+                                             stores_version, session['selected_store'])
             else:
                 session['selected_store'] = None
             
@@ -168,6 +1366,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/logout')
+@query_budget(0)
 def logout():
     session.clear()
     flash('Logged out successfully', 'success')
@@ -175,6 +1374,7 @@ def logout():
 
 @app.route('/change-password', methods=['GET', 'POST'])
 @login_required
+@query_budget(3)
 def change_password():
     if request.method == 'POST':
         current_password = request.form.get('current_password')
@@ -183,7 +1383,7 @@ def change_password():
         
         # Verify current password
         result = supabase.table('users') \
-            .select('*') \
+            .select(USER_EXISTS_COLUMNS) \
             .eq('code', session['user_code']) \
             .eq('password', current_password) \
             .execute()
@@ -214,137 +1414,380 @@ def change_password():
 # Dashboard routes
 @app.route('/dashboard')
 @login_required
+@query_budget(3)
 def dashboard():
     user_code = session['user_code']
     is_admin = session.get('is_admin', False)
     selected_store = session.get('selected_store')
-    display_name = session.get('display_name', user_code)
     
-    # Get user's stores
-    stores = get_user_stores(user_code)
+    # Load the user's stores and the selected store's credits side by side;
+    # past the latency budget, fall back to the last good copy of either
+    deadline = time.monotonic() + DASHBOARD_LATENCY_BUDGET
+    stores_key = f'{user_code}:{int(is_admin)}'
+    if STREAM_RENDERING and selected_store:
+        # Credits are paged in as the page streams rather than loaded up front
+        stores_load = dashboard_cache.refresh('stores', stores_key, lambda: get_user_stores(user_code, is_admin))
+        stores, as_of = dashboard_cache.get('stores', stores_key, stores_load, deadline)
+        return render_dashboard(stores, PagedCredits(selected_store, STREAM_PAGE_SIZE), as_of)
     
-    # Get credits for selected store with creator display names
-    credits = []
+    credits_namespace = f'credits:{selected_store}'
+    # Straight after login or a store switch both are already loaded or loading
+    prefetched = dashboard_prefetch.take(dashboard_cache, user_code, selected_store) if selected_store else None
+    if prefetched:
+        stores_load, credits_load = prefetched
+    else:
+        stores_load = dashboard_cache.refresh('stores', stores_key, lambda: get_user_stores(user_code, is_admin))
+        if selected_store:
+            credits_load = dashboard_cache.refresh(credits_namespace, 'tiles',
+                                                   lambda: fetch_store_credits(selected_store))
+    
+    stores, stores_as_of = dashboard_cache.get('stores', stores_key, stores_load, deadline)
+    credits, credits_as_of = [], None
     if selected_store:
-        result = supabase.table('credits') \
-            .select('*, users!credits_created_by_fkey(display_name)') \
-            .eq('store_id', selected_store) \
-            .order('created_at', desc=True) \
-            .execute()
-        
-        # Flatten the user data and parse items
-        for credit in result.data:
-            if credit.get('users'):
-                credit['creator_display_name'] = credit['users'].get('display_name', credit['created_by'])
-            else:
-                credit['creator_display_name'] = credit['created_by']
-            
-            # Parse items JSON to display
-            items_str = credit.get('items', '')
-            try:
-                # Try to parse as JSON array
-                items_list = json.loads(items_str)
-                if isinstance(items_list, list):
-                    credit['items_display'] = ', '.join(items_list)
-                else:
-                    credit['items_display'] = items_str
-            except (json.JSONDecodeError, TypeError):
-                # Not JSON, treat as plain string
-                credit['items_display'] = items_str
-                
-        credits = result.data
+        credits, credits_as_of = dashboard_cache.get(credits_namespace, 'tiles', credits_load, deadline)
     
-    return render_template('dashboard.html', 
+    as_of = min((t for t in (stores_as_of, credits_as_of) if t), default=None)
+    return render_dashboard(stores, credits, as_of)
+
+def render_dashboard(stores, credits, as_of=None):
+    """Render the dashboard; as_of marks data older than this request"""
+    user_code = session['user_code']
+    render = stream_page if STREAM_RENDERING else render_template
+    return render('dashboard.html', 
                          credits=credits, 
+                         as_of=as_of,
+                         idempotency_key=uuid.uuid4().hex,
                          stores=stores,
-                         selected_store=selected_store,
+                         selected_store=session.get('selected_store'),
                          user_code=user_code,
-                         display_name=display_name,
-                         is_admin=is_admin)
+                         display_name=session.get('display_name', user_code),
+                         is_admin=session.get('is_admin', False))
+
+def render_cached_dashboard():
+    """Render the dashboard from cached data alone, or None if there is none"""
+    user_code = session['user_code']
+    selected_store = session.get('selected_store')
+    stores = dashboard_cache.peek('stores', f"{user_code}:{int(session.get('is_admin', False))}")
+    if stores is None:
+        return None
+    if not selected_store:
+        return render_dashboard(stores[0], [], stores[1])
+    if selected_store not in [store['store_id'] for store in stores[0]]:
+        return None
+    credits = dashboard_cache.peek(f'credits:{selected_store}', 'tiles')
+    if credits is None:
+        return None
+    return render_dashboard(stores[0], credits[0], min(stores[1], credits[1]))
 
 @app.route('/select-store', methods=['POST'])
 @login_required
+@query_budget(3)
 def select_store():
     new_store_id = request.form.get('store_id')
     
     # Verify user has access to this store
+    stores_version = dashboard_prefetch.stores_version(dashboard_cache)
     stores = get_user_stores(session['user_code'])
     store_ids = [s['store_id'] for s in stores]
     
     if new_store_id in store_ids:
         session['selected_store'] = new_store_id
+        if not STREAM_RENDERING:
+            dashboard_prefetch.start(dashboard_cache, session['user_code'], session.get('is_admin', False), stores,
+                                     stores_version, new_store_id)
         flash(f'Store changed to {new_store_id}', 'success')
     else:
         flash('You do not have access to that store', 'error')
     
     return redirect(url_for('dashboard'))
 
+@app.route('/dashboard/all')
+@login_required
+@query_budget(4)
+def consolidated_dashboard():
+    user_code = session['user_code']
+    is_admin = session.get('is_admin', False)
+    stores = get_user_stores(user_code)
+    store_ids = [s['store_id'] for s in stores]
+    
+    store_filter = request.args.get('store', '').strip()
+    if store_filter not in store_ids:
+        store_filter = ''
+    page = get_page_number()
+    
+    credits, has_next, counts = [], False, {}
+    if store_ids:
+        # Admins see every store, so they skip the store_id IN (...) list
+        if store_filter:
+            credits, has_next = fetch_credit_page([store_filter], page)
+        else:
+            credits, has_next = fetch_credit_page(None if is_admin else store_ids, page)
+        counts = get_store_credit_counts(None if is_admin else store_ids)
+    
+    credits = credits_from_rows(credits)
+    
+    store_rows = []
+    for store in stores:
+        store_counts = counts.get(store['store_id'], {})
+        store_rows.append({
+            'store_id': store['store_id'],
+            'name': store['name'],
+            'active': store_counts.get('active', 0),
+            'claimed': store_counts.get('claimed', 0)
+        })
+    
+    return render_template('consolidated.html',
+                         credits=credits,
+                         stores=store_rows,
+                         store_filter=store_filter,
+                         page=page,
+                         has_next=has_next,
+                         total_active=sum(row['active'] for row in store_rows),
+                         total_claimed=sum(row['claimed'] for row in store_rows))
+
+def idempotency_key():
+    """The idempotency key the submitted form carries, if any"""
+    return request.form.get('idempotency_key', '').strip()[:64]
+
+def run_once(scope, submit):
+    """Run submit() at most once per idempotency key in the form
+
+    submit returns the (message, category) to flash. Resubmissions with the
+    same key, scope and user get the stored outcome without running submit
+    again; if submit raises, the key is released so a retry can succeed.
+    """
+    key = idempotency_key()
+    if not key:
+        return submit()
+    
+    store_key = (session['user_code'], scope, key)
+    first, outcome = idempotency_keys.begin(store_key)
+    if not first:
+        return outcome or ('This request is still being processed. Please check the dashboard', 'error')
+    
+    try:
+        outcome = submit()
+    except Exception:
+        idempotency_keys.discard(store_key)
+        raise
+    idempotency_keys.finish(store_key, outcome)
+    return outcome
+
+def parse_credit_fields(form):
+    """Validate create-credit input, returning (fields, error message)"""
+    items_json = form.get('items', '').strip()
+    reason = form.get('reason', '').strip()
+    date_of_issue = form.get('date_of_issue', '').strip()
+    customer_name = form.get('customer_name', '').strip()
+    customer_phone = form.get('customer_phone', '').strip()
+    
+    if not items_json or not reason:
+        return None, 'Items and reason are required'
+    
+    if not customer_name:
+        return None, 'Customer name is required'
+    
+    if not customer_phone:
+        return None, 'Customer phone number is required'
+    
+    # Parse items JSON or accept as string
+    items_str = items_json
+    if items_json.startswith('['):
+        try:
+            items_list = json.loads(items_json)
+        except json.JSONDecodeError:
+            return None, 'Invalid items format'
+        if not items_list or not isinstance(items_list, list):
+            return None, 'At least one item is required'
+        # Store as JSON string
+        items_str = json.dumps(items_list)
+    # else: it's a plain string, use as is for backward compatibility
+    
+    fields = {
+        'items': items_str,
+        'reason': reason,
+        'customer_name': customer_name,
+        'customer_phone': customer_phone
+    }
+    
+    # Only add date_of_issue if provided, otherwise use database default (today)
+    if date_of_issue:
+        fields['date_of_issue'] = date_of_issue
+    
+    return fields, None
+
+def insert_credit(fields, store_id, user_code, client_ref=None):
+    """Insert a credit with a freshly generated code and return the code
+
+    client_ref is the offline terminal's action id; its unique index makes a
+    replayed create fail instead of issuing a second credit.
+    """
+    code = generate_code(store_id)
+    
+    credit_data = dict(fields)
+    credit_data.update({
+        'code': code,
+        'store_id': store_id,
+        'created_by': user_code
+    })
+    if client_ref:
+        credit_data['client_ref'] = client_ref
+    
+    credits_db(store_id).table('credits').insert(credit_data).execute()
+    
+    item_suggestions.add(store_id, item_names(credit_data['items']))
+    credits_changed(store_id, {
+        'type': 'create',
+        'code': code,
+        'credit': {
+            'code': code,
+            'status': 'active',
+            'items_display': format_items(credit_data['items']),
+            'reason': credit_data['reason'],
+            'date_of_issue': credit_data.get('date_of_issue', datetime.now(timezone.utc).date().isoformat()),
+            'customer_name': credit_data['customer_name'],
+            'customer_phone': credit_data['customer_phone'],
+            'created_by': user_code,
+            'creator_display_name': session.get('display_name') or user_code
+        }
+    })
+    return code
+
+def find_credit_by_client_ref(store_id, client_ref, user_code):
+    """Return the code of the credit user_code created under client_ref, or None"""
+    result = credits_db(store_id).table('credits') \
+        .select('code') \
+        .eq('client_ref', client_ref) \
+        .eq('created_by', user_code) \
+        .execute()
+    return result.data[0]['code'] if result.data else None
+
+def is_claimed_by(code, store_id, user_code):
+    """Whether user_code holds the claim on credit code"""
+    result = credits_db(store_id).table('credits') \
+        .select('code') \
+        .eq('code', code) \
+        .eq('store_id', store_id) \
+        .eq('status', 'claimed') \
+        .eq('claimed_by_user', user_code) \
+        .execute()
+    return bool(result.data)
+
+def in_credit_partition(query, credit):
+    """Narrow an update of credit to the partition holding it
+
+    credits may be partitioned by created_at month (see partition_credits()
+    in schema.sql); matching the created_at the check query returned lets the
+    database prune the update to one partition. Legacy rows without a
+    created_at, which only an unpartitioned table still holds (conversion
+    dates them), are matched by code alone.
+    """
+    if credit.get('created_at'):
+        query = query.eq('created_at', credit['created_at'])
+    return query
+
+def claim_active_credit(code, store_id, user_code, display_name):
+    """Claim an active credit, returning (claimed, message)"""
+    db = credits_db(store_id)
+    
+    # Check if credit exists and is active
+    result = db.table('credits') \
+        .select(CREDIT_CLAIM_CHECK_COLUMNS) \
+        .eq('code', code) \
+        .eq('store_id', store_id) \
+        .eq('status', 'active') \
+        .execute()
+    
+    if not result.data:
+        return False, f'Credit {code} not found or already claimed'
+    
+    credit = result.data[0]
+    customer_name = credit.get('customer_name', 'Unknown')
+    
+    # Claim the credit with user information
+    # Note: The .eq('status', 'active') check is intentionally duplicated here
+    # (also in SELECT above) to prevent race conditions where another user
+    # might claim the same credit between the SELECT and UPDATE operations.
+    claimed_at = datetime.now(timezone.utc).isoformat()
+    update = db.table('credits') \
+        .update({
+            'status': 'claimed',
+            'claimed_at': claimed_at,
+            'claimed_by': display_name,
+            'claimed_by_user': user_code
+        }) \
+        .eq('code', code) \
+        .eq('store_id', store_id) \
+        .eq('status', 'active')
+    update_result = in_credit_partition(update, credit).execute()
+    
+    # Validate that the update was successful
+    if update_result.data:
+        credits_changed(store_id, {
+            'type': 'claim',
+            'code': code,
+            'claimed_at': claimed_at,
+            'claimed_by': display_name,
+            'claimed_by_user': user_code
+        })
+        return True, f'Credit {code} claimed successfully for {customer_name}!'
+    return False, f'Failed to claim credit {code}. Please try again.'
+
 @app.route('/create-credit', methods=['POST'])
 @login_required
+@query_budget(4)
 def create_credit():
-    items_json = request.form.get('items', '').strip()
-    reason = request.form.get('reason', '').strip()
-    date_of_issue = request.form.get('date_of_issue', '').strip()
-    customer_name = request.form.get('customer_name', '').strip()
-    customer_phone = request.form.get('customer_phone', '').strip()
     selected_store = session.get('selected_store')
     
     if not selected_store:
         flash('Please select a store first', 'error')
         return redirect(url_for('dashboard'))
     
-    if not items_json or not reason:
-        flash('Items and reason are required', 'error')
+    fields, error = parse_credit_fields(request.form)
+    if error:
+        flash(error, 'error')
         return redirect(url_for('dashboard'))
     
-    if not customer_name:
-        flash('Customer name is required', 'error')
-        return redirect(url_for('dashboard'))
+    # The key is stored as client_ref, so a resubmission that reaches another
+    # server process fails on its unique index instead of issuing a second code
+    key = idempotency_key()
+    client_ref = f'form-{key}' if key else None
     
-    if not customer_phone:
-        flash('Customer phone number is required', 'error')
-        return redirect(url_for('dashboard'))
+    def submit():
+        try:
+            code = insert_credit(fields, selected_store, session['user_code'], client_ref=client_ref)
+        except APIError as e:
+            code = e.code == '23505' and client_ref and \
+                find_credit_by_client_ref(selected_store, client_ref, session['user_code'])
+            if not code:
+                raise
+        return f'Credit created successfully! Code: {code}', 'success'
     
     try:
-        # Parse items JSON or accept as string
-        items_str = items_json
-        if items_json.startswith('['):
-            items_list = json.loads(items_json)
-            if not items_list or not isinstance(items_list, list):
-                flash('At least one item is required', 'error')
-                return redirect(url_for('dashboard'))
-            # Store as JSON string
-            items_str = json.dumps(items_list)
-        # else: it's a plain string, use as is for backward compatibility
-        
-        code = generate_code()
-        
-        credit_data = {
-            'code': code,
-            'items': items_str,
-            'reason': reason,
-            'store_id': selected_store,
-            'created_by': session['user_code'],
-            'customer_name': customer_name,
-            'customer_phone': customer_phone
-        }
-        
-        # Only add date_of_issue if provided, otherwise use database default (today)
-        if date_of_issue:
-            credit_data['date_of_issue'] = date_of_issue
-        
-        supabase.table('credits').insert(credit_data).execute()
-        
-        flash(f'Credit created successfully! Code: {code}', 'success')
-    except json.JSONDecodeError:
-        flash('Invalid items format', 'error')
+        flash(*run_once('create', submit))
     except Exception as e:
         flash(f'Error creating credit: {str(e)}', 'error')
     
     return redirect(url_for('dashboard'))
 
+@app.route('/items/suggest', methods=['GET'])
+@login_required
+@query_budget(2)
+def suggest_items():
+    selected_store = session.get('selected_store')
+    q = request.args.get('q', '').strip()
+    if not selected_store or not q:
+        return jsonify([])
+    
+    suggestions = item_suggestions.suggest(selected_store, q, fetch_store_item_names)
+    return jsonify([
+        {'value': name, 'label': f"{name} (on {uses} credit{'' if uses == 1 else 's'})"}
+        for name, uses in suggestions
+    ])
+
 @app.route('/claim-credit', methods=['POST'])
 @login_required
+@query_budget(3)
 def claim_credit():
     code = request.form.get('code', '').upper().strip()
     selected_store = session.get('selected_store')
@@ -368,45 +1811,21 @@ def claim_credit():
         flash('Please select a store first', 'error')
         return redirect(url_for('dashboard'))
     
-    if len(code) != 3:
-        flash('Code must be exactly 3 characters', 'error')
+    # Reject typos locally before spending a database round trip
+    if not is_valid_credit_code(code):
+        flash(f'{code or "Code"} is not a valid credit code. Please check it and try again', 'error')
         return redirect(url_for('dashboard'))
     
+    def submit():
+        claimed, message = claim_active_credit(code, selected_store, user_code, display_name)
+        # A resubmission another server process applied first is not a conflict
+        if not claimed and idempotency_key() and is_claimed_by(code, selected_store, user_code):
+            return f'Credit {code} was already claimed by you', 'success'
+        return message, 'success' if claimed else 'error'
+    
     try:
-        # Check if credit exists and is active
-        result = supabase.table('credits') \
-            .select('*') \
-            .eq('code', code) \
-            .eq('store_id', selected_store) \
-            .eq('status', 'active') \
-            .execute()
-        
-        if result.data:
-            credit = result.data[0]
-            customer_name = credit.get('customer_name', 'Unknown')
-            
-            # Claim the credit with user information
-            # Note: The .eq('status', 'active') check is intentionally duplicated here
-            # (also in SELECT above) to prevent race conditions where another user
-            # might claim the same credit between the SELECT and UPDATE operations.
-            update_result = supabase.table('credits') \
-                .update({
-                    'status': 'claimed',
-                    'claimed_at': datetime.now(timezone.utc).isoformat(),
-                    'claimed_by': display_name,
-                    'claimed_by_user': user_code
-                }) \
-                .eq('code', code) \
-                .eq('status', 'active') \
-                .execute()
-            
-            # Validate that the update was successful
-            if update_result.data:
-                flash(f'Credit {code} claimed successfully for {customer_name}!', 'success')
-            else:
-                flash(f'Failed to claim credit {code}. Please try again.', 'error')
-        else:
-            flash(f'Credit {code} not found or already claimed', 'error')
+        # Keys are issued per dashboard render, so scope them by store and code
+        flash(*run_once(f'claim:{selected_store}:{code}', submit))
     except Exception as e:
         flash(f'Error claiming credit: {str(e)}', 'error')
     
@@ -414,6 +1833,7 @@ def claim_credit():
 
 @app.route('/unclaim-credit', methods=['POST'])
 @login_required
+@query_budget(3)
 def unclaim_credit():
     code = request.form.get('code', '').upper().strip()
     selected_store = session.get('selected_store')
@@ -428,14 +1848,15 @@ def unclaim_credit():
         flash('Please select a store first', 'error')
         return redirect(url_for('dashboard'))
     
-    if len(code) != 3:
-        flash('Code must be exactly 3 characters', 'error')
+    # Reject typos locally before spending a database round trip
+    if not is_valid_credit_code(code):
+        flash(f'{code or "Code"} is not a valid credit code. Please check it and try again', 'error')
         return redirect(url_for('dashboard'))
     
     try:
         # Check if credit exists and is claimed
-        result = supabase.table('credits') \
-            .select('*') \
+        result = credits_db(selected_store).table('credits') \
+            .select(CREDIT_UNCLAIM_CHECK_COLUMNS) \
             .eq('code', code) \
             .eq('store_id', selected_store) \
             .eq('status', 'claimed') \
@@ -456,7 +1877,7 @@ def unclaim_credit():
                 # might unclaim the same credit between the SELECT and UPDATE operations.
                 # Note: customer_name and customer_phone are NOT cleared because they are
                 # assigned during creation and should persist even if the credit is unclaimed.
-                update_result = supabase.table('credits') \
+                update = credits_db(selected_store).table('credits') \
                     .update({
                         'status': 'active',
                         'claimed_at': None,
@@ -464,11 +1885,13 @@ def unclaim_credit():
                         'claimed_by_user': None
                     }) \
                     .eq('code', code) \
-                    .eq('status', 'claimed') \
-                    .execute()
+                    .eq('store_id', selected_store) \
+                    .eq('status', 'claimed')
+                update_result = in_credit_partition(update, credit).execute()
                 
                 # Validate that the update was successful
                 if update_result.data:
+                    credits_changed(selected_store, {'type': 'unclaim', 'code': code})
                     flash(f'Credit {code} unclaimed successfully!', 'success')
                 else:
                     flash(f'Failed to unclaim credit {code}. Please try again.', 'error')
@@ -481,31 +1904,208 @@ def unclaim_credit():
     
     return redirect(url_for('dashboard'))
 
+# Live credit updates
+@app.route('/events')
+@login_required
+def credit_event_stream():
+    store_id = session.get('selected_store')
+    if not store_id:
+        abort(404)
+    
+    subscriber = credit_events.subscribe(store_id, request.headers.get('Last-Event-ID'))
+    
+    if subscriber is None:
+        # Every stream slot is taken: a complete, empty stream makes the
+        # browser try again later instead of holding a thread now
+        def generate():
+            yield f'retry: {int(SSE_BUSY_RETRY_SECONDS * 1000)}\n\n'
+    else:
+        def generate():
+            try:
+                # The id lets a reconnecting browser resume after this point
+                yield f'id: {subscriber.resume_id}\nretry: 5000\n\n'
+                deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+                while not subscriber.evicted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    try:
+                        entry = subscriber.get(timeout=min(SSE_KEEPALIVE_SECONDS, remaining))
+                    except queue.Empty:
+                        if time.monotonic() < deadline:
+                            yield ': keepalive\n\n'
+                        continue
+                    if entry is None:
+                        return
+                    sequence, event = entry
+                    yield f'id: {credit_events.process_id}-{sequence}\ndata: {json.dumps(event)}\n\n'
+                # Tell the client it missed events so it can refresh
+                yield 'event: evicted\ndata: {}\n\n'
+            finally:
+                credit_events.unsubscribe(store_id, subscriber)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Offline terminal support
+@app.route('/sw.js')
+@query_budget(0)
+def service_worker():
+    # Served from the root so the worker's scope covers the whole app
+    response = app.send_static_file('js/sw.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def replay_offline_action(action, user_code, display_name, store_ids):
+    """Apply one action queued by an offline terminal
+
+    Returns a result whose status is 'ok', 'duplicate' (already applied by an
+    earlier replay), 'error' (will never succeed) or 'retry' (try again later).
+    """
+    action_id = str(action.get('id') or '')[:64]
+    store_id = action.get('store_id')
+    
+    if not action_id:
+        return {'id': action_id, 'status': 'error', 'message': 'Missing action id'}
+    
+    # A shared terminal can hold actions queued under another login; they wait
+    # for that user instead of being credited to whoever is signed in now
+    if not action.get('user_code'):
+        return {'id': action_id, 'status': 'error', 'message': 'Queued action does not say who made it'}
+    if action['user_code'] != user_code:
+        return {'id': action_id, 'status': 'retry', 'message': 'Queued by another user'}
+    
+    if store_id not in store_ids:
+        return {'id': action_id, 'status': 'error', 'message': 'You do not have access to that store'}
+    
+    try:
+        if action.get('type') == 'create':
+            # Replays are recognised by the action id stored as client_ref
+            code = find_credit_by_client_ref(store_id, action_id, user_code)
+            if code:
+                return {'id': action_id, 'status': 'duplicate', 'code': code,
+                        'message': f'Credit already created. Code: {code}'}
+            
+            form = {key: value for key, value in action.items() if isinstance(value, str)}
+            fields, error = parse_credit_fields(form)
+            if error:
+                return {'id': action_id, 'status': 'error', 'message': error}
+            
+            try:
+                code = insert_credit(fields, store_id, user_code, client_ref=action_id)
+            except APIError as e:
+                if e.code != '23505':
+                    raise
+                # Our own replay may have landed through another worker; any
+                # other holder of the id is someone else's credit
+                code = find_credit_by_client_ref(store_id, action_id, user_code)
+                if not code:
+                    return {'id': action_id, 'status': 'error', 'message': 'Action id is already in use'}
+                return {'id': action_id, 'status': 'duplicate', 'code': code,
+                        'message': f'Credit already created. Code: {code}'}
+            return {'id': action_id, 'status': 'ok', 'code': code,
+                    'message': f'Credit created successfully! Code: {code}'}
+        
+        if action.get('type') == 'claim':
+            code = str(action.get('code') or '').upper().strip()
+            if not is_valid_credit_code(code):
+                return {'id': action_id, 'status': 'error', 'message': f'{code} is not a valid credit code'}
+            
+            claimed, message = claim_active_credit(code, store_id, user_code, display_name)
+            if claimed:
+                return {'id': action_id, 'status': 'ok', 'code': code, 'message': message}
+            
+            # A claim this user already made is a replay, not a conflict
+            if is_claimed_by(code, store_id, user_code):
+                return {'id': action_id, 'status': 'duplicate', 'code': code,
+                        'message': f'Credit {code} was already claimed by you'}
+            return {'id': action_id, 'status': 'error', 'code': code, 'message': message}
+        
+        return {'id': action_id, 'status': 'error', 'message': 'Unknown action type'}
+    except Exception as e:
+        return {'id': action_id, 'status': 'retry', 'message': str(e)}
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_actions():
+    payload = request.get_json(silent=True) or {}
+    actions = payload.get('actions')
+    
+    if not isinstance(actions, list) or not all(isinstance(action, dict) for action in actions):
+        return jsonify({'error': 'Expected a list of actions'}), 400
+    
+    if len(actions) > SYNC_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SYNC_BATCH_LIMIT} actions per batch'}), 400
+    
+    user_code = session['user_code']
+    display_name = session.get('display_name') or user_code
+    store_ids = {store['store_id'] for store in get_user_stores(user_code)}
+    
+    results = [replay_offline_action(action, user_code, display_name, store_ids) for action in actions]
+    return jsonify({'results': results})
+
 # Admin routes
 @app.route('/admin')
 @admin_required
+@query_budget(5)
 def admin_index():
     # Get statistics
-    users_count = len(supabase.table('users').select('id').execute().data)
-    stores_count = len(supabase.table('stores').select('id').execute().data)
-    credits_count = len(supabase.table('credits').select('id').execute().data)
-    assignments_count = len(supabase.table('user_stores').select('id').execute().data)
+    # HEAD requests with an exact count return only the totals, not the rows
+    users_count = supabase.table('users').select('id', count='exact', head=True).execute().count
+    stores_count = supabase.table('stores').select('id', count='exact', head=True).execute().count
+    credits_count = sum(db.table('credits').select('id', count='exact', head=True).execute().count
+                        for db, _ in credit_databases())
+    assignments_count = supabase.table('user_stores').select('id', count='exact', head=True).execute().count
     
     return render_template('admin/index.html',
                          users_count=users_count,
                          stores_count=stores_count,
                          credits_count=credits_count,
-                         assignments_count=assignments_count)
+                         assignments_count=assignments_count,
+                         cache_stats=dashboard_cache.backend.stats())
+
+@app.route('/admin/cache.json', methods=['GET'])
+@admin_required
+@query_budget(1)
+def admin_cache_json():
+    return jsonify(dashboard_cache.backend.stats())
+
+@app.route('/admin/reports', methods=['GET'])
+@admin_required
+@query_budget(3)
+def admin_reports():
+    try:
+        report = get_credit_report(request.args)
+    except Exception as e:
+        flash(f'Error loading report: {str(e)}', 'error')
+        return redirect(url_for('admin_index'))
+    return render_template('admin/reports.html', report=report)
+
+@app.route('/admin/reports.json', methods=['GET'])
+@admin_required
+@query_budget(3)
+def admin_reports_json():
+    return jsonify(get_credit_report(request.args))
 
 @app.route('/admin/users', methods=['GET'])
 @admin_required
+@query_budget(2)
 def admin_users():
-    result = supabase.table('users').select('*').order('created_at', desc=True).execute()
-    users = result.data
-    return render_template('admin/users.html', users=users)
+    page = get_page_number()
+    q = get_search_term(request.args.get('q'))
+    
+    query = supabase.table('users').select('code, display_name, is_admin, created_at')
+    if q:
+        query = query.or_(f'code.ilike.*{q}*,display_name.ilike.*{q}*')
+    users, has_next = fetch_page(query.order('created_at', desc=True), page)
+    
+    return render_template('admin/users.html', users=users, page=page, has_next=has_next, q=q)
 
 @app.route('/admin/users/create', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_users_create():
     code = request.form.get('code', '').strip()
     password = request.form.get('password', '').strip()
@@ -531,6 +2131,14 @@ def admin_users_create():
             'display_name': display_name,
             'is_admin': is_admin
         }).execute()
+        # Shard copies exist for foreign keys only, so they carry no password
+        for client in shard_clients.values():
+            client.table('users').insert({
+                'code': code,
+                'password': '',
+                'display_name': display_name,
+                'is_admin': is_admin
+            }).execute()
         flash(f'User {display_name} ({code}) created successfully', 'success')
     except Exception as e:
         flash(f'Error creating user: {str(e)}', 'error')
@@ -539,10 +2147,11 @@ def admin_users_create():
 
 @app.route('/admin/users/<code>/edit', methods=['GET'])
 @admin_required
+@query_budget(2)
 def admin_users_edit(code):
     # Get user details
     try:
-        result = supabase.table('users').select('*').eq('code', code).execute()
+        result = supabase.table('users').select(USER_PROFILE_COLUMNS).eq('code', code).execute()
         if not result.data:
             flash('User not found', 'error')
             return redirect(url_for('admin_users'))
@@ -555,6 +2164,7 @@ def admin_users_edit(code):
 
 @app.route('/admin/users/<code>/update', methods=['POST'])
 @admin_required
+@query_budget(7)
 def admin_users_update(code):
     new_code = request.form.get('code', '').strip()
     display_name = request.form.get('display_name', '').strip()
@@ -576,14 +2186,14 @@ def admin_users_update(code):
     
     try:
         # Check if the user exists
-        result = supabase.table('users').select('*').eq('code', code).execute()
+        result = supabase.table('users').select(USER_EXISTS_COLUMNS).eq('code', code).execute()
         if not result.data:
             flash('User not found', 'error')
             return redirect(url_for('admin_users'))
         
         # If code is being changed, check if new code is already taken
         if new_code != code:
-            check_result = supabase.table('users').select('code').eq('code', new_code).execute()
+            check_result = supabase.table('users').select(USER_EXISTS_COLUMNS).eq('code', new_code).execute()
             if check_result.data:
                 flash(f'User code {new_code} is already in use', 'error')
                 return redirect(url_for('admin_users_edit', code=code))
@@ -609,6 +2219,18 @@ def admin_users_update(code):
                 'is_admin': is_admin
             }).eq('code', code).execute()
             
+            # On shards, add the new copy before repointing credits at it
+            for client in shard_clients.values():
+                client.table('users').insert({
+                    'code': new_code,
+                    'password': '',
+                    'display_name': display_name,
+                    'is_admin': is_admin
+                }).execute()
+                client.table('credits').update({'created_by': new_code}).eq('created_by', code).execute()
+                client.table('credits').update({'claimed_by_user': new_code}).eq('claimed_by_user', code).execute()
+                client.table('users').delete().eq('code', code).execute()
+            
             # Update session if editing own account
             if code == session['user_code']:
                 session['user_code'] = new_code
@@ -618,10 +2240,10 @@ def admin_users_update(code):
             flash(f'User updated successfully (code changed to {new_code})', 'success')
         else:
             # Update user without changing code
-            supabase.table('users').update({
+            mirror_to_shards(lambda db: db.table('users').update({
                 'display_name': display_name,
                 'is_admin': is_admin
-            }).eq('code', code).execute()
+            }).eq('code', code).execute())
             
             # Update session if editing own account
             if code == session['user_code']:
@@ -629,6 +2251,7 @@ def admin_users_update(code):
                 session['display_name'] = display_name
             
             flash(f'User {display_name} updated successfully', 'success')
+        stores_changed()
     except Exception as e:
         flash(f'Error updating user: {str(e)}', 'error')
         return redirect(url_for('admin_users_edit', code=code))
@@ -637,6 +2260,7 @@ def admin_users_update(code):
 
 @app.route('/admin/users/<code>/delete', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_users_delete(code):
     # Prevent deleting yourself
     if code == session['user_code']:
@@ -644,7 +2268,9 @@ def admin_users_delete(code):
         return redirect(url_for('admin_users'))
     
     try:
-        supabase.table('users').delete().eq('code', code).execute()
+        mirror_to_shards(lambda db: db.table('users').delete().eq('code', code).execute(),
+                         shards_first=True)
+        stores_changed()
         flash(f'User {code} deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting user: {str(e)}', 'error')
@@ -653,13 +2279,21 @@ def admin_users_delete(code):
 
 @app.route('/admin/stores', methods=['GET'])
 @admin_required
+@query_budget(2)
 def admin_stores():
-    result = supabase.table('stores').select('*').order('created_at', desc=True).execute()
-    stores = result.data
-    return render_template('admin/stores.html', stores=stores)
+    page = get_page_number()
+    q = get_search_term(request.args.get('q'))
+    
+    query = supabase.table('stores').select('store_id, name, created_at')
+    if q:
+        query = query.or_(f'store_id.ilike.*{q}*,name.ilike.*{q}*')
+    stores, has_next = fetch_page(query.order('created_at', desc=True), page)
+    
+    return render_template('admin/stores.html', stores=stores, page=page, has_next=has_next, q=q)
 
 @app.route('/admin/stores/create', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_stores_create():
     store_id = request.form.get('store_id', '').strip()
     name = request.form.get('name', '').strip()
@@ -669,10 +2303,11 @@ def admin_stores_create():
         return redirect(url_for('admin_stores'))
     
     try:
-        supabase.table('stores').insert({
+        mirror_to_shards(lambda db: db.table('stores').insert({
             'store_id': store_id,
             'name': name
-        }).execute()
+        }).execute())
+        stores_changed()
         flash(f'Store {store_id} created successfully', 'success')
     except Exception as e:
         flash(f'Error creating store: {str(e)}', 'error')
@@ -681,9 +2316,12 @@ def admin_stores_create():
 
 @app.route('/admin/stores/<store_id>/delete', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_stores_delete(store_id):
     try:
-        supabase.table('stores').delete().eq('store_id', store_id).execute()
+        mirror_to_shards(lambda db: db.table('stores').delete().eq('store_id', store_id).execute(),
+                         shards_first=True)
+        stores_changed()
         flash(f'Store {store_id} deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting store: {str(e)}', 'error')
@@ -692,25 +2330,57 @@ def admin_stores_delete(store_id):
 
 @app.route('/admin/assignments', methods=['GET'])
 @admin_required
+@query_budget(2)
 def admin_assignments():
-    # Get all assignments with user and store details
-    result = supabase.table('user_stores') \
-        .select('*, users(*), stores(*)') \
-        .order('id', desc=True) \
-        .execute()
-    assignments = result.data
+    page = get_page_number()
+    q = get_search_term(request.args.get('q'))
     
-    # Get all users and stores for dropdowns
-    users = supabase.table('users').select('*').order('code').execute().data
-    stores = supabase.table('stores').select('*').order('name').execute().data
+    # Embed only the names the table shows; users and stores for the create
+    # form are looked up on demand through the type-ahead endpoints
+    query = supabase.table('user_stores') \
+        .select('id, user_code, store_id, users(display_name), stores(name)')
+    if q:
+        query = query.or_(f'user_code.ilike.*{q}*,store_id.ilike.*{q}*')
+    assignments, has_next = fetch_page(query.order('id', desc=True), page)
     
     return render_template('admin/assignments.html', 
                          assignments=assignments,
-                         users=users,
-                         stores=stores)
+                         page=page,
+                         has_next=has_next,
+                         q=q)
+
+@app.route('/admin/lookup/users', methods=['GET'])
+@admin_required
+@query_budget(2)
+def admin_lookup_users():
+    q = get_search_term(request.args.get('q'))
+    query = supabase.table('users').select(USER_PROFILE_COLUMNS)
+    if q:
+        query = query.or_(f'code.ilike.{q}*,display_name.ilike.*{q}*')
+    users = query.order('code').limit(LOOKUP_LIMIT).execute().data
+    return jsonify([
+        {'value': user['code'],
+         'label': f"{user['code']} - {user['display_name']}{' (Admin)' if user.get('is_admin') else ''}"}
+        for user in users
+    ])
+
+@app.route('/admin/lookup/stores', methods=['GET'])
+@admin_required
+@query_budget(2)
+def admin_lookup_stores():
+    q = get_search_term(request.args.get('q'))
+    query = supabase.table('stores').select(STORE_COLUMNS)
+    if q:
+        query = query.or_(f'store_id.ilike.{q}*,name.ilike.*{q}*')
+    stores = query.order('store_id').limit(LOOKUP_LIMIT).execute().data
+    return jsonify([
+        {'value': store['store_id'], 'label': f"{store['store_id']} - {store['name']}"}
+        for store in stores
+    ])
 
 @app.route('/admin/assignments/create', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_assignments_create():
     user_code = request.form.get('user_code')
     store_id = request.form.get('store_id')
@@ -724,6 +2394,7 @@ def admin_assignments_create():
             'user_code': user_code,
             'store_id': store_id
         }).execute()
+        stores_changed()
         flash(f'Assignment created successfully', 'success')
     except Exception as e:
         flash(f'Error creating assignment: {str(e)}', 'error')
@@ -732,11 +2403,13 @@ def admin_assignments_create():
 
 @app.route('/admin/assignments/delete', methods=['POST'])
 @admin_required
+@query_budget(2)
 def admin_assignments_delete():
     assignment_id = request.form.get('assignment_id')
     
     try:
         supabase.table('user_stores').delete().eq('id', assignment_id).execute()
+        stores_changed()
         flash(f'Assignment deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting assignment: {str(e)}', 'error')
@@ -0,0 +1,203 @@
+"""Back up and restore the app's tables through the Supabase REST API
+
+    python backup.py dump backup.jsonl.gz
+    python backup.py restore backup.jsonl.gz [--emit-events]
+
+dump pages through users, stores, user_stores and credits with keyset
+cursors on id (credits from the primary and every shard in
+SUPABASE_SHARDS) and writes each row as one JSON line of a gzip archive.
+restore reads the archive a line at a time and upserts the rows in batches,
+tables in the order they were dumped so foreign keys always resolve: users
+and stores are written to the primary and mirrored to every shard, credits
+to their store's database, through schema.sql's restore_credits().
+Restoring over existing rows updates them, so a restore that stopped part
+way can simply be run again. Partitioned credits (see partition_credits()
+in schema.sql) cannot be upserted on (store_id, code); there, credits whose
+code the store already has are skipped instead. Restored credits reach the
+event outbox only with --emit-events, so a restore does not replay history
+to the POS systems.
+
+Both hold at most one batch of rows in memory, and print rows, bytes and
+rows per second for every table. Credit rollups are not archived; the
+rollup triggers rebuild them as credits are restored.
+
+Reads SUPABASE_URL, SUPABASE_KEY and the sharding settings from the
+environment or .env, like the app.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+ARCHIVE_FORMAT = 'domcredsys-backup'
+ARCHIVE_VERSION = 1
+
+# Tables in dump and restore order, with the columns that identify a row
+TABLES = [
+    ('users', 'code'),
+    ('stores', 'store_id'),
+    ('user_stores', 'user_code,store_id'),
+    ('credits', 'store_id,code'),
+]
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def page_rows(client, table, batch_size):
+    """Yield every row of table, batch_size rows per request, in id order
+
+    Each page starts after the last id seen, so deep pages cost the same as
+    the first. Only an empty page ends the scan, since the server may cap
+    pages below batch_size.
+    """
+    last_id = 0
+    while True:
+        rows = client.table(table).select('*').gt('id', last_id).order('id').limit(batch_size).execute().data
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]['id']
+
+
+class Throughput:
+    """Count rows and bytes per table and print them as a table"""
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.started = time.monotonic()
+        self.rows = 0
+        self.bytes = 0
+
+    def header(self, title):
+        print(title, file=self.out)
+        print('| table | rows | MB | seconds | rows/s |', file=self.out)
+        print('|:------|-----:|---:|--------:|-------:|', file=self.out)
+
+    def report(self, table, rows, size, seconds):
+        self.rows += rows
+        self.bytes += size
+        print(f'| {table} | {rows} | {size / 1e6:.2f} | {seconds:.2f} | {rows / seconds if seconds else 0:.0f} |',
+              file=self.out, flush=True)
+
+    def summary(self):
+        seconds = time.monotonic() - self.started
+        print(f'| total | {self.rows} | {self.bytes / 1e6:.2f} | {seconds:.2f} '
+              f'| {self.rows / seconds if seconds else 0:.0f} |', file=self.out, flush=True)
+
+
+def dump(path, primary, credit_clients, batch_size=DEFAULT_BATCH_SIZE, out=sys.stdout):
+    """Write every table to a gzip archive of JSON lines at path
+
+    credit_clients are the databases holding credits: the primary and each
+    shard. Returns the number of rows written.
+    """
+    throughput = Throughput(out)
+    throughput.header(f'Dumping to {path}')
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        archive.write(json.dumps({'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION,
+                                  'created_at': datetime.now(timezone.utc).isoformat(),
+                                  'tables': [table for table, _ in TABLES]}) + '\n')
+        for table, _ in TABLES:
+            started = time.monotonic()
+            rows = size = 0
+            for client in (credit_clients if table == 'credits' else [primary]):
+                for row in page_rows(client, table, batch_size):
+                    line = json.dumps({'table': table, 'row': row}, separators=(',', ':')) + '\n'
+                    archive.write(line)
+                    rows += 1
+                    size += len(line)
+            throughput.report(table, rows, size, time.monotonic() - started)
+    throughput.summary()
+    return throughput.rows
+
+
+def restore(path, primary, shard_clients, credits_db, batch_size=DEFAULT_BATCH_SIZE, out=sys.stdout,
+            emit_events=False):
+    """Upsert every row of the archive at path; returns the number restored
+
+    Users and stores go to the primary and every client in shard_clients
+    (shard user copies carry no password, as in the app); assignments to the
+    primary; credits to credits_db(store_id), with outbox events only if
+    emit_events.
+    """
+    keys = dict(TABLES)
+    throughput = Throughput(out)
+    throughput.header(f'Restoring from {path}')
+    batches = {}
+    current = {'table': None, 'rows': 0, 'size': 0, 'started': time.monotonic()}
+
+    def write(client, table, rows):
+        if table == 'credits':
+            client.rpc('restore_credits', {'p_rows': rows, 'p_emit_events': emit_events}).execute()
+        else:
+            client.table(table).upsert(rows, on_conflict=keys[table], returning='minimal').execute()
+
+    def flush(client, table):
+        rows = batches.pop(id(client), (client, []))[1]
+        if not rows:
+            return
+        write(client, table, rows)
+        if table in ('users', 'stores'):
+            mirrored = [dict(row, password='') for row in rows] if table == 'users' else rows
+            for shard in shard_clients:
+                write(shard, table, mirrored)
+
+    def finish_table():
+        for client, _ in list(batches.values()):
+            flush(client, current['table'])
+        if current['table']:
+            throughput.report(current['table'], current['rows'], current['size'],
+                              time.monotonic() - current['started'])
+
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        header = json.loads(archive.readline() or '{}')
+        if header.get('format') != ARCHIVE_FORMAT or header.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f'{path} is not a version {ARCHIVE_VERSION} {ARCHIVE_FORMAT} archive')
+        for line in archive:
+            entry = json.loads(line)
+            table = entry['table']
+            if table not in keys:
+                raise ValueError(f'{path} holds rows for unknown table {table}')
+            if table != current['table']:
+                finish_table()
+                current.update(table=table, rows=0, size=0, started=time.monotonic())
+            row = entry['row']
+            # Ids are regenerated so the sequences stay ahead of the rows
+            row.pop('id', None)
+            client = credits_db(row['store_id']) if table == 'credits' else primary
+            batch = batches.setdefault(id(client), (client, []))[1]
+            batch.append(row)
+            current['rows'] += 1
+            current['size'] += len(line)
+            if len(batch) >= batch_size:
+                flush(client, table)
+        finish_table()
+    throughput.summary()
+    return throughput.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['dump', 'restore'])
+    parser.add_argument('path', help='Archive file (gzip-compressed JSON lines)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Rows per request (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--emit-events', action='store_true',
+                        help='Record outbox events for restored credits, as if they were just created')
+    args = parser.parse_args()
+
+    # Connects with the app's settings, including its shards
+    import app
+
+    if args.action == 'dump':
+        dump(args.path, app.supabase, [client for client, _ in app.credit_databases()], args.batch_size)
+    else:
+        restore(args.path, app.supabase, list(app.shard_clients.values()), app.credits_db, args.batch_size,
+                emit_events=args.emit_events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Race claims and unclaims of the same credits through gunicorn and check the outcome
+
+Seeds a SQLite database with one store, --codes active credits and one user
+per virtual terminal, serves it through localbackend.py and starts
+`gunicorn wsgi:app` with --workers processes. At each --concurrency level
+the terminals are spread over --processes client processes, log in as
+their own users and, all starting at once:
+
+  claim   claim every code in a random order; exactly one terminal may win
+          each code, and it must be the one recorded on the credit
+  churn   claim and immediately unclaim random codes for --duration seconds;
+          per code, successful claims minus unclaims must match whether it
+          ends up claimed, and no credit may be left half claimed
+
+Outcomes are read from the flash message each request leaves in the session
+cookie. Any violation is printed and makes the script exit non-zero.
+
+    python benchmarks/claimstress.py --workers 2 --threads 8 --processes 4 --concurrency 1,4,16,32
+
+Needs gunicorn (see requirements.txt); httpx comes with supabase.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from loadtest import ROOT, free_port, wait_for
+from localbackend import LocalDatabase
+
+STORE_ID = 'RACE1'
+SECRET_KEY = 'claimstress-secret'
+
+
+def user_code(terminal):
+    return f'{2000 + terminal:04d}'
+
+
+def seed(path, codes, terminals):
+    database = LocalDatabase(path)
+    database.insert('stores', {'store_id': STORE_ID, 'name': 'Race'})
+    database.insert('users', [{'code': user_code(t), 'password': user_code(t), 'display_name': f'Terminal {t}'}
+                              for t in range(terminals)])
+    database.insert('user_stores', [{'user_code': user_code(t), 'store_id': STORE_ID} for t in range(terminals)])
+    database.insert('credits', [
+        {'code': code, 'items': '["Item"]', 'reason': 'Race', 'store_id': STORE_ID,
+         'created_by': user_code(0), 'customer_name': f'Customer {code}'}
+        for code in codes
+    ])
+
+
+def reset(path):
+    LocalDatabase(path).update('credits', {'status': 'active', 'claimed_at': None, 'claimed_by': None,
+                                           'claimed_by_user': None}, [('store_id', f'eq.{STORE_ID}')])
+
+
+def session_serializer():
+    """Sign and read session cookies the way the server does"""
+    signer = Flask(__name__, root_path=ROOT)
+    signer.secret_key = SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(signer)
+
+
+class Terminal:
+    """One logged-in store terminal that reports whether each action succeeded"""
+
+    serializer = session_serializer()
+
+    def __init__(self, base_url, terminal):
+        self.client = httpx.Client(base_url=base_url, timeout=60)
+        code = user_code(terminal)
+        self.client.post('/login', data={'code': code, 'password': code})
+        self.take_flashes()
+
+    def take_flashes(self):
+        """Return the session's flash messages and drop them from the cookie"""
+        session = self.serializer.loads(self.client.cookies['session'])
+        flashes = session.pop('_flashes', [])
+        self.client.cookies.set('session', self.serializer.dumps(session), domain='127.0.0.1', path='/')
+        return flashes
+
+    def post(self, path, code):
+        self.client.post(path, data={'code': code})
+        return any(category == 'success' for category, _ in self.take_flashes())
+
+
+def run_terminals(base_url, terminals, codes, mode, start_at, duration):
+    """Run one client process's terminals on threads; returns their tallies"""
+    sessions = {t: Terminal(base_url, t) for t in terminals}
+    results = {}
+
+    def claim_all(terminal):
+        order = random.sample(codes, len(codes))
+        delay = start_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        results[terminal] = {'won': [code for code in order if sessions[terminal].post('/claim-credit', code)],
+                             'requests': len(order)}
+
+    def churn(terminal):
+        delay = start_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        tally, requests = {}, 0
+        while time.time() < start_at + duration:
+            code = random.choice(codes)
+            if sessions[terminal].post('/claim-credit', code):
+                tally[code] = tally.get(code, 0) + 1
+            if sessions[terminal].post('/unclaim-credit', code):
+                tally[code] = tally.get(code, 0) - 1
+            requests += 2
+        results[terminal] = {'tally': tally, 'requests': requests}
+
+    def run(terminal):
+        try:
+            (claim_all if mode == 'claim' else churn)(terminal)
+        except httpx.HTTPError as e:
+            results[terminal] = {'error': f'{type(e).__name__}: {e}'}
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in terminals]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def check_credits(path, codes):
+    rows = {row['code']: row for row in LocalDatabase(path).select(
+        'credits', 'code, status, claimed_at, claimed_by_user', [('store_id', f'eq.{STORE_ID}')])[0]}
+    problems = []
+    for code in codes:
+        row = rows[code]
+        claimed = row['claimed_at'] is not None and row['claimed_by_user'] is not None
+        if (row['status'] == 'claimed') != claimed or (row['status'] == 'active' and
+                                                      (row['claimed_at'] or row['claimed_by_user'])):
+            problems.append(f'{code} is inconsistent: {row}')
+    return rows, problems
+
+
+def run_level(base_url, db_path, codes, concurrency, processes, mode, duration):
+    reset(db_path)
+    groups = [list(range(concurrency))[p::processes] for p in range(min(processes, concurrency))]
+    start_at = time.time() + 2 + concurrency * 0.05
+    with multiprocessing.Pool(len(groups)) as pool:
+        jobs = [pool.apply_async(run_terminals, (base_url, group, codes, mode, start_at, duration))
+                for group in groups]
+        results = {}
+        for job in jobs:
+            results.update(job.get())
+    elapsed = time.time() - start_at
+
+    rows, problems = check_credits(db_path, codes)
+    # A terminal whose request failed may have won codes without knowing it
+    for terminal, result in results.items():
+        if 'error' in result:
+            problems.append(f'terminal {terminal} stopped after a failed request: {result["error"]}')
+    if any('error' in result for result in results.values()):
+        return {'requests': 0, 'rps': 0, 'successes': 0, 'problems': problems}
+    if mode == 'claim':
+        winners = {}
+        for terminal, result in results.items():
+            for code in result['won']:
+                winners.setdefault(code, []).append(user_code(terminal))
+        for code in codes:
+            won_by = winners.get(code, [])
+            if len(won_by) != 1:
+                problems.append(f'{code} was claimed by {len(won_by)} terminals: {won_by}')
+            elif rows[code]['claimed_by_user'] != won_by[0]:
+                problems.append(f'{code} was won by {won_by[0]} but is recorded for {rows[code]["claimed_by_user"]}')
+        successes = sum(len(result['won']) for result in results.values())
+    else:
+        net, successes = {}, 0
+        for result in results.values():
+            for code, change in result['tally'].items():
+                net[code] = net.get(code, 0) + change
+        for code in codes:
+            expected = 1 if rows[code]['status'] == 'claimed' else 0
+            if net.get(code, 0) != expected:
+                problems.append(f'{code} had {net.get(code, 0)} more claims than unclaims '
+                                f'but is {rows[code]["status"]}')
+    requests = sum(result['requests'] for result in results.values())
+    return {'requests': requests, 'rps': requests / elapsed, 'successes': successes, 'problems': problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=5, help='Delay per database request')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--processes', type=int, default=4, help='Client processes running the terminals')
+    parser.add_argument('--concurrency', default='1,4,16,32', help='Comma-separated terminal counts')
+    parser.add_argument('--codes', type=int, default=100, help='Credits raced over')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of claim/unclaim churn per level')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    codes = [f'S{i:02d}' if i < 100 else f'{i:03d}' for i in range(args.codes)]
+    workdir = tempfile.mkdtemp(prefix='domcredsys-race-')
+    db_path = os.path.join(workdir, 'race.db')
+    seed(db_path, codes, max(levels))
+
+    backend_port = free_port()
+    backend = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'localbackend.py'), '--db', db_path,
+        '--port', str(backend_port), '--latency-ms', str(args.latency_ms)
+    ], stdout=subprocess.DEVNULL)
+    backend_url = f'http://127.0.0.1:{backend_port}'
+    wait_for(backend_url)
+
+    port = free_port()
+    env = dict(os.environ,
+               SUPABASE_URL=backend_url, SUPABASE_KEY='local', SECRET_KEY=SECRET_KEY,
+               PORT=str(port), HOST='127.0.0.1',
+               WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+               # Recycling a worker mid-race would drop requests whose outcome is then unknown
+               GUNICORN_MAX_REQUESTS='0', GUNICORN_ACCESS_LOG='')
+    server = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'wsgi:app'],
+                              cwd=ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+
+    failed = False
+    print(f'Backend latency {args.latency_ms}ms per database request, {args.workers} worker(s) x '
+          f'{args.threads} threads, {args.codes} codes, {args.processes} client processes\n')
+    print('| terminals | phase | requests | req/s | successful | violations |')
+    print('|----------:|:------|---------:|------:|-----------:|-----------:|')
+    try:
+        wait_for(base_url + '/login')
+        for concurrency in levels:
+            for mode in ('claim', 'churn'):
+                result = run_level(base_url, db_path, codes, concurrency, args.processes, mode, args.duration)
+                print(f"| {concurrency} | {mode} | {result['requests']} | {result['rps']:.1f} "
+                      f"| {result['successes'] if mode == 'claim' else '-'} | {len(result['problems'])} |",
+                      flush=True)
+                for problem in result['problems'][:10]:
+                    print(f'    {problem}')
+                failed = failed or bool(result['problems'])
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+        backend.terminate()
+        backend.wait()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
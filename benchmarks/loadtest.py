@@ -0,0 +1,153 @@
+"""Load test the app under gunicorn against the latency-injected local backend
+
+Seeds a SQLite database with one store and its credits, serves it through
+localbackend.py with --latency-ms of delay per database request, then
+starts `gunicorn wsgi:app` once per --threads setting and measures
+dashboard throughput at each --concurrency level. Every virtual user logs
+in as the default admin, selects the store and loads /dashboard in a loop.
+
+    python benchmarks/loadtest.py --latency-ms 20 --threads 1,4,16 --concurrency 1,4,16,32
+
+Needs gunicorn (see requirements.txt); httpx comes with supabase.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from localbackend import LocalDatabase  # noqa: E402
+
+STORE_ID = 'LOAD1'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+def seed(path, credits):
+    database = LocalDatabase(path)
+    database.insert('stores', {'store_id': STORE_ID, 'name': 'Load Test'})
+    database.insert('credits', [
+        {'code': f'L{i:05d}', 'items': '["Item"]', 'reason': 'Load test', 'store_id': STORE_ID,
+         'created_by': '4757', 'customer_name': f'Customer {i}', 'customer_phone': f'555-{i:04d}'}
+        for i in range(credits)
+    ])
+
+
+def virtual_user(base_url, deadline, latencies, errors):
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        client.post('/login', data={'code': '4757', 'password': '4757'})
+        client.post('/select-store', data={'store_id': STORE_ID})
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                response = client.get('/dashboard')
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.monotonic() - started)
+            else:
+                errors.append(1)
+
+
+def run_level(base_url, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    users = [threading.Thread(target=virtual_user, args=(base_url, deadline, latencies, errors))
+             for _ in range(concurrency)]
+    started = time.monotonic()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=20, help='Delay per database request')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', default='1,4,16', help='Comma-separated gunicorn thread counts')
+    parser.add_argument('--concurrency', default='1,4,16,32', help='Comma-separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--credits', type=int, default=50, help='Credits on the dashboard')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='domcredsys-load-')
+    db_path = os.path.join(workdir, 'load.db')
+    seed(db_path, args.credits)
+
+    backend_port = free_port()
+    backend = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'localbackend.py'), '--db', db_path,
+        '--port', str(backend_port), '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms)
+    ], stdout=subprocess.DEVNULL)
+    backend_url = f'http://127.0.0.1:{backend_port}'
+    wait_for(backend_url)
+
+    print(f'Backend latency {args.latency_ms}ms per database request, '
+          f'{args.workers} worker(s), {args.duration:.0f}s per level\n')
+    print('| threads | concurrency | req/s | p50 ms | p95 ms | errors |')
+    print('|--------:|------------:|------:|-------:|-------:|-------:|')
+    try:
+        for threads in [int(t) for t in args.threads.split(',')]:
+            port = free_port()
+            env = dict(os.environ,
+                       SUPABASE_URL=backend_url, SUPABASE_KEY='local',
+                       PORT=str(port), HOST='127.0.0.1',
+                       WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(threads),
+                       GUNICORN_ACCESS_LOG='')
+            server = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'wsgi:app'],
+                                      cwd=ROOT, env=env)
+            base_url = f'http://127.0.0.1:{port}'
+            try:
+                wait_for(base_url + '/login')
+                for concurrency in [int(c) for c in args.concurrency.split(',')]:
+                    result = run_level(base_url, concurrency, args.duration)
+                    print(f"| {threads} | {concurrency} | {result['rps']:.1f} | {result['p50']:.0f} "
+                          f"| {result['p95']:.0f} | {result['errors']} |", flush=True)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+    finally:
+        backend.terminate()
+        backend.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Measure dashboard heap usage per request for dict rows and Credit records
+
+Builds a PostgREST-shaped JSON response of N credits for one store, decodes
+it the way the client does, then under tracemalloc either flattens the dicts
+in place (how dashboard() used to prepare them) or converts them with
+credits_from_rows(). Reports the memory still held by the records when the
+template is rendered, and the peak including the rendered page. The
+streamed row instead decodes the credits one STREAM_PAGE_SIZE page at a
+time while stream_page() sends the page, as with STREAM_RENDERING on.
+
+    python benchmarks/memory.py --credits 1000,10000,100000
+
+No database is needed; the template is rendered in a test request context.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:1')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+from flask import render_template  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+STORE_ID = 'MEM1'
+CREATORS = ['4757', '1001', '1002', '1003']
+
+
+def response_body(credits):
+    rows = []
+    for i in range(credits):
+        creator = CREATORS[i % len(CREATORS)]
+        claimed = i % 3 == 0
+        rows.append({
+            'code': f'M{i:05d}', 'status': 'claimed' if claimed else 'active',
+            'items': json.dumps([f'Item {i}', 'Bag']), 'reason': 'Damaged in transit',
+            'date_of_issue': '2026-10-01', 'customer_name': f'Customer {i}',
+            'customer_phone': f'555-{i:04d}',
+            'claimed_at': '2026-10-02T10:00:00+00:00' if claimed else None,
+            'claimed_by': 'Alex' if claimed else None, 'claimed_by_user': '1001' if claimed else None,
+            'created_by': creator, 'users': {'display_name': f'User {creator}'},
+        })
+    return json.dumps(rows)
+
+
+def flatten_dicts(rows):
+    for credit in rows:
+        credit['creator_display_name'] = (credit.get('users') or {}).get('display_name') or credit['created_by']
+        credit['items_display'] = app_module.format_items(credit.get('items', ''))
+    return rows
+
+
+def measure(body, prepare):
+    gc.collect()
+    tracemalloc.start()
+    credits = prepare(json.loads(body))
+    held = tracemalloc.get_traced_memory()[0]
+    with app_module.app.test_request_context('/dashboard'):
+        html = render_template('dashboard.html', credits=credits, idempotency_key='benchmark',
+                               stores=[{'store_id': STORE_ID, 'name': 'Memory'}],
+                               selected_store=STORE_ID, user_code='4757',
+                               display_name='Admin', is_admin=True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del credits, html
+    return held, peak
+
+
+def measure_streamed(pages):
+    gc.collect()
+    tracemalloc.start()
+    credits = app_module.PagedCredits(STORE_ID, app_module.STREAM_PAGE_SIZE)
+    # Stands in for the database: each page is decoded only when it is reached
+    credits._pages = (json.loads(page) for page in pages)
+    with app_module.app.test_request_context('/dashboard'):
+        response = app_module.stream_page('dashboard.html', credits=credits, idempotency_key='benchmark',
+                                          stores=[{'store_id': STORE_ID, 'name': 'Memory'}],
+                                          selected_store=STORE_ID, user_code='4757',
+                                          display_name='Admin', is_admin=True)
+        for _ in response.response:
+            pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--credits', default='1000,10000,100000', help='Comma-separated credit counts')
+    args = parser.parse_args()
+
+    print('| credits | records | held MiB | bytes/credit | peak MiB |')
+    print('|--------:|:--------|---------:|-------------:|---------:|')
+    for count in [int(c) for c in args.credits.split(',')]:
+        body = response_body(count)
+        for name, prepare in (('dicts', flatten_dicts), ('Credit', app_module.credits_from_rows)):
+            held, peak = measure(body, prepare)
+            print(f'| {count} | {name} | {held / 2**20:.1f} | {held / count:.0f} | {peak / 2**20:.1f} |',
+                  flush=True)
+        rows = json.loads(body)
+        size = app_module.STREAM_PAGE_SIZE
+        pages = [json.dumps(rows[start:start + size]) for start in range(0, count, size)]
+        del rows
+        print(f'| {count} | streamed | - | - | {measure_streamed(pages) / 2**20:.1f} |', flush=True)
+
+
+if __name__ == '__main__':
+    main()
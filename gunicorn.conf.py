@@ -0,0 +1,60 @@
+"""Gunicorn settings for serving wsgi:app
+
+Every route spends most of its time waiting on Supabase HTTP calls, so
+concurrency comes from threads: a thread waiting on the database releases
+the GIL and the worker keeps serving other requests. Add workers to use
+more CPU cores; add threads to overlap more database waits.
+
+All settings can be overridden from the environment.
+"""
+
+import os
+import signal
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+
+# Each worker keeps its own live update broadcaster (see /events), so with
+# more than one worker a terminal only sees changes made through its worker
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Sizing: every open dashboard holds a thread for its live update stream
+# (/events). app.py serves at most SSE_MAX_STREAMS streams per worker (default:
+# half of these threads) and turns further terminals away until a slot frees,
+# so the rest are always left for logins, claims and page loads. Raise
+# GUNICORN_THREADS with the number of terminals: threads = open dashboards
+# per worker + threads for everything else. With gevent, streams cost no
+# thread, so SSE_MAX_STREAMS can be raised to the number of terminals.
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+
+# Kill a worker that stops responding for this long. Individual database
+# calls are bounded separately by SUPABASE_TIMEOUT in app.py
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+
+# On SIGTERM, stop accepting connections and give in-flight requests this
+# long to finish before workers are killed
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '20'))
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Set GUNICORN_ACCESS_LOG to an empty string to turn access logging off
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """End live update streams on SIGTERM so they do not hold up shutdown
+
+    Streams otherwise run for up to SSE_MAX_STREAM_SECONDS, longer than
+    graceful_timeout. Browsers reconnect to the replacement worker.
+    """
+    from app import credit_events
+
+    def handle_exit(signum, frame):
+        credit_events.close()
+        worker.handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit)
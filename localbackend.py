@@ -0,0 +1,711 @@
+"""Local stand-in for the Supabase REST API, backed by SQLite
+
+Serves the subset of PostgREST that app.py uses (select with embeds,
+filters, ordering, ranges and exact counts; insert, upsert, update, delete; and the
+RPC functions from schema.sql) over plain HTTP, so the real supabase-py
+client can be pointed at it. Every request can be delayed by a fixed
+latency plus jitter to mimic a remote database, which is what the load and
+stress benchmarks measure against.
+
+Run it standalone:
+
+    python localbackend.py --db local.db --port 54321 --latency-ms 20
+
+and start the app with SUPABASE_URL=http://127.0.0.1:54321 and any
+SUPABASE_KEY. The schema mirrors schema.sql, including the default admin
+user (4757/4757), the rollup triggers and the credit event outbox.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    code TEXT UNIQUE NOT NULL CHECK (length(code) = 4 AND code GLOB '[0-9][0-9][0-9][0-9]'),
+    password TEXT NOT NULL,
+    display_name TEXT NOT NULL DEFAULT '',
+    is_admin BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+INSERT OR IGNORE INTO users (code, password, display_name, is_admin)
+VALUES ('4757', '4757', 'Admin', 1);
+
+CREATE TABLE IF NOT EXISTS stores (
+    id INTEGER PRIMARY KEY,
+    store_id TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS user_stores (
+    id INTEGER PRIMARY KEY,
+    user_code TEXT NOT NULL REFERENCES users(code) ON DELETE CASCADE,
+    store_id TEXT NOT NULL REFERENCES stores(store_id) ON DELETE CASCADE,
+    UNIQUE(user_code, store_id)
+);
+
+CREATE TABLE IF NOT EXISTS credits (
+    id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    items TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    date_of_issue DATE NOT NULL DEFAULT (date('now')),
+    store_id TEXT NOT NULL REFERENCES stores(store_id),
+    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'claimed')),
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    claimed_at TIMESTAMP,
+    claimed_by TEXT,
+    claimed_by_user TEXT REFERENCES users(code),
+    created_by TEXT REFERENCES users(code),
+    customer_name TEXT,
+    customer_phone TEXT,
+    client_ref TEXT,
+    UNIQUE(store_id, code)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_credits_client_ref ON credits(client_ref) WHERE client_ref IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_credits_store_created ON credits(store_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_credits_created_at ON credits(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_credits_created_by ON credits(created_by);
+CREATE INDEX IF NOT EXISTS idx_credits_claimed_by_user ON credits(claimed_by_user) WHERE claimed_by_user IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_user_stores_store_id ON user_stores(store_id);
+CREATE INDEX IF NOT EXISTS idx_stores_name ON stores(name);
+
+CREATE TABLE IF NOT EXISTS credit_daily_rollups (
+    store_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    user_code TEXT NOT NULL DEFAULT '',
+    issued INTEGER NOT NULL DEFAULT 0,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, day, user_code)
+);
+
+CREATE INDEX IF NOT EXISTS idx_credit_daily_rollups_day ON credit_daily_rollups(day);
+
+-- AUTOINCREMENT so ids are never reused once delivered events are deleted
+CREATE TABLE IF NOT EXISTS credit_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_type TEXT NOT NULL CHECK (event_type IN ('create', 'claim', 'unclaim')),
+    store_id TEXT NOT NULL,
+    code TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS credit_outbox_cursors (
+    sink TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+"""
+
+# The same bookkeeping as credits_maintain_rollups() in schema.sql, spelled
+# as one SQLite trigger per contribution
+ROLLUP_ADD = """
+    INSERT INTO credit_daily_rollups (store_id, day, user_code, issued, claimed)
+    VALUES ({store_id}, date({day}), COALESCE({user_code}, ''), {issued}, {claimed})
+    ON CONFLICT (store_id, day, user_code) DO UPDATE
+    SET issued = issued + excluded.issued, claimed = claimed + excluded.claimed;
+"""
+
+ISSUE_CHANGED = ('OLD.store_id IS NOT NEW.store_id OR OLD.created_at IS NOT NEW.created_at '
+                 'OR OLD.created_by IS NOT NEW.created_by')
+CLAIM_CHANGED = ('OLD.store_id IS NOT NEW.store_id OR OLD.status IS NOT NEW.status '
+                 'OR OLD.claimed_at IS NOT NEW.claimed_at OR OLD.claimed_by_user IS NOT NEW.claimed_by_user '
+                 'OR OLD.created_at IS NOT NEW.created_at')
+
+
+def _rollup_trigger(name, event, when, row, issued, claimed):
+    # Credits without a created_at contribute nothing
+    when = f'{row}.created_at IS NOT NULL' + (f' AND ({when})' if when else '')
+    add = ROLLUP_ADD.format(
+        store_id=f'{row}.store_id',
+        day=f'{row}.created_at' if issued else f'COALESCE({row}.claimed_at, {row}.created_at)',
+        user_code=f'{row}.created_by' if issued else f'{row}.claimed_by_user',
+        issued=issued,
+        claimed=claimed
+    )
+    return f"""
+CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON credits WHEN {when}
+BEGIN
+    {add}
+END;
+"""
+
+
+ROLLUP_TRIGGERS = ''.join([
+    _rollup_trigger('rollup_insert_issue', 'INSERT', None, 'NEW', 1, 0),
+    _rollup_trigger('rollup_insert_claim', 'INSERT', "NEW.status = 'claimed'", 'NEW', 0, 1),
+    _rollup_trigger('rollup_update_issue_old', 'UPDATE', ISSUE_CHANGED, 'OLD', -1, 0),
+    _rollup_trigger('rollup_update_issue_new', 'UPDATE', ISSUE_CHANGED, 'NEW', 1, 0),
+    _rollup_trigger('rollup_update_claim_old', 'UPDATE',
+                    f"OLD.status = 'claimed' AND ({CLAIM_CHANGED})", 'OLD', 0, -1),
+    _rollup_trigger('rollup_update_claim_new', 'UPDATE',
+                    f"NEW.status = 'claimed' AND ({CLAIM_CHANGED})", 'NEW', 0, 1),
+    _rollup_trigger('rollup_delete_issue', 'DELETE', None, 'OLD', -1, 0),
+    _rollup_trigger('rollup_delete_claim', 'DELETE', "OLD.status = 'claimed'", 'OLD', 0, -1),
+])
+
+# credits_write_outbox() from schema.sql, one SQLite trigger per event type
+OUTBOX_PAYLOAD = ", ".join(f"'{column}', NEW.{column}" for column in (
+    'code', 'store_id', 'status', 'items', 'reason', 'date_of_issue', 'customer_name', 'customer_phone',
+    'created_by', 'created_at', 'claimed_at', 'claimed_by', 'claimed_by_user'))
+
+
+def _outbox_trigger(event_type, event, when):
+    when_clause = f'WHEN {when}' if when else ''
+    return f"""
+CREATE TRIGGER IF NOT EXISTS outbox_{event_type} AFTER {event} ON credits {when_clause}
+BEGIN
+    INSERT INTO credit_outbox (event_type, store_id, code, payload)
+    VALUES ('{event_type}', NEW.store_id, NEW.code, json_object({OUTBOX_PAYLOAD}));
+END;
+"""
+
+
+OUTBOX_TRIGGERS = ''.join([
+    _outbox_trigger('create', 'INSERT', None),
+    _outbox_trigger('claim', 'UPDATE OF status', "OLD.status = 'active' AND NEW.status = 'claimed'"),
+    _outbox_trigger('unclaim', 'UPDATE OF status', "OLD.status = 'claimed' AND NEW.status = 'active'"),
+])
+
+# Embedded resources used by app.py: (table, embed name) -> (target table,
+# local column, target column)
+EMBEDS = {
+    ('credits', 'users!credits_created_by_fkey'): ('users', 'created_by', 'code'),
+    ('user_stores', 'users'): ('users', 'user_code', 'code'),
+    ('user_stores', 'stores'): ('stores', 'store_id', 'store_id'),
+}
+
+FILTER_OPERATORS = {
+    'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=', 'ilike': 'LIKE'
+}
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Map SQLite errors to the PostgreSQL SQLSTATE codes PostgREST would report
+INTEGRITY_CODES = (
+    ('UNIQUE', '23505'),
+    ('FOREIGN KEY', '23503'),
+    ('NOT NULL', '23502'),
+    ('CHECK', '23514'),
+)
+
+
+class BackendError(Exception):
+    """An error reported to the client as a PostgREST error body"""
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def split_top_level(text, separator=','):
+    """Split on separator, ignoring separators inside parentheses"""
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def identifier(name):
+    if not IDENTIFIER.match(name):
+        raise BackendError(400, 'PGRST100', f'Invalid identifier: {name}')
+    return f'"{name}"'
+
+
+def sqlite_value(value):
+    """Translate a filter literal to the value SQLite stores"""
+    if value == 'true':
+        return 1
+    if value == 'false':
+        return 0
+    return value
+
+
+def sql_value(value):
+    """Translate a JSON value to the value SQLite stores"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+class LocalDatabase:
+    """SQLite database holding the app's tables, one connection per thread"""
+
+    _names = itertools.count()
+
+    def __init__(self, path=':memory:'):
+        # Shared-cache memory databases let every thread see the same data.
+        # The name must be unique for the process: id() can be reused while a
+        # request thread still holds an earlier database open
+        if path == ':memory:':
+            path = f'file:localbackend-{next(LocalDatabase._names)}?mode=memory&cache=shared'
+        self.path = path
+        self._local = threading.local()
+        self._boolean_columns = {}
+        # Keeps a shared-cache memory database alive between requests
+        self._keeper = self.connection()
+        self._keeper.executescript(SCHEMA + ROLLUP_TRIGGERS + OUTBOX_TRIGGERS)
+        for table in ('users', 'stores', 'user_stores', 'credits', 'credit_daily_rollups'):
+            columns = self._keeper.execute(f'PRAGMA table_info({table})').fetchall()
+            self._boolean_columns[table] = {row[1] for row in columns if row[2] == 'BOOLEAN'}
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, uri=self.path.startswith('file:'),
+                                   timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA busy_timeout = 30000')
+            if not self.path.startswith('file:'):
+                conn.execute('PRAGMA journal_mode = WAL')
+            self._local.conn = conn
+        return conn
+
+    def row_dict(self, table, row):
+        data = dict(row)
+        for column in self._boolean_columns.get(table, ()):
+            if column in data and data[column] is not None:
+                data[column] = bool(data[column])
+        return data
+
+    # Query building
+
+    def _condition(self, column, expression, params):
+        operator, _, value = expression.partition('.')
+        negate = False
+        if operator == 'not':
+            negate = True
+            operator, _, value = value.partition('.')
+        column_sql = identifier(column)
+        if operator in FILTER_OPERATORS:
+            # Values holding reserved characters are sent double-quoted
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            if operator == 'ilike':
+                value = value.replace('*', '%')
+                sql = f'{column_sql} LIKE ?'
+            else:
+                sql = f'{column_sql} {FILTER_OPERATORS[operator]} ?'
+            params.append(sqlite_value(value))
+        elif operator == 'in':
+            values = [v.strip().strip('"') for v in value.strip('()').split(',') if v.strip()]
+            if not values:
+                sql = '0'
+            else:
+                sql = f'{column_sql} IN ({", ".join("?" for _ in values)})'
+                params.extend(sqlite_value(v) for v in values)
+        elif operator == 'is':
+            literal = {'null': 'NULL', 'true': '1', 'false': '0'}.get(value.lower())
+            if literal is None:
+                raise BackendError(400, 'PGRST100', f'Invalid is value: {value}')
+            sql = f'{column_sql} IS {literal}'
+        else:
+            raise BackendError(400, 'PGRST100', f'Unsupported operator: {operator}')
+        return f'NOT ({sql})' if negate else sql
+
+    def _group(self, expression, joiner, params):
+        """Build an or=(...) filter, or an and(...)/or(...) group nested in one"""
+        conditions = []
+        for part in split_top_level(expression.strip()[1:-1]):
+            if part.startswith(('and(', 'or(')):
+                name, _, group = part.partition('(')
+                conditions.append(self._group('(' + group, ' AND ' if name == 'and' else ' OR ', params))
+            else:
+                column, _, condition = part.partition('.')
+                conditions.append(self._condition(column, condition, params))
+        return '(' + joiner.join(conditions) + ')'
+
+    def where_clause(self, filters):
+        """Build a WHERE clause from (column, expression) query parameters"""
+        conditions, params = [], []
+        for column, expression in filters:
+            if column == 'or':
+                conditions.append(self._group(expression, ' OR ', params))
+            else:
+                conditions.append(self._condition(column, expression, params))
+        if not conditions:
+            return '', params
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    def parse_select(self, table, select):
+        """Split a select parameter into plain columns and embeds"""
+        columns, embeds = [], []
+        for part in split_top_level(select or '*'):
+            match = re.match(r'^([A-Za-z0-9_!]+)\((.*)\)$', part)
+            if match:
+                key = (table, match.group(1))
+                if key not in EMBEDS:
+                    raise BackendError(400, 'PGRST200', f'Unknown relationship {match.group(1)} on {table}')
+                target, local_column, target_column = EMBEDS[key]
+                alias = match.group(1).split('!')[0]
+                embeds.append((alias, target, local_column, target_column, match.group(2)))
+            else:
+                columns.append(part)
+        return columns, embeds
+
+    def _embed(self, conn, rows, embeds):
+        for alias, target, local_column, target_column, select in embeds:
+            keys = sorted({row[local_column] for row in rows if row.get(local_column) is not None})
+            related = {}
+            if keys:
+                target_columns, nested = self.parse_select(target, select)
+                query_columns = list(dict.fromkeys(target_columns + [target_column]))
+                column_sql = '*' if '*' in query_columns else ', '.join(identifier(c) for c in query_columns)
+                result = conn.execute(
+                    f'SELECT {column_sql} FROM {identifier(target)} '
+                    f'WHERE {identifier(target_column)} IN ({", ".join("?" for _ in keys)})', keys
+                ).fetchall()
+                for row in result:
+                    data = self.row_dict(target, row)
+                    related[data[target_column]] = data
+                self._embed(conn, list(related.values()), nested)
+                if '*' not in target_columns:
+                    for data in related.values():
+                        for column in list(data):
+                            if column not in target_columns and column not in {n[0] for n in nested}:
+                                del data[column]
+            for row in rows:
+                row[alias] = related.get(row.get(local_column))
+        return rows
+
+    def select(self, table, select, filters, order=None, limit=None, offset=None, count=False):
+        """Run a PostgREST-style read, returning (rows, total count or None)"""
+        conn = self.connection()
+        columns, embeds = self.parse_select(table, select)
+        where, params = self.where_clause(filters)
+
+        query_columns = list(dict.fromkeys(columns + [embed[2] for embed in embeds]))
+        column_sql = '*' if '*' in query_columns or not query_columns else \
+            ', '.join(identifier(c) for c in query_columns)
+
+        sql = f'SELECT {column_sql} FROM {identifier(table)}{where}'
+        if order:
+            terms = []
+            for term in order.split(','):
+                parts = term.split('.')
+                direction = 'DESC' if 'desc' in parts[1:] else 'ASC'
+                nulls = ' NULLS FIRST' if 'nullsfirst' in parts[1:] else \
+                    ' NULLS LAST' if 'nullslast' in parts[1:] else ''
+                terms.append(f'{identifier(parts[0])} {direction}{nulls}')
+            sql += ' ORDER BY ' + ', '.join(terms)
+        if limit is not None or offset is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params_page = [int(limit) if limit is not None else -1, int(offset or 0)]
+        else:
+            params_page = []
+
+        rows = [self.row_dict(table, row) for row in conn.execute(sql, params + params_page).fetchall()]
+        self._embed(conn, rows, embeds)
+        if '*' not in columns:
+            for row in rows:
+                for column in list(row):
+                    if column not in columns and column not in {e[0] for e in embeds}:
+                        del row[column]
+
+        total = None
+        if count:
+            total = conn.execute(f'SELECT COUNT(*) FROM {identifier(table)}{where}', params).fetchone()[0]
+        return rows, total
+
+    def _returning(self, conn, table, rowids):
+        if not rowids:
+            return []
+        rows = conn.execute(
+            f'SELECT * FROM {identifier(table)} WHERE rowid IN ({", ".join("?" for _ in rowids)}) ORDER BY rowid',
+            rowids
+        ).fetchall()
+        return [self.row_dict(table, row) for row in rows]
+
+    def insert(self, table, records, on_conflict=None, ignore_duplicates=False):
+        """Insert records; with on_conflict, rows clashing on those columns are
+        merged (or skipped with ignore_duplicates) like a PostgREST upsert"""
+        conn = self.connection()
+        if isinstance(records, dict):
+            records = [records]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._returning(conn, table, self._insert(conn, table, records, on_conflict, ignore_duplicates))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _insert(self, conn, table, records, on_conflict, ignore_duplicates):
+        """Insert records in the open transaction, returning their rowids"""
+        rowids = []
+        for record in records:
+            columns = list(record)
+            sql = (f'INSERT INTO {identifier(table)} ({", ".join(identifier(c) for c in columns)}) '
+                   f'VALUES ({", ".join("?" for _ in columns)})')
+            if on_conflict:
+                targets = [c.strip() for c in on_conflict.split(',')]
+                updates = [c for c in columns if c not in targets]
+                sql += f' ON CONFLICT ({", ".join(identifier(c) for c in targets)}) '
+                if updates and not ignore_duplicates:
+                    sql += 'DO UPDATE SET ' + ', '.join(f'{identifier(c)} = excluded.{identifier(c)}'
+                                                        for c in updates)
+                else:
+                    sql += 'DO NOTHING'
+                rowids.extend(row[0] for row in
+                              conn.execute(sql + ' RETURNING rowid', [sql_value(record[c]) for c in columns]))
+            else:
+                rowids.append(conn.execute(sql, [sql_value(record[c]) for c in columns]).lastrowid)
+        return rowids
+
+    def update(self, table, values, filters):
+        conn = self.connection()
+        where, params = self.where_clause(filters)
+        # One write transaction, so a conditional update (e.g. status = 'active')
+        # is atomic against concurrent requests just as it is in Postgres
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rowids = [row[0] for row in conn.execute(f'SELECT rowid FROM {identifier(table)}{where}', params)]
+            if rowids and values:
+                assignments = ', '.join(f'{identifier(c)} = ?' for c in values)
+                conn.execute(
+                    f'UPDATE {identifier(table)} SET {assignments} '
+                    f'WHERE rowid IN ({", ".join("?" for _ in rowids)})',
+                    [sql_value(v) for v in values.values()] + rowids
+                )
+            rows = self._returning(conn, table, rowids)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def delete(self, table, filters):
+        conn = self.connection()
+        where, params = self.where_clause(filters)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rowids = [row[0] for row in conn.execute(f'SELECT rowid FROM {identifier(table)}{where}', params)]
+            rows = self._returning(conn, table, rowids)
+            if rowids:
+                conn.execute(f'DELETE FROM {identifier(table)} WHERE rowid IN ({", ".join("?" for _ in rowids)})',
+                             rowids)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    # RPC functions from schema.sql
+
+    def rpc_credit_store_counts(self, p_store_ids=None):
+        sql = ('SELECT store_id, SUM(issued - claimed) AS active, SUM(claimed) AS claimed '
+               'FROM credit_daily_rollups')
+        params = []
+        if p_store_ids is not None:
+            sql += f' WHERE store_id IN ({", ".join("?" for _ in p_store_ids)})' if p_store_ids else ' WHERE 0'
+            params = list(p_store_ids)
+        rows = self.connection().execute(sql + ' GROUP BY store_id', params).fetchall()
+        return [dict(row) for row in rows]
+
+    def rpc_restore_credits(self, p_rows, p_emit_events=False):
+        # Upserts like restore_credits() on an unpartitioned table; instead of
+        # muting the outbox trigger, drops what it wrote in the same transaction
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM credit_outbox').fetchone()[0]
+            self._insert(conn, 'credits', p_rows, 'store_id,code', False)
+            if not p_emit_events:
+                conn.execute('DELETE FROM credit_outbox WHERE id > ?', (last_event,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def call(self, name, args):
+        function = getattr(self, f'rpc_{name}', None)
+        if function is None:
+            raise BackendError(404, 'PGRST202', f'Could not find the function public.{name}')
+        return function(**args)
+
+
+class LocalBackendHandler(BaseHTTPRequestHandler):
+    """Translates PostgREST HTTP requests into LocalDatabase calls"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm holds the body back for a delayed ACK on every request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, payload=None, headers=None):
+        body = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _handle(self):
+        self.server.count_request()
+        self.server.inject_latency()
+        parts = urlsplit(self.path)
+        if not parts.path.startswith('/rest/v1/'):
+            self._body()
+            self._send(404, {'code': 'PGRST404', 'message': 'Not found'})
+            return
+        resource = parts.path[len('/rest/v1/'):]
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        prefer = self.headers.get('Prefer', '')
+        database = self.server.database
+
+        try:
+            body = self._body() if self.command in ('POST', 'PATCH', 'DELETE') else None
+            if resource.startswith('rpc/'):
+                self._send(200, database.call(resource[4:], body or {}))
+                return
+
+            identifier(resource)
+            options = {key: value for key, value in params
+                       if key in ('select', 'order', 'limit', 'offset')}
+            filters = [(key, value) for key, value in params
+                       if key not in ('select', 'order', 'limit', 'offset', 'columns', 'on_conflict')]
+
+            if self.command in ('GET', 'HEAD'):
+                rows, total = database.select(resource, options.get('select'), filters,
+                                              order=options.get('order'),
+                                              limit=options.get('limit'),
+                                              offset=options.get('offset'),
+                                              count='count=exact' in prefer)
+                start = int(options.get('offset') or 0)
+                content_range = f'{start}-{start + len(rows) - 1}' if rows else '*'
+                content_range += f'/{total if total is not None else "*"}'
+                self._send(200, None if self.command == 'HEAD' else rows,
+                           {'Content-Range': content_range})
+            elif self.command == 'POST':
+                on_conflict = dict(params).get('on_conflict') if 'resolution=' in prefer else None
+                rows = database.insert(resource, body, on_conflict,
+                                       ignore_duplicates='resolution=ignore-duplicates' in prefer)
+                self._send(201, rows if 'return=representation' in prefer else None)
+            elif self.command == 'PATCH':
+                rows = database.update(resource, body, filters)
+                self._send(200, rows if 'return=representation' in prefer else None)
+            elif self.command == 'DELETE':
+                rows = database.delete(resource, filters)
+                self._send(200, rows if 'return=representation' in prefer else None)
+        except BackendError as e:
+            self._send(e.status, {'code': e.code, 'message': e.message, 'details': None, 'hint': None})
+        except sqlite3.IntegrityError as e:
+            message = str(e)
+            code = next((c for marker, c in INTEGRITY_CODES if marker in message), '23000')
+            self._send(409, {'code': code, 'message': message, 'details': None, 'hint': None})
+        except sqlite3.OperationalError as e:
+            self._send(400, {'code': '42703', 'message': str(e), 'details': None, 'hint': None})
+
+    do_GET = do_HEAD = do_POST = do_PATCH = do_DELETE = _handle
+
+
+class LocalBackend(ThreadingHTTPServer):
+    """HTTP server for a LocalDatabase with injected per-request latency
+
+    latency_ms is added to every request, plus up to jitter_ms of random
+    extra delay. Requests are served on separate threads, so concurrent
+    requests wait out their latency in parallel like they would against a
+    remote database. request_count counts every request served, which is
+    how the tests hold routes to their database call budgets.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, database=None, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, verbose=False):
+        super().__init__((host, port), LocalBackendHandler)
+        self.database = database or LocalDatabase()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.verbose = verbose
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+    def inject_latency(self):
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def start(self):
+        """Serve on a background thread; returns self for chaining"""
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local SQLite stand-in for the Supabase REST API')
+    parser.add_argument('--db', default='local.db', help='SQLite database file (default: local.db)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random extra delay, up to this much')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    server = LocalBackend(LocalDatabase(args.db), args.host, args.port,
+                          args.latency_ms, args.jitter_ms, args.verbose)
+    print(f'Serving {args.db} at {server.url} (latency {args.latency_ms}ms + up to {args.jitter_ms}ms jitter)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""Deliver credit lifecycle events from the outbox to external HTTP sinks
+
+    python outbox.py dispatch
+    python outbox.py receive --port 8099
+
+Creating, claiming and unclaiming a credit writes an event to credit_outbox
+in the same transaction (see credits_write_outbox() in schema.sql), so the
+app never calls POS or loyalty systems itself. dispatch runs the delivery
+worker: for every credit database (the primary and each shard in
+SUPABASE_SHARDS) and every sink in OUTBOX_SINKS, a lane reads events in id
+order and POSTs them in batches as
+
+    {"events": [{"id": "primary:42", "type": "claim", "store_id": ...,
+                 "code": ..., "occurred_at": ..., "credit": {...}}]}
+
+and, once the sink answers 2xx, moves that sink's cursor in
+credit_outbox_cursors past them. Delivery is at least once and in order per
+database; sinks should ignore event ids they have already seen.
+
+- Failures are retried with exponential backoff and jitter, up to
+  OUTBOX_MAX_BACKOFF_SECONDS apart. A sink's Retry-After is honoured.
+- Each lane has one batch in flight. Events wait in the database while a
+  sink is slow or down, so the worker's memory stays flat and other sinks
+  are not held up.
+- A batch answered 400, 413 or 422 is split until the event the sink
+  refuses is found, which is then skipped and recorded as the cursor's
+  last_error. Later batches grow back to full size.
+- Ids left unused by a transaction that has not committed yet would be
+  skipped for good, so a lane stops at a gap in the ids until the event
+  after it is OUTBOX_SETTLE_SECONDS old.
+
+receive runs a stand-in sink that prints every batch, for local testing.
+
+Reads the app's settings from the environment or .env, plus:
+
+    OUTBOX_SINKS='{"pos": {"url": "https://pos.example.com/credit-events",
+                           "headers": {"Authorization": "Bearer ..."}}}'
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_POLL_SECONDS = 1.0
+DEFAULT_MAX_BACKOFF_SECONDS = 300.0
+DEFAULT_SETTLE_SECONDS = 60.0
+DEFAULT_TIMEOUT = 10.0
+
+# First retry delay; each further failure doubles it
+BASE_BACKOFF_SECONDS = 1.0
+
+# Events not yet delivered to every sink are kept; delivered ones are
+# deleted at most this often per lane
+PRUNE_SECONDS = 60.0
+
+# Responses meaning the sink will never accept some event in the batch, or
+# the batch is too large
+REJECTED_STATUSES = (400, 413, 422)
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def item_list(items):
+    """Items as a list of names, whether stored as a JSON array or plain text"""
+    try:
+        items = json.loads(items)
+    except (TypeError, ValueError):
+        return [items] if items else []
+    return items if isinstance(items, list) else [items]
+
+
+class HttpSink:
+    """An HTTP endpoint that is POSTed batches of events"""
+
+    def __init__(self, name, url, headers=None, timeout=DEFAULT_TIMEOUT, client=None):
+        self.name = name
+        self.url = url
+        self.headers = headers or {}
+        self.client = client or httpx.Client(timeout=timeout)
+
+    def send(self, events):
+        """POST events; returns (status or None, Retry-After seconds or None, error)"""
+        try:
+            response = self.client.post(self.url, json={'events': events}, headers=self.headers)
+        except httpx.HTTPError as e:
+            return None, None, f'{type(e).__name__}: {e}'
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get('Retry-After', ''))
+        except ValueError:
+            pass
+        error = None if response.is_success else f'HTTP {response.status_code}: {response.text[:200]}'
+        return response.status_code, retry_after, error
+
+
+class OutboxLane:
+    """Delivers one database's outbox to one sink, a batch at a time
+
+    step() does one round and returns how many seconds to wait before the
+    next, so the delivery logic runs without threads or sleeping in tests.
+    """
+
+    def __init__(self, database, db, sink, batch_size=DEFAULT_BATCH_SIZE, poll_seconds=DEFAULT_POLL_SECONDS,
+                 max_backoff=DEFAULT_MAX_BACKOFF_SECONDS, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 sink_names=None, out=sys.stdout):
+        self.database = database
+        self.db = db
+        self.sink = sink
+        self.max_batch_size = batch_size
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_backoff = max_backoff
+        self.settle_seconds = settle_seconds
+        # Every sink reading this outbox; events are deleted once all have them
+        self.sink_names = sink_names or [sink.name]
+        self.out = out
+        self.cursor = None
+        self.failures = 0
+        self.pruned_at = 0.0
+
+    def report(self, message):
+        print(f'{datetime.now(timezone.utc).isoformat(timespec="seconds")} '
+              f'[{self.database} -> {self.sink.name}] {message}', file=self.out, flush=True)
+
+    def load_cursor(self):
+        self.db.table('credit_outbox_cursors') \
+            .upsert({'sink': self.sink.name}, on_conflict='sink', ignore_duplicates=True, returning='minimal') \
+            .execute()
+        rows = self.db.table('credit_outbox_cursors').select('last_id').eq('sink', self.sink.name).execute().data
+        self.cursor = rows[0]['last_id']
+
+    def pending(self):
+        """The next events to deliver: up to batch_size, stopping at an unsettled gap"""
+        rows = self.db.table('credit_outbox') \
+            .select('id, event_type, store_id, code, payload, created_at') \
+            .gt('id', self.cursor) \
+            .order('id') \
+            .limit(self.batch_size) \
+            .execute().data
+        ready = []
+        expected = self.cursor + 1
+        now = time.time()
+        for row in rows:
+            if row['id'] != expected and now - parse_timestamp(row['created_at']) < self.settle_seconds:
+                break
+            ready.append(row)
+            expected = row['id'] + 1
+        return ready
+
+    def event(self, row):
+        credit = json.loads(row['payload'])
+        credit['items'] = item_list(credit.get('items'))
+        return {
+            'id': f"{self.database}:{row['id']}",
+            'type': row['event_type'],
+            'store_id': row['store_id'],
+            'code': row['code'],
+            'occurred_at': row['created_at'],
+            'credit': credit,
+        }
+
+    def advance(self, last_id, error=None):
+        """Move the cursor past last_id; reload it if another worker moved it first
+
+        last_error keeps the most recent failure or skip until the next one.
+        """
+        values = {'last_id': last_id, 'updated_at': datetime.now(timezone.utc).isoformat()}
+        if error:
+            values['last_error'] = error
+        moved = self.db.table('credit_outbox_cursors') \
+            .update(values) \
+            .eq('sink', self.sink.name) \
+            .eq('last_id', self.cursor) \
+            .execute().data
+        if moved:
+            self.cursor = last_id
+        else:
+            self.load_cursor()
+
+    def prune(self):
+        """Delete events every sink has received"""
+        self.pruned_at = time.monotonic()
+        cursors = self.db.table('credit_outbox_cursors') \
+            .select('last_id') \
+            .in_('sink', self.sink_names) \
+            .execute().data
+        if len(cursors) == len(self.sink_names):
+            delivered = min(cursor['last_id'] for cursor in cursors)
+            self.db.table('credit_outbox').delete(returning='minimal').lte('id', delivered).execute()
+
+    def backoff(self, retry_after=None):
+        self.failures += 1
+        delay = min(self.max_backoff, BASE_BACKOFF_SECONDS * 2 ** (self.failures - 1))
+        delay *= random.uniform(0.5, 1)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    def step(self):
+        if self.cursor is None:
+            self.load_cursor()
+        rows = self.pending()
+        if not rows:
+            if time.monotonic() - self.pruned_at >= PRUNE_SECONDS:
+                self.prune()
+            return self.poll_seconds
+
+        status, retry_after, error = self.sink.send([self.event(row) for row in rows])
+        if error is None:
+            self.advance(rows[-1]['id'])
+            self.failures = 0
+            # Grow back towards full batches after splitting one
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            return 0
+
+        if status in REJECTED_STATUSES:
+            # Split the batch until the event the sink refuses is alone
+            if len(rows) > 1:
+                self.batch_size = max(1, len(rows) // 2)
+                return 0
+            self.report(f'skipping event {rows[0]["id"]}: {error}')
+            self.advance(rows[0]['id'], error=f'event {rows[0]["id"]} skipped: {error}')
+            return 0
+
+        delay = self.backoff(retry_after)
+        self.report(f'{error}; retrying in {delay:.1f}s')
+        self.db.table('credit_outbox_cursors').update({'last_error': error}).eq('sink', self.sink.name).execute()
+        return delay
+
+    def run(self, stop):
+        """Step until stop is set, backing off when the database fails too"""
+        while not stop.is_set():
+            try:
+                delay = self.step()
+            except Exception as e:
+                delay = self.backoff()
+                self.report(f'{type(e).__name__}: {e}; retrying in {delay:.1f}s')
+            if delay:
+                stop.wait(delay)
+
+
+class OutboxDispatcher:
+    """Runs one lane per database and sink, each on its own thread
+
+    databases is [(name, client)]; sinks is [HttpSink]. Other keyword
+    arguments go to every OutboxLane.
+    """
+
+    def __init__(self, databases, sinks, **options):
+        names = [sink.name for sink in sinks]
+        self.lanes = [OutboxLane(database, db, sink, sink_names=names, **options)
+                      for database, db in databases for sink in sinks]
+        self.stop = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for lane in self.lanes:
+            thread = threading.Thread(target=lane.run, args=(self.stop,), daemon=True,
+                                      name=f'outbox-{lane.database}-{lane.sink.name}')
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def close(self, timeout=None):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+class LocalReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        events = json.loads(self.rfile.read(length) or b'{}').get('events', [])
+        status, headers = self.server.respond(events)
+        self.server.record(events, status)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class LocalReceiver(ThreadingHTTPServer):
+    """Stand-in sink that records every batch it is sent
+
+    respond(events) returns the (status, headers) to answer with; by default
+    every batch is accepted. batches holds (events, status) in arrival order.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, respond=None, verbose=False):
+        super().__init__((host, port), LocalReceiverHandler)
+        self.respond = respond or (lambda events: (200, {}))
+        self.verbose = verbose
+        self.batches = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/events'
+
+    def record(self, events, status):
+        with self.lock:
+            self.batches.append((events, status))
+        if self.verbose:
+            for event in events:
+                print(f"{status} {event['id']} {event['type']} {event['store_id']}/{event['code']}", flush=True)
+
+    def delivered(self):
+        """Every event from accepted batches, in arrival order"""
+        with self.lock:
+            return [event for events, status in self.batches if 200 <= status < 300 for event in events]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def sinks_from_config(config, timeout=DEFAULT_TIMEOUT):
+    """Build sinks from OUTBOX_SINKS: {"name": {"url": ..., "headers": {...}}}"""
+    return [HttpSink(name, options['url'], options.get('headers'), timeout)
+            for name, options in json.loads(config or '{}').items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['dispatch', 'receive'])
+    parser.add_argument('--port', type=int, default=8099, help='Port for receive (default: 8099)')
+    args = parser.parse_args()
+
+    if args.action == 'receive':
+        receiver = LocalReceiver(port=args.port, verbose=True)
+        print(f'Receiving events at {receiver.url}', flush=True)
+        receiver.serve_forever()
+        return
+
+    # Connects with the app's settings, including its shards
+    import app
+
+    sinks = sinks_from_config(os.environ.get('OUTBOX_SINKS'),
+                              float(os.environ.get('OUTBOX_TIMEOUT', DEFAULT_TIMEOUT)))
+    if not sinks:
+        raise SystemExit('OUTBOX_SINKS names no sinks')
+    databases = [('primary', app.supabase)] + list(app.shard_clients.items())
+    dispatcher = OutboxDispatcher(
+        databases, sinks,
+        batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        poll_seconds=float(os.environ.get('OUTBOX_POLL_SECONDS', DEFAULT_POLL_SECONDS)),
+        max_backoff=float(os.environ.get('OUTBOX_MAX_BACKOFF_SECONDS', DEFAULT_MAX_BACKOFF_SECONDS)),
+        settle_seconds=float(os.environ.get('OUTBOX_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS)),
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: dispatcher.stop.set())
+    print(f'Delivering {len(databases)} outbox(es) to {", ".join(sink.name for sink in sinks)}', flush=True)
+    dispatcher.start()
+    while not dispatcher.stop.wait(1):
+        pass
+    dispatcher.close(timeout=DEFAULT_TIMEOUT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""Direct PostgreSQL client for app.py, bypassing the Supabase REST API
+
+Implements the part of supabase-py's query builder that app.py uses --
+table() with select (including exact counts and the embeds in EMBEDS),
+insert, upsert, update and delete; eq, neq, gt, gte, lt, lte, ilike, in_,
+is_ and or_ filters; order, limit and range; and rpc() -- by building
+parameterised SQL and running it on a psycopg_pool connection pool.
+
+Rows come back the way PostgREST returns them, aggregated with json_agg()
+by the database, so values such as timestamps are formatted identically.
+Connections prepare every statement on first use, so repeated hot queries
+such as the claim check skip parsing and planning. Database errors are
+raised as postgrest's APIError with the SQLSTATE as code, like the HTTP
+client's.
+
+Needs psycopg and psycopg_pool (pip install "psycopg[binary,pool]").
+"""
+
+import json
+import re
+
+from postgrest.exceptions import APIError
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Embedded resources used by app.py: (table, embed name) -> (target table,
+# local column, target column)
+EMBEDS = {
+    ('credits', 'users!credits_created_by_fkey'): ('users', 'created_by', 'code'),
+    ('user_stores', 'users'): ('users', 'user_code', 'code'),
+    ('user_stores', 'stores'): ('stores', 'store_id', 'store_id'),
+}
+
+OPERATORS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=', 'ilike': 'ILIKE'}
+
+
+def identifier(name):
+    if not IDENTIFIER.match(name):
+        raise ValueError(f'Invalid identifier: {name}')
+    return f'"{name}"'
+
+
+def split_top_level(text, separator=','):
+    """Split on separator, ignoring separators inside parentheses"""
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def sql_value(value):
+    """Adapt a JSON value for a text or scalar column"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+class QueryResult:
+    """What execute() returns: the rows as data, and count when asked for"""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def first_value(cursor):
+    """The first column of a statement's first row, or None if it returns no rows"""
+    if cursor.description is None:
+        return None
+    return cursor.fetchone()[0]
+
+
+class PostgresQuery:
+    """One table request, built up like a supabase-py request builder"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = identifier(table)
+        self.table_name = table
+        self.method = 'select'
+        self.columns = '*'
+        self.count = None
+        self.head = False
+        self.body = None
+        self.returning = True
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.conditions = []
+        self.params = []
+        self.orders = []
+        self.limit_count = None
+        self.offset_count = None
+
+    # Request kinds
+
+    def select(self, *columns, count=None, head=None):
+        self.columns = ','.join(columns) or '*'
+        self.count = count
+        self.head = bool(head)
+        return self
+
+    def insert(self, json, *, count=None, returning='representation', upsert=False, default_to_null=True):
+        self.method = 'insert'
+        self.body = json if isinstance(json, list) else [json]
+        self.returning = str(getattr(returning, 'value', returning)) == 'representation'
+        return self
+
+    def upsert(self, json, *, count=None, returning='representation', ignore_duplicates=False,
+               on_conflict='', default_to_null=True):
+        self.insert(json, returning=returning)
+        self.on_conflict = [column.strip() for column in on_conflict.split(',') if column.strip()]
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json, *, count=None, returning='representation'):
+        self.method = 'update'
+        self.body = json
+        self.returning = str(getattr(returning, 'value', returning)) == 'representation'
+        return self
+
+    def delete(self, *, count=None, returning='representation'):
+        self.method = 'delete'
+        self.returning = str(getattr(returning, 'value', returning)) == 'representation'
+        return self
+
+    # Filters
+
+    def _filter(self, column, operator, value):
+        if operator == 'ilike':
+            value = value.replace('*', '%')
+        self.conditions.append(f't.{identifier(column)} {OPERATORS[operator]} %s')
+        self.params.append(sql_value(value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, 'ilike', pattern)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.conditions.append('FALSE')
+        else:
+            self.conditions.append(f't.{identifier(column)} IN ({", ".join("%s" for _ in values)})')
+            self.params.extend(sql_value(value) for value in values)
+        return self
+
+    def is_(self, column, value):
+        literal = {'null': 'NULL', 'true': 'TRUE', 'false': 'FALSE'}.get(str(value).lower())
+        if literal is None:
+            raise ValueError(f'Invalid is value: {value}')
+        self.conditions.append(f't.{identifier(column)} IS {literal}')
+        return self
+
+    def _group(self, filters, joiner):
+        """SQL for PostgREST conditions joined by joiner, with and(...)/or(...) groups nested"""
+        conditions = []
+        for part in split_top_level(filters):
+            if part.startswith(('and(', 'or(')):
+                name, _, group = part.partition('(')
+                conditions.append(self._group(group[:-1], ' AND ' if name == 'and' else ' OR '))
+                continue
+            column, operator, value = part.split('.', 2)
+            negate = operator == 'not'
+            if negate:
+                operator, _, value = value.partition('.')
+            value = value.strip('"')
+            if operator == 'is':
+                literal = {'null': 'NULL', 'true': 'TRUE', 'false': 'FALSE'}[value.lower()]
+                condition = f't.{identifier(column)} IS {literal}'
+            else:
+                if operator == 'ilike':
+                    value = value.replace('*', '%')
+                condition = f't.{identifier(column)} {OPERATORS[operator]} %s'
+                self.params.append(value)
+            conditions.append(f'NOT {condition}' if negate else condition)
+        return '(' + joiner.join(conditions) + ')'
+
+    def or_(self, filters, reference_table=None):
+        """Add PostgREST alternatives such as 'code.ilike.*47*,display_name.ilike.*47*'"""
+        self.conditions.append(self._group(filters, ' OR '))
+        return self
+
+    # Modifiers
+
+    def order(self, column, *, desc=False, nullsfirst=None, foreign_table=None):
+        direction = ' DESC' if desc else ''
+        if nullsfirst is not None:
+            direction += ' NULLS FIRST' if nullsfirst else ' NULLS LAST'
+        self.orders.append(f't.{identifier(column)}{direction}')
+        return self
+
+    def limit(self, size, *, foreign_table=None):
+        self.limit_count = int(size)
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self.offset_count = int(start)
+        self.limit_count = int(end) - int(start) + 1
+        return self
+
+    # SQL
+
+    def _where(self):
+        return ' WHERE ' + ' AND '.join(self.conditions) if self.conditions else ''
+
+    def _select_list(self):
+        items = []
+        for part in split_top_level(self.columns):
+            if '(' in part:
+                name, _, inner = part.partition('(')
+                name = name.strip()
+                if (self.table_name, name) not in EMBEDS:
+                    raise ValueError(f'Unsupported embed {name} on {self.table_name}')
+                target, local, remote = EMBEDS[(self.table_name, name)]
+                columns = [column.strip() for column in inner.rstrip(')').split(',') if column.strip()]
+                fields = ', '.join(f"'{column}', e.{identifier(column)}" for column in columns)
+                items.append(f'(SELECT json_build_object({fields}) FROM {identifier(target)} e '
+                             f'WHERE e.{identifier(remote)} = t.{identifier(local)}) '
+                             f'AS {identifier(name.split("!")[0])}')
+            elif part == '*':
+                items.append('t.*')
+            else:
+                items.append(f't.{identifier(part)}')
+        return ', '.join(items)
+
+    def statements(self):
+        """Return [(sql, params)] run in order; the last one yields the rows as JSON"""
+        where = self._where()
+        if self.method == 'select':
+            sql = f'SELECT {self._select_list()} FROM {self.table} t{where}'
+            if self.orders:
+                sql += ' ORDER BY ' + ', '.join(self.orders)
+            if self.limit_count is not None:
+                sql += f' LIMIT {self.limit_count}'
+            if self.offset_count:
+                sql += f' OFFSET {self.offset_count}'
+            statements = []
+            if self.count:
+                statements.append((f'SELECT count(*) FROM {self.table} t{where}', list(self.params)))
+            if not self.head:
+                statements.append((f"SELECT coalesce(json_agg(q), '[]') FROM ({sql}) q", list(self.params)))
+            return statements
+
+        if self.method == 'insert':
+            columns = list(dict.fromkeys(column for row in self.body for column in row))
+            params, rows = [], []
+            for row in self.body:
+                values = []
+                for column in columns:
+                    if column in row:
+                        values.append('%s')
+                        params.append(sql_value(row[column]))
+                    else:
+                        values.append('DEFAULT')
+                rows.append(f'({", ".join(values)})')
+            sql = (f'INSERT INTO {self.table} AS t ({", ".join(identifier(c) for c in columns)}) '
+                   f'VALUES {", ".join(rows)}')
+            if self.on_conflict:
+                sql += f' ON CONFLICT ({", ".join(identifier(c) for c in self.on_conflict)}) '
+                updates = [c for c in columns if c not in self.on_conflict]
+                if updates and not self.ignore_duplicates:
+                    sql += 'DO UPDATE SET ' + ', '.join(f'{identifier(c)} = EXCLUDED.{identifier(c)}'
+                                                        for c in updates)
+                else:
+                    sql += 'DO NOTHING'
+        elif self.method == 'update':
+            assignments = ', '.join(f'{identifier(column)} = %s' for column in self.body)
+            sql = f'UPDATE {self.table} AS t SET {assignments}{where}'
+            params = [sql_value(value) for value in self.body.values()] + self.params
+        else:
+            sql = f'DELETE FROM {self.table} AS t{where}'
+            params = list(self.params)
+
+        if not self.returning:
+            return [(sql, params)]
+        return [(f"WITH q AS ({sql} RETURNING t.*) SELECT coalesce(json_agg(q), '[]') FROM q", params)]
+
+    def execute(self):
+        results = self.client.run(self.statements())
+        if self.method == 'select':
+            count = results[0] if self.count else None
+            return QueryResult([] if self.head else results[-1], count)
+        return QueryResult(results[-1] if self.returning else [])
+
+
+class PostgresRpc:
+    """A call of a set-returning database function, like supabase-py's rpc()"""
+
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = identifier(name)
+        self.params = params or {}
+
+    def statements(self):
+        arguments, params = [], []
+        for key, value in self.params.items():
+            # Objects and lists of them are json arguments; lists of scalars stay arrays
+            if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(v, dict) for v in value)):
+                arguments.append(f'{identifier(key)} => %s::json')
+                params.append(json.dumps(value))
+            else:
+                arguments.append(f'{identifier(key)} => %s')
+                params.append(value)
+        return [(f"SELECT coalesce(json_agg(r), '[]') FROM {self.name}({', '.join(arguments)}) r", params)]
+
+    def execute(self):
+        return QueryResult(self.client.run(self.statements())[-1])
+
+
+class PostgresClient:
+    """Stands in for a supabase Client, holding a pool of direct connections
+
+    pool_size connections are kept per process. Statements time out after
+    timeout seconds, which is also how long a request waits for a free
+    connection.
+    """
+
+    def __init__(self, dsn, pool_size=10, timeout=10):
+        import psycopg
+        from psycopg_pool import ConnectionPool
+
+        self._errors = psycopg.Error
+        statement_timeout = int(timeout * 1000)
+
+        def configure(conn):
+            conn.execute(f'SET statement_timeout = {statement_timeout}')
+
+        self.pool = ConnectionPool(dsn, min_size=1, max_size=pool_size, timeout=timeout, configure=configure,
+                                   kwargs={'autocommit': True, 'prepare_threshold': 0}, open=True)
+
+    def table(self, name):
+        return PostgresQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, name, params=None):
+        return PostgresRpc(self, name, params)
+
+    def run(self, statements):
+        """Run each (sql, params) on one pooled connection; returns their first values
+
+        Statements that return no rows, like writes with returning='minimal',
+        give None.
+        """
+        try:
+            with self.pool.connection() as conn:
+                return [first_value(conn.execute(sql, params)) for sql, params in statements]
+        except self._errors as e:
+            diag = getattr(e, 'diag', None)
+            raise APIError({
+                'message': (diag and diag.message_primary) or str(e),
+                'code': getattr(e, 'sqlstate', None),
+                'details': diag and diag.message_detail,
+                'hint': diag and diag.message_hint,
+            }) from e
+
+    def close(self):
+        self.pool.close()
@@ -51,7 +51,7 @@ CREATE TABLE IF NOT EXISTS user_stores (
 -- 4. Credits table (updated for item-based system)
 CREATE TABLE IF NOT EXISTS credits (
     id SERIAL PRIMARY KEY,
-    code TEXT UNIQUE NOT NULL,
+    code TEXT NOT NULL,
     items TEXT NOT NULL,
     reason TEXT NOT NULL,
     date_of_issue DATE NOT NULL DEFAULT CURRENT_DATE,
@@ -63,7 +63,8 @@ CREATE TABLE IF NOT EXISTS credits (
     claimed_by_user TEXT REFERENCES users(code),
     created_by TEXT REFERENCES users(code),
     customer_name TEXT,
-    customer_phone TEXT
+    customer_phone TEXT,
+    UNIQUE(store_id, code)
 );
 
 -- Migration: Add claimed_by_user column if not exists (for existing databases)
@@ -88,9 +89,429 @@ BEGIN
     END IF;
 END $$;
 
+-- Migration: Add client_ref column if not exists (for existing databases)
+-- Offline terminals tag each queued create with a client-generated id so a
+-- replayed batch can never create the same credit twice.
+DO $$ 
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                   WHERE table_name='credits' AND column_name='client_ref') THEN
+        ALTER TABLE credits ADD COLUMN client_ref TEXT;
+    END IF;
+END $$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_credits_client_ref ON credits(client_ref) WHERE client_ref IS NOT NULL;
+
+-- Migration: Make credit codes unique per store instead of across the chain
+-- (for existing databases). Codes that were unique across the chain are
+-- unique within each store, so existing rows always satisfy the new
+-- constraint; it is added before the old one is dropped so codes are never
+-- left unchecked. Partitioned credits tables (see partition_credits() below)
+-- enforce the same rule through credit_codes instead.
+DO $$ 
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'credits'::regclass) <> 'p'
+       AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                       WHERE conrelid = 'credits'::regclass AND conname = 'credits_store_id_code_key') THEN
+        ALTER TABLE credits ADD CONSTRAINT credits_store_id_code_key UNIQUE (store_id, code);
+    END IF;
+    ALTER TABLE credits DROP CONSTRAINT IF EXISTS credits_code_key;
+END $$;
+
 -- Create indexes for better query performance
-CREATE INDEX IF NOT EXISTS idx_credits_store_id ON credits(store_id);
-CREATE INDEX IF NOT EXISTS idx_credits_status ON credits(status);
-CREATE INDEX IF NOT EXISTS idx_credits_code ON credits(code);
-CREATE INDEX IF NOT EXISTS idx_user_stores_user_code ON user_stores(user_code);
+-- Each index below matches a query app.py actually issues. Lookups of a
+-- store's credit by code (claims, unclaims and code generation),
+-- users.code and stores.store_id are already served by the indexes behind
+-- their UNIQUE constraints, and user_stores(user_code) by the
+-- UNIQUE(user_code, store_id) index, so no separate indexes are kept for them.
+
+-- Migration: Drop single-column indexes superseded by the composite ones below
+DROP INDEX IF EXISTS idx_credits_store_id;
+DROP INDEX IF EXISTS idx_credits_status;
+DROP INDEX IF EXISTS idx_credits_code;
+DROP INDEX IF EXISTS idx_user_stores_user_code;
+-- Superseded by the UNIQUE(store_id, code) index
+DROP INDEX IF EXISTS idx_credits_store_active_code;
+-- Streamed dashboards page by (created_at, id) on idx_credits_store_created
+DROP INDEX IF EXISTS idx_credits_store_id_desc;
+
+-- dashboard(): WHERE store_id = ? ORDER BY created_at DESC, also paged by
+-- (created_at, id) with STREAM_RENDERING
+CREATE INDEX IF NOT EXISTS idx_credits_store_created ON credits(store_id, created_at DESC);
+
+-- admin_users_update() code changes and user deletes (FK checks) look up
+-- credits by creator and claimer
+CREATE INDEX IF NOT EXISTS idx_credits_created_by ON credits(created_by);
+CREATE INDEX IF NOT EXISTS idx_credits_claimed_by_user ON credits(claimed_by_user) WHERE claimed_by_user IS NOT NULL;
+
+-- Store deletes cascade through user_stores by store_id
 CREATE INDEX IF NOT EXISTS idx_user_stores_store_id ON user_stores(store_id);
+
+-- consolidated_dashboard(): credits across stores ORDER BY created_at DESC
+-- LIMIT/OFFSET; walking this index avoids sorting every credit in the chain
+CREATE INDEX IF NOT EXISTS idx_credits_created_at ON credits(created_at DESC);
+
+-- get_user_stores() for admins: ORDER BY name
+CREATE INDEX IF NOT EXISTS idx_stores_name ON stores(name);
+
+-- Paginated admin lists: ORDER BY created_at DESC LIMIT/OFFSET
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_stores_created_at ON stores(created_at DESC);
+
+-- Admin search and type-ahead lookups match '*term*' with ILIKE, which only
+-- trigram indexes can serve. pg_trgm ships with Supabase; skip it elsewhere.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_users_display_name_trgm ON users USING gin (display_name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_stores_name_trgm ON stores USING gin (name gin_trgm_ops);
+    END IF;
+END $$;
+
+-- 5. Daily reporting rollups
+-- One row per store, day and user, maintained incrementally by triggers on
+-- credits so reports never scan the credits table. "issued" counts credits
+-- created by the user on that day, "claimed" counts credits the user claimed
+-- on that day (an unclaim takes the claim back). user_code is '' for legacy
+-- credits without a creator or claimer. Legacy credits without a created_at
+-- are left out until partition_credits() dates them.
+CREATE TABLE IF NOT EXISTS credit_daily_rollups (
+    store_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    user_code TEXT NOT NULL DEFAULT '',
+    issued INTEGER NOT NULL DEFAULT 0,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, day, user_code)
+);
+
+-- admin_reports(): WHERE day BETWEEN ? AND ? across all stores
+CREATE INDEX IF NOT EXISTS idx_credit_daily_rollups_day ON credit_daily_rollups(day);
+
+CREATE OR REPLACE FUNCTION credit_rollup_add(p_store_id TEXT, p_day DATE, p_user_code TEXT,
+                                             p_issued INTEGER, p_claimed INTEGER)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO credit_daily_rollups (store_id, day, user_code, issued, claimed)
+    VALUES (p_store_id, p_day, COALESCE(p_user_code, ''), p_issued, p_claimed)
+    ON CONFLICT (store_id, day, user_code) DO UPDATE
+    SET issued = credit_daily_rollups.issued + EXCLUDED.issued,
+        claimed = credit_daily_rollups.claimed + EXCLUDED.claimed;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION credits_maintain_rollups()
+RETURNS trigger AS $$
+DECLARE
+    issue_changed BOOLEAN := TG_OP <> 'UPDATE'
+        OR (OLD.store_id, OLD.created_at, OLD.created_by)
+           IS DISTINCT FROM (NEW.store_id, NEW.created_at, NEW.created_by);
+    claim_changed BOOLEAN := TG_OP <> 'UPDATE'
+        OR (OLD.store_id, OLD.status, OLD.claimed_at, OLD.claimed_by_user, OLD.created_at)
+           IS DISTINCT FROM (NEW.store_id, NEW.status, NEW.claimed_at, NEW.claimed_by_user, NEW.created_at);
+BEGIN
+    -- Retract the old row's contribution, then add the new row's. Rows
+    -- without a created_at contribute nothing, either way.
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+        IF issue_changed THEN
+            PERFORM credit_rollup_add(OLD.store_id, (OLD.created_at AT TIME ZONE 'UTC')::date,
+                                      OLD.created_by, -1, 0);
+        END IF;
+        IF claim_changed AND OLD.status = 'claimed' THEN
+            PERFORM credit_rollup_add(OLD.store_id,
+                                      (COALESCE(OLD.claimed_at, OLD.created_at) AT TIME ZONE 'UTC')::date,
+                                      OLD.claimed_by_user, 0, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+        IF issue_changed THEN
+            PERFORM credit_rollup_add(NEW.store_id, (NEW.created_at AT TIME ZONE 'UTC')::date,
+                                      NEW.created_by, 1, 0);
+        END IF;
+        IF claim_changed AND NEW.status = 'claimed' THEN
+            PERFORM credit_rollup_add(NEW.store_id,
+                                      (COALESCE(NEW.claimed_at, NEW.created_at) AT TIME ZONE 'UTC')::date,
+                                      NEW.claimed_by_user, 0, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Migration: Backfill rollups from existing credits (first run only)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM credit_daily_rollups) THEN
+        INSERT INTO credit_daily_rollups (store_id, day, user_code, issued, claimed)
+        SELECT store_id, day, user_code, SUM(issued), SUM(claimed)
+        FROM (
+            SELECT store_id, (created_at AT TIME ZONE 'UTC')::date AS day,
+                   COALESCE(created_by, '') AS user_code, 1 AS issued, 0 AS claimed
+            FROM credits
+            WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT store_id, (COALESCE(claimed_at, created_at) AT TIME ZONE 'UTC')::date,
+                   COALESCE(claimed_by_user, ''), 0, 1
+            FROM credits
+            WHERE status = 'claimed' AND created_at IS NOT NULL
+        ) contributions
+        GROUP BY store_id, day, user_code;
+    END IF;
+END $$;
+
+DROP TRIGGER IF EXISTS credits_maintain_rollups ON credits;
+CREATE TRIGGER credits_maintain_rollups
+    AFTER INSERT OR UPDATE OR DELETE ON credits
+    FOR EACH ROW EXECUTE FUNCTION credits_maintain_rollups();
+
+-- consolidated_dashboard(): active and claimed counts for many stores in one
+-- aggregate over the rollups (issued minus claimed is what is still active).
+-- Pass NULL to count every store.
+CREATE OR REPLACE FUNCTION credit_store_counts(p_store_ids TEXT[] DEFAULT NULL)
+RETURNS TABLE (store_id TEXT, active BIGINT, claimed BIGINT) AS $$
+    SELECT r.store_id, SUM(r.issued - r.claimed), SUM(r.claimed)
+    FROM credit_daily_rollups r
+    WHERE p_store_ids IS NULL OR r.store_id = ANY(p_store_ids)
+    GROUP BY r.store_id
+$$ LANGUAGE sql STABLE;
+
+-- 6. Monthly partitions (optional)
+-- Run SELECT partition_credits(); once to turn credits into a table range
+-- partitioned by created_at month. Recent and active credits then sit in
+-- small partitions whose indexes stay cached, old months stop needing
+-- vacuum, and queries bounded by created_at only touch the months they
+-- name. Indexes declared on credits are created on every partition.
+--
+-- A partitioned table's unique indexes must include created_at, so the
+-- per-store code rule (and client_ref's) is enforced by credit_codes, kept
+-- in step by a trigger.
+CREATE OR REPLACE FUNCTION credit_partition_name(p_month TIMESTAMPTZ)
+RETURNS TEXT AS $$
+    SELECT 'credits_' || to_char(p_month AT TIME ZONE 'UTC', '"y"YYYY"m"MM')
+$$ LANGUAGE sql STABLE;
+
+-- Create the monthly partitions (UTC months) from p_from's month through
+-- p_months_ahead months after the current one. Does nothing unless credits
+-- is partitioned; already existing partitions are skipped.
+CREATE OR REPLACE FUNCTION create_credit_partitions(p_months_ahead INTEGER DEFAULT 3,
+                                                    p_from TIMESTAMPTZ DEFAULT now())
+RETURNS void AS $$
+DECLARE
+    v_month TIMESTAMPTZ := date_trunc('month', LEAST(p_from, now()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    v_last TIMESTAMPTZ := (date_trunc('month', now() AT TIME ZONE 'UTC')
+                           + make_interval(months => p_months_ahead)) AT TIME ZONE 'UTC';
+    v_next TIMESTAMPTZ;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('credits')) <> 'p' THEN
+        RETURN;
+    END IF;
+    WHILE v_month <= v_last LOOP
+        v_next := ((v_month AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+        IF to_regclass(credit_partition_name(v_month)) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF credits FOR VALUES FROM (%L) TO (%L)',
+                           credit_partition_name(v_month), v_month, v_next);
+        END IF;
+        v_month := v_next;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION credits_maintain_codes()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM credit_codes WHERE store_id = OLD.store_id AND code = OLD.code;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO credit_codes (store_id, code, client_ref) VALUES (NEW.store_id, NEW.code, NEW.client_ref);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Convert credits to a partitioned table, keeping its rows, ids, rollups and
+-- the indexes above. Partitioned credits always have a created_at, so rows
+-- without one are dated first. Takes an exclusive lock on credits and
+-- copies every row, so run it in a quiet period. Does nothing if credits is
+-- already partitioned.
+CREATE OR REPLACE FUNCTION partition_credits(p_months_ahead INTEGER DEFAULT 3)
+RETURNS void AS $$
+DECLARE
+    v_sequence TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('credits')) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE credits IN ACCESS EXCLUSIVE MODE;
+    -- Every row needs a created_at to have a partition. Legacy rows without
+    -- one are dated to the oldest credit and sort with it; the rollup
+    -- trigger starts counting them as they are dated.
+    UPDATE credits SET created_at = COALESCE((SELECT min(created_at) FROM credits), now())
+    WHERE created_at IS NULL;
+    v_sequence := pg_get_serial_sequence('credits', 'id');
+    ALTER TABLE credits RENAME TO credits_unpartitioned;
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', v_sequence);
+
+    -- Same columns in the same order, with their defaults and checks
+    CREATE TABLE credits (LIKE credits_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at);
+    ALTER TABLE credits ALTER COLUMN created_at SET NOT NULL;
+    PERFORM create_credit_partitions(p_months_ahead,
+                                     COALESCE((SELECT min(created_at) FROM credits_unpartitioned), now()));
+    INSERT INTO credits SELECT * FROM credits_unpartitioned;
+
+    CREATE TABLE IF NOT EXISTS credit_codes (
+        store_id TEXT NOT NULL,
+        code TEXT NOT NULL,
+        client_ref TEXT UNIQUE,
+        PRIMARY KEY (store_id, code)
+    );
+    TRUNCATE credit_codes;
+    INSERT INTO credit_codes (store_id, code, client_ref) SELECT store_id, code, client_ref FROM credits;
+
+    DROP TABLE credits_unpartitioned;
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY credits.id', v_sequence);
+
+    ALTER TABLE credits ADD CONSTRAINT credits_pkey PRIMARY KEY (id, created_at);
+    ALTER TABLE credits ADD CONSTRAINT credits_store_id_fkey
+        FOREIGN KEY (store_id) REFERENCES stores(store_id);
+    ALTER TABLE credits ADD CONSTRAINT credits_created_by_fkey
+        FOREIGN KEY (created_by) REFERENCES users(code);
+    ALTER TABLE credits ADD CONSTRAINT credits_claimed_by_user_fkey
+        FOREIGN KEY (claimed_by_user) REFERENCES users(code);
+
+    -- The indexes above, minus uniqueness that credit_codes now enforces
+    CREATE INDEX idx_credits_store_code ON credits(store_id, code);
+    CREATE INDEX idx_credits_client_ref ON credits(client_ref) WHERE client_ref IS NOT NULL;
+    CREATE INDEX idx_credits_store_created ON credits(store_id, created_at DESC);
+    CREATE INDEX idx_credits_created_by ON credits(created_by);
+    CREATE INDEX idx_credits_claimed_by_user ON credits(claimed_by_user) WHERE claimed_by_user IS NOT NULL;
+    CREATE INDEX idx_credits_created_at ON credits(created_at DESC);
+
+    CREATE TRIGGER credits_maintain_rollups
+        AFTER INSERT OR UPDATE OR DELETE ON credits
+        FOR EACH ROW EXECUTE FUNCTION credits_maintain_rollups();
+    CREATE TRIGGER credits_maintain_codes
+        AFTER INSERT OR DELETE OR UPDATE OF store_id, code, client_ref ON credits
+        FOR EACH ROW EXECUTE FUNCTION credits_maintain_codes();
+    CREATE TRIGGER credits_write_outbox
+        AFTER INSERT OR UPDATE OF status ON credits
+        FOR EACH ROW EXECUTE FUNCTION credits_write_outbox();
+
+    PERFORM maintain_credit_partitions();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep months ahead of the clock: on every run of this file and, where
+-- pg_cron is enabled (Supabase offers it as an extension), every night.
+-- Without either, inserts fail once the last partition's month is over.
+CREATE OR REPLACE FUNCTION maintain_credit_partitions()
+RETURNS void AS $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('credits')) <> 'p' THEN
+        RETURN;
+    END IF;
+    PERFORM create_credit_partitions();
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('create-credit-partitions', '0 3 * * *', 'SELECT create_credit_partitions()');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT maintain_credit_partitions();
+
+-- 7. Credit event outbox
+-- Every create, claim and unclaim adds an event to credit_outbox in the same
+-- transaction as the change, so an event exists exactly when its change
+-- committed and the cashier never waits on an outside system. outbox.py
+-- delivers events in id order to the HTTP sinks in OUTBOX_SINKS, recording
+-- how far each sink has got in credit_outbox_cursors, and deletes events
+-- every sink has received. payload is the credit as it was after the change.
+CREATE TABLE IF NOT EXISTS credit_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL CHECK (event_type IN ('create', 'claim', 'unclaim')),
+    store_id TEXT NOT NULL,
+    code TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS credit_outbox_cursors (
+    sink TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION credits_write_outbox()
+RETURNS trigger AS $$
+DECLARE
+    v_event_type TEXT;
+BEGIN
+    -- Credits written by restore_credits() are history, not news
+    IF current_setting('domcredsys.restoring', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        v_event_type := 'create';
+    ELSIF OLD.status = 'active' AND NEW.status = 'claimed' THEN
+        v_event_type := 'claim';
+    ELSIF OLD.status = 'claimed' AND NEW.status = 'active' THEN
+        v_event_type := 'unclaim';
+    ELSE
+        RETURN NULL;
+    END IF;
+    INSERT INTO credit_outbox (event_type, store_id, code, payload)
+    VALUES (v_event_type, NEW.store_id, NEW.code, json_build_object(
+        'code', NEW.code, 'store_id', NEW.store_id, 'status', NEW.status,
+        'items', NEW.items, 'reason', NEW.reason, 'date_of_issue', NEW.date_of_issue,
+        'customer_name', NEW.customer_name, 'customer_phone', NEW.customer_phone,
+        'created_by', NEW.created_by, 'created_at', NEW.created_at,
+        'claimed_at', NEW.claimed_at, 'claimed_by', NEW.claimed_by,
+        'claimed_by_user', NEW.claimed_by_user
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS credits_write_outbox ON credits;
+CREATE TRIGGER credits_write_outbox
+    AFTER INSERT OR UPDATE OF status ON credits
+    FOR EACH ROW EXECUTE FUNCTION credits_write_outbox();
+
+-- 8. Restores
+-- backup.py restores credits through restore_credits(), one batch of
+-- archived rows per call. Rows are upserted on (store_id, code); partitioned
+-- credits have no such index, so there the rows whose code the store already
+-- has are skipped, after the months they fall in have been partitioned.
+-- Unless p_emit_events, the outbox records no events for them.
+CREATE OR REPLACE FUNCTION restore_credits(p_rows JSON, p_emit_events BOOLEAN DEFAULT FALSE)
+RETURNS void AS $$
+BEGIN
+    PERFORM set_config('domcredsys.restoring', CASE WHEN p_emit_events THEN 'off' ELSE 'on' END, true);
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('credits')) = 'p' THEN
+        PERFORM create_credit_partitions(3, (SELECT min((r->>'created_at')::timestamptz)
+                                             FROM json_array_elements(p_rows) r));
+        INSERT INTO credits (code, items, reason, date_of_issue, store_id, status, created_at, claimed_at,
+                             claimed_by, claimed_by_user, created_by, customer_name, customer_phone, client_ref)
+        SELECT code, items, reason, date_of_issue, store_id, status, created_at, claimed_at,
+               claimed_by, claimed_by_user, created_by, customer_name, customer_phone, client_ref
+        FROM json_populate_recordset(NULL::credits, p_rows) r
+        WHERE NOT EXISTS (SELECT 1 FROM credit_codes c WHERE c.store_id = r.store_id AND c.code = r.code);
+    ELSE
+        INSERT INTO credits (code, items, reason, date_of_issue, store_id, status, created_at, claimed_at,
+                             claimed_by, claimed_by_user, created_by, customer_name, customer_phone, client_ref)
+        SELECT code, items, reason, date_of_issue, store_id, status, created_at, claimed_at,
+               claimed_by, claimed_by_user, created_by, customer_name, customer_phone, client_ref
+        FROM json_populate_recordset(NULL::credits, p_rows)
+        ON CONFLICT (store_id, code) DO UPDATE SET
+            items = EXCLUDED.items, reason = EXCLUDED.reason, date_of_issue = EXCLUDED.date_of_issue,
+            status = EXCLUDED.status, created_at = EXCLUDED.created_at, claimed_at = EXCLUDED.claimed_at,
+            claimed_by = EXCLUDED.claimed_by, claimed_by_user = EXCLUDED.claimed_by_user,
+            created_by = EXCLUDED.created_by, customer_name = EXCLUDED.customer_name,
+            customer_phone = EXCLUDED.customer_phone, client_ref = EXCLUDED.client_ref;
+    END IF;
+    PERFORM set_config('domcredsys.restoring', 'off', true);
+END;
+$$ LANGUAGE plpgsql;
@@ -11,8 +11,9 @@ document.addEventListener('DOMContentLoaded', function() {
         themeToggle.addEventListener('click', toggleTheme);
     }
     
-    // Initialize filter state
-    let currentFilter = 'all';
+    // Keep only the tiles near the viewport in the DOM
+    const creditsGrid = document.querySelector('.credits-grid');
+    const creditGrid = creditsGrid ? new VirtualCreditGrid(creditsGrid) : null;
     
     // Attach filter toggle event listeners
     document.querySelectorAll('.filter-toggle-btn').forEach(button => {
@@ -22,21 +23,23 @@ document.addEventListener('DOMContentLoaded', function() {
             this.classList.add('active');
             
             // Update filter and apply
-            currentFilter = this.dataset.filter;
-            filterCredits();
+            if (creditGrid) creditGrid.setFilter(this.dataset.filter);
         });
     });
     
-    // Attach search event listener
+    // Attach search event listener, debounced so a burst of keystrokes filters once
     const searchInput = document.getElementById('credit-search');
-    if (searchInput) {
-        searchInput.addEventListener('input', filterCredits);
+    if (searchInput && creditGrid) {
+        let searchTimer = null;
+        searchInput.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => creditGrid.setQuery(searchInput.value), 150);
+        });
     }
     
     // Add swipe gesture support for filter toggle
     let touchStartX = 0;
     let touchEndX = 0;
-    const creditsGrid = document.querySelector('.credits-grid');
     
     if (creditsGrid) {
         creditsGrid.addEventListener('touchstart', function(e) {
@@ -71,62 +74,15 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Modified filterCredits function to respect current filter
-    function filterCredits() {
-        const query = (document.getElementById('credit-search')?.value || '').toLowerCase().trim();
-        const tiles = document.querySelectorAll('.credit-tile');
-        const noResults = document.getElementById('no-results');
-        let visibleCount = 0;
-        
-        tiles.forEach(tile => {
-            const code = tile.dataset.code.toLowerCase();
-            const customerPhone = (tile.dataset.customerPhone || '').toLowerCase();
-            const customerName = (tile.dataset.customerName || '').toLowerCase();
-            const status = tile.dataset.status;
-            
-            // Check if matches search query
-            const matchesSearch = !query || code.includes(query) || customerPhone.includes(query) || customerName.includes(query);
-            
-            // Check if matches current filter
-            const matchesFilter = currentFilter === 'all' || status === currentFilter;
-            
-            // Show tile only if it matches both search and filter
-            if (matchesSearch && matchesFilter) {
-                tile.style.display = 'flex';
-                visibleCount++;
-            } else {
-                tile.style.display = 'none';
-            }
-        });
-        
-        // Show/hide no results message
-        if (noResults) {
-            noResults.style.display = visibleCount === 0 ? 'block' : 'none';
-        }
+    // One listener on the grid handles every claim and unclaim button
+    if (creditsGrid) {
+        creditsGrid.addEventListener('click', handleTileButton);
     }
     
-    // Attach claim button event listeners
-    document.querySelectorAll('.btn-claim').forEach(button => {
-        button.addEventListener('click', function() {
-            const tile = this.closest('.credit-tile');
-            const code = tile.dataset.code;
-            const customerName = tile.dataset.customerName || 'this customer';
-            if (confirm(`Claim credit ${code} for ${customerName}?`)) {
-                submitClaim(code);
-            }
-        });
-    });
-    
-    // Attach unclaim button event listeners
-    document.querySelectorAll('.btn-unclaim').forEach(button => {
-        button.addEventListener('click', function() {
-            const tile = this.closest('.credit-tile');
-            const code = tile.dataset.code;
-            if (confirm(`Are you sure you want to unclaim credit ${code}?`)) {
-                submitUnclaim(code);
-            }
-        });
-    });
+    // Apply credit changes made on other terminals as they happen
+    if (creditGrid && creditsGrid.dataset.eventsUrl && 'EventSource' in window) {
+        subscribeToCreditEvents(creditGrid);
+    }
     
     // Attach item input Enter key listener
     const itemInput = document.getElementById('item-input');
@@ -139,6 +95,9 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Attach type-ahead lookups (item names and admin user and store pickers)
+    document.querySelectorAll('input[data-lookup-url]').forEach(attachLookup);
+    
     // Form submit validation
     const createCreditForm = document.getElementById('create-credit-form');
     if (createCreditForm) {
@@ -148,6 +107,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 alert('Please add at least one item');
                 return false;
             }
+            
+            // Offline: queue the credit for replay instead of posting it
+            if (typeof isTerminalOffline === 'function' && isTerminalOffline()) {
+                e.preventDefault();
+                queueCreate(createCreditForm);
+                return;
+            }
+            
+            // Resubmits carry the same idempotency key, but don't invite them
+            createCreditForm.querySelector('button[type="submit"]').disabled = true;
         });
     }
 });
@@ -195,6 +164,34 @@ function escapeHtml(text) {
     return text.replace(/[&<>"']/g, m => map[m]);
 }
 
+// Type-ahead lookup: fills the input's datalist from a JSON endpoint
+// returning [{value, label}], debounced so only the last keystroke queries
+function attachLookup(input) {
+    const datalist = document.getElementById(input.getAttribute('list'));
+    let timer = null;
+    let lastQuery = null;
+    
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            const query = input.value.trim();
+            if (query === lastQuery) return;
+            lastQuery = query;
+            
+            fetch(`${input.dataset.lookupUrl}?q=${encodeURIComponent(query)}`, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : [])
+                .then(options => {
+                    // Ignore responses for queries the user has typed past
+                    if (query !== lastQuery || !datalist) return;
+                    datalist.innerHTML = options.map(option =>
+                        `<option value="${escapeHtml(option.value)}">${escapeHtml(option.label)}</option>`
+                    ).join('');
+                })
+                .catch(() => {});
+        }, 200);
+    });
+}
+
 function toggleTheme() {
     const currentTheme = document.documentElement.getAttribute('data-theme');
     const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
@@ -210,6 +207,266 @@ function updateThemeIcon(theme) {
     }
 }
 
+function handleTileButton(e) {
+    const button = e.target.closest('.btn-claim, .btn-unclaim');
+    if (!button) return;
+    const tile = button.closest('.credit-tile');
+    const code = tile.dataset.code;
+    
+    if (button.classList.contains('btn-claim')) {
+        const customerName = tile.dataset.customerName || 'this customer';
+        if (confirm(`Claim credit ${code} for ${customerName}?`)) {
+            if (typeof isTerminalOffline === 'function' && isTerminalOffline()) {
+                queueClaim(tile);
+            } else {
+                submitClaim(code);
+            }
+        }
+    } else if (confirm(`Are you sure you want to unclaim credit ${code}?`)) {
+        submitUnclaim(code);
+    }
+}
+
+// Virtualised credit grid - the server renders every tile, then they are
+// detached and only the rows around the viewport are put back. The grid's
+// padding stands in for the rows above and below, so the page scrolls as
+// if every tile were present. Rows share the height of the tallest tile
+// seen so far, which keeps row positions computable from the scroll offset.
+class VirtualCreditGrid {
+    constructor(grid) {
+        this.grid = grid;
+        this.records = Array.from(grid.querySelectorAll('.credit-tile'), tile => this.record(tile));
+        this.byCode = new Map(this.records.map(record => [record.code, record]));
+        this.visible = this.records;
+        this.filter = 'all';
+        this.query = '';
+        this.rowHeight = 0;
+        this.columns = 1;
+        this.range = null;
+        this.frame = null;
+        this.noResults = document.getElementById('no-results');
+        
+        grid.replaceChildren();
+        this.measure();
+        window.addEventListener('scroll', () => this.schedule(), { passive: true });
+        window.addEventListener('resize', () => this.schedule(true));
+    }
+    
+    // Search text is lowercased once here, not on every keystroke
+    record(tile) {
+        return {
+            tile: tile,
+            code: tile.dataset.code,
+            status: tile.dataset.status,
+            search: [tile.dataset.code, tile.dataset.customerPhone || '', tile.dataset.customerName || '']
+                .join('\n').toLowerCase()
+        };
+    }
+    
+    find(code) {
+        return this.byCode.get(code);
+    }
+    
+    prepend(tile) {
+        const record = this.record(tile);
+        this.records.unshift(record);
+        this.byCode.set(record.code, record);
+        this.refilter();
+    }
+    
+    setStatus(record, status) {
+        record.status = status;
+        this.refilter();
+    }
+    
+    setFilter(filter) {
+        this.filter = filter;
+        this.refilter();
+    }
+    
+    setQuery(query) {
+        this.query = query.toLowerCase().trim();
+        this.refilter();
+    }
+    
+    refilter() {
+        const { filter, query } = this;
+        this.visible = this.records.filter(record =>
+            (filter === 'all' || record.status === filter) && (!query || record.search.includes(query)));
+        if (this.noResults) {
+            this.noResults.style.display = this.visible.length === 0 ? 'block' : 'none';
+        }
+        this.range = null;
+        this.render();
+    }
+    
+    schedule(remeasure) {
+        if (remeasure) this.range = null;
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            if (this.range === null) {
+                this.measure();
+            } else {
+                this.render();
+            }
+        });
+    }
+    
+    measure() {
+        this.columns = getComputedStyle(this.grid).gridTemplateColumns.split(' ').length || 1;
+        this.range = null;
+        this.render();
+    }
+    
+    render() {
+        const gap = parseFloat(getComputedStyle(this.grid).rowGap) || 0;
+        const rows = Math.ceil(this.visible.length / this.columns);
+        // Until a row has been measured, render one screen's worth
+        const stride = (this.rowHeight || 200) + gap;
+        const overscan = 2;
+        const offset = Math.max(0, -this.grid.getBoundingClientRect().top);
+        const first = Math.max(0, Math.min(rows, Math.floor(offset / stride) - overscan));
+        const last = Math.min(rows, Math.ceil((offset + window.innerHeight) / stride) + overscan);
+        
+        if (this.range && this.range[0] === first && this.range[1] === last) return;
+        this.range = [first, last];
+        
+        this.grid.replaceChildren(...this.visible
+            .slice(first * this.columns, last * this.columns)
+            .map(record => record.tile));
+        this.grid.style.paddingTop = `${first * stride}px`;
+        this.grid.style.paddingBottom = `${Math.max(0, rows - last) * stride}px`;
+        
+        let tallest = this.rowHeight;
+        for (const tile of this.grid.children) {
+            tallest = Math.max(tallest, tile.offsetHeight);
+        }
+        if (tallest > this.rowHeight) {
+            this.rowHeight = tallest;
+            this.grid.style.gridAutoRows = `${tallest}px`;
+            this.range = null;
+            this.render();
+        }
+    }
+}
+
+// Live updates - the server pushes create/claim/unclaim events for the
+// selected store over /events and tiles are patched in place
+function subscribeToCreditEvents(creditGrid) {
+    const grid = creditGrid.grid;
+    const source = new EventSource(grid.dataset.eventsUrl);
+    
+    source.onmessage = function(message) {
+        const event = JSON.parse(message.data);
+        const record = creditGrid.find(event.code);
+        
+        if (event.type === 'create' && !record) {
+            creditGrid.prepend(renderCreditTile(event.credit));
+        } else if (event.type === 'claim' && record) {
+            setTileStatus(grid, record.tile, 'claimed', event);
+            creditGrid.setStatus(record, 'claimed');
+        } else if (event.type === 'unclaim' && record) {
+            setTileStatus(grid, record.tile, 'active', event);
+            creditGrid.setStatus(record, 'active');
+        }
+    };
+    
+    // The server dropped us for falling behind; reload to catch up
+    source.addEventListener('evicted', function() {
+        source.close();
+        window.location.reload();
+    });
+}
+
+function renderCreditTile(credit) {
+    const tile = document.createElement('div');
+    tile.className = 'credit-tile';
+    tile.dataset.status = credit.status;
+    tile.dataset.code = credit.code;
+    tile.dataset.customerPhone = credit.customer_phone || '';
+    tile.dataset.customerName = credit.customer_name || '';
+    tile.innerHTML = `
+        <div class="tile-header">
+            <span class="credit-code">${escapeHtml(credit.code)}</span>
+            <span class="status-badge ${credit.status}">${credit.status.toUpperCase()}</span>
+        </div>
+        <div class="tile-body">
+            <p><strong>Items:</strong> ${escapeHtml(credit.items_display || '')}</p>
+            <p><strong>Reason:</strong> ${escapeHtml(credit.reason || '')}</p>
+            <p><strong>Date:</strong> ${escapeHtml(credit.date_of_issue || '')}</p>
+            <p><strong>Customer Name:</strong> ${escapeHtml(credit.customer_name || '-')}</p>
+            <p><strong>Customer Phone:</strong> ${escapeHtml(credit.customer_phone || '-')}</p>
+            <p><strong>Created By:</strong> ${escapeHtml(credit.creator_display_name || '-')}</p>
+        </div>
+        <div class="tile-footer">
+            <button class="btn-claim">Claim</button>
+        </div>`;
+    return tile;
+}
+
+// Tiles may be detached from the grid, so it is passed in
+function setTileStatus(grid, tile, status, event) {
+    tile.dataset.status = status;
+    
+    const badge = tile.querySelector('.status-badge');
+    badge.className = `status-badge ${status}`;
+    badge.textContent = status.toUpperCase();
+    
+    const body = tile.querySelector('.tile-body');
+    body.querySelectorAll('.claim-detail').forEach(row => row.remove());
+    const existingFooter = tile.querySelector('.tile-footer');
+    if (existingFooter) existingFooter.remove();
+    
+    let button = '';
+    if (status === 'claimed') {
+        const createdBy = body.lastElementChild;
+        createdBy.insertAdjacentHTML('beforebegin', `
+            <p class="claim-detail"><strong>Claimed By:</strong> ${escapeHtml(event.claimed_by || '-')}</p>
+            <p class="claim-detail"><strong>Claimed At:</strong> ${escapeHtml((event.claimed_at || '-').slice(0, 19))}</p>`);
+        if (event.claimed_by_user === grid.dataset.userCode || grid.dataset.isAdmin === 'true') {
+            button = '<button class="btn-unclaim">Unclaim</button>';
+        }
+    } else {
+        button = '<button class="btn-claim">Claim</button>';
+    }
+    
+    if (button) {
+        tile.insertAdjacentHTML('beforeend', `<div class="tile-footer">${button}</div>`);
+    }
+}
+
+// Offline queueing - see offline.js
+function queueClaim(tile) {
+    const grid = tile.closest('.credits-grid');
+    queueOfflineAction({
+        type: 'claim',
+        store_id: grid.dataset.storeId,
+        code: tile.dataset.code
+    }).then(() => {
+        const badge = tile.querySelector('.status-badge');
+        if (badge) badge.textContent = 'CLAIM QUEUED';
+        const footer = tile.querySelector('.tile-footer');
+        if (footer) footer.remove();
+    }).catch(() => alert('Could not queue the claim while offline'));
+}
+
+function queueCreate(form) {
+    const action = { type: 'create', store_id: form.dataset.storeId };
+    new FormData(form).forEach((value, key) => { action[key] = value; });
+    // Keep the offline day as the issue date rather than the replay day
+    if (!action.date_of_issue) {
+        const now = new Date();
+        action.date_of_issue = new Date(now.getTime() - now.getTimezoneOffset() * 60000).toISOString().slice(0, 10);
+    }
+    queueOfflineAction(action).then(() => {
+        form.reset();
+        items = [];
+        renderItems();
+        alert('You are offline. The credit has been queued and its code will be issued when the connection returns.');
+    }).catch(() => alert('Could not queue the credit while offline'));
+}
+
 // Submit Claim - uses customer details stored at credit creation
 function submitClaim(code) {
     // Get claim URL from data attribute
@@ -226,7 +483,14 @@ function submitClaim(code) {
     codeInput.name = 'code';
     codeInput.value = code;
     
+    // Repeat claims of this code from this page load are recognised as one
+    const keyInput = document.createElement('input');
+    keyInput.type = 'hidden';
+    keyInput.name = 'idempotency_key';
+    keyInput.value = creditsGrid ? creditsGrid.dataset.idempotencyKey || '' : '';
+    
     form.appendChild(codeInput);
+    form.appendChild(keyInput);
     document.body.appendChild(form);
     form.submit();
 }
@@ -0,0 +1,147 @@
+// Offline support for store terminals
+// Registers the service worker and keeps an IndexedDB outbox of claim and
+// create actions made while offline. When the terminal reconnects the whole
+// outbox is replayed in one /api/sync batch; every action carries the id it
+// was queued with, so the server can recognise and skip replays, and the user
+// who queued it, so on a shared terminal it is only sent under their login.
+
+const OFFLINE_DB_NAME = 'domcredsys-outbox';
+const OFFLINE_STORE_NAME = 'actions';
+let outboxFlushing = false;
+
+function openOutbox() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(OFFLINE_DB_NAME, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(OFFLINE_STORE_NAME, { keyPath: 'id' });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function outboxTransaction(mode, work) {
+    return openOutbox().then(db => new Promise((resolve, reject) => {
+        const tx = db.transaction(OFFLINE_STORE_NAME, mode);
+        const result = work(tx.objectStore(OFFLINE_STORE_NAME));
+        tx.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+        tx.onerror = () => reject(tx.error);
+    }));
+}
+
+function queueOfflineAction(action) {
+    action.id = action.id || crypto.randomUUID();
+    action.queued_at = new Date().toISOString();
+    action.user_code = document.body.dataset.userCode;
+    return outboxTransaction('readwrite', store => store.put(action))
+        .then(() => {
+            updateOfflineBanner();
+            return action;
+        });
+}
+
+function readOutbox() {
+    return outboxTransaction('readonly', store => store.getAll());
+}
+
+// Actions the signed-in user queued. Untagged actions from before actions
+// recorded their user are included so the server can turn them down.
+function readOwnOutbox() {
+    const userCode = document.body.dataset.userCode;
+    return readOutbox().then(actions => actions.filter(action => !action.user_code || action.user_code === userCode));
+}
+
+function removeFromOutbox(ids) {
+    return outboxTransaction('readwrite', store => ids.forEach(id => store.delete(id)));
+}
+
+function isTerminalOffline() {
+    return !navigator.onLine;
+}
+
+function updateOfflineBanner() {
+    const banner = document.getElementById('offline-banner');
+    if (!banner || !('indexedDB' in window)) return;
+
+    readOwnOutbox().then(actions => {
+        const queued = actions.length;
+        if (isTerminalOffline()) {
+            banner.textContent = `Offline - showing the last saved dashboard. ${queued} action(s) queued and will be sent when the connection returns.`;
+            banner.style.display = 'block';
+        } else if (queued) {
+            banner.textContent = `Sending ${queued} queued action(s)...`;
+            banner.style.display = 'block';
+        } else {
+            banner.style.display = 'none';
+        }
+    }).catch(() => {});
+}
+
+// Replay every queued action in one batch. Actions the server applied,
+// recognised as replays or rejected for good are removed; actions that hit
+// a transient error stay queued for the next attempt.
+function flushOutbox() {
+    const syncUrl = document.body.dataset.syncUrl;
+    if (!syncUrl || outboxFlushing || isTerminalOffline() || !('indexedDB' in window)) {
+        return Promise.resolve();
+    }
+    outboxFlushing = true;
+
+    return readOwnOutbox()
+        .then(actions => {
+            if (!actions.length) return null;
+            return fetch(syncUrl, {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ actions: actions })
+            }).then(response => {
+                // A redirect means the session expired; keep everything queued
+                if (!response.ok || response.redirected) return null;
+                return response.json();
+            });
+        })
+        .then(payload => {
+            if (!payload || !payload.results) return;
+            const done = payload.results.filter(result => result.status !== 'retry');
+            const failed = done.filter(result => result.status === 'error');
+            return removeFromOutbox(done.map(result => result.id)).then(() => {
+                if (failed.length) {
+                    alert('Some queued actions could not be applied:\n' +
+                          failed.map(result => result.message).join('\n'));
+                }
+                if (done.length && window.location.pathname === '/dashboard') {
+                    window.location.reload();
+                }
+            });
+        })
+        .catch(() => {})
+        .finally(() => {
+            outboxFlushing = false;
+            updateOfflineBanner();
+        });
+}
+
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', function() {
+        navigator.serviceWorker.register('/sw.js').catch(() => {});
+    });
+}
+
+// Send this user's queued actions before logging out; anything left waits
+// for them to log in again on this terminal
+document.addEventListener('click', function(event) {
+    const link = event.target.closest('a[href="/logout"]');
+    if (!link || isTerminalOffline() || !('indexedDB' in window)) return;
+    event.preventDefault();
+    flushOutbox().finally(() => {
+        window.location.href = link.href;
+    });
+});
+
+window.addEventListener('online', flushOutbox);
+window.addEventListener('offline', updateOfflineBanner);
+document.addEventListener('DOMContentLoaded', function() {
+    updateOfflineBanner();
+    flushOutbox();
+});
@@ -0,0 +1,86 @@
+// Service worker for store terminals
+// Caches the app shell and the last dashboard snapshot so the dashboard
+// still opens when the terminal loses its connection. Queued claim/create
+// actions are kept by offline.js and replayed through /api/sync.
+
+const SHELL_CACHE = 'domcredsys-shell-v1';
+const SNAPSHOT_CACHE = 'domcredsys-snapshot-v1';
+const SNAPSHOT_URL = '/dashboard';
+const APP_SHELL = [
+    '/static/css/style.css',
+    '/static/js/main.js',
+    '/static/js/offline.js'
+];
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(APP_SHELL))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', function(event) {
+    const current = [SHELL_CACHE, SNAPSHOT_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => !current.includes(name)).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+
+    // Never keep another user's snapshot around after logging out
+    if (url.pathname === '/logout') {
+        event.respondWith(
+            caches.delete(SNAPSHOT_CACHE).then(() => fetch(request))
+        );
+        return;
+    }
+
+    // Dashboard: network first, falling back to the last good snapshot
+    if (url.pathname === SNAPSHOT_URL) {
+        event.respondWith(
+            fetch(request)
+                .then(response => {
+                    // Redirects mean the session is gone; don't cache the login page
+                    if (response.ok && !response.redirected) {
+                        const copy = response.clone();
+                        caches.open(SNAPSHOT_CACHE).then(cache => cache.put(SNAPSHOT_URL, copy));
+                    }
+                    return response;
+                })
+                .catch(() => caches.match(SNAPSHOT_URL, { cacheName: SNAPSHOT_CACHE })
+                    .then(cached => cached || Response.error()))
+        );
+        return;
+    }
+
+    // App shell: serve from cache, refreshing it in the background
+    if (url.pathname.startsWith('/static/')) {
+        event.respondWith(
+            caches.open(SHELL_CACHE).then(cache =>
+                cache.match(request).then(cached => {
+                    const network = fetch(request)
+                        .then(response => {
+                            if (response.ok) {
+                                cache.put(request, response.clone());
+                            }
+                            return response;
+                        })
+                        .catch(() => cached);
+                    return cached || network;
+                })
+            )
+        );
+    }
+});
@@ -4,10 +4,23 @@ Tests for claim/unclaim credit functionality
 """
 
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, call
 from datetime import datetime, timezone
 import sys
 import os
+import gzip
+import io
+import json
+import pickle
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
 
 # Add the parent directory to the path to import app
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -20,6 +33,69 @@ os.environ['SECRET_KEY'] = 'test-secret-key'
 # Mock supabase before importing app
 with patch('app.create_client'):
     from app import app
+    import app as app_module
+
+from supabase import create_client
+from postgrest.exceptions import APIError
+from localbackend import LocalBackend
+import backup
+import outbox
+import pgbackend
+
+
+class RecordingQuery:
+    """Chainable stand-in for a PostgREST query builder
+
+    Every builder method returns the query itself; select() records the
+    requested columns and execute() records the round trip and returns the
+    client's canned rows for the table.
+    """
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+
+    def select(self, *columns, **kwargs):
+        self.client.selects.append((self.table, ', '.join(columns)))
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.client.executed.append(self.table)
+        result = Mock()
+        result.data = [dict(row) for row in self.client.rows.get(self.table, [])]
+        result.count = len(result.data)
+        return result
+
+
+class RecordingClient:
+    """Stand-in Supabase client that records every query the app makes"""
+
+    def __init__(self, rows=None):
+        self.rows = {
+            'users': [{'code': '4757', 'display_name': 'Admin', 'is_admin': True,
+                       'created_at': '2026-01-01T00:00:00+00:00'}],
+            'stores': [{'store_id': 'STORE1', 'name': 'Main', 'created_at': '2026-01-01T00:00:00+00:00'}],
+            'user_stores': [{'id': 1, 'user_code': '4757', 'store_id': 'STORE1',
+                             'users': {'display_name': 'Admin'},
+                             'stores': {'store_id': 'STORE1', 'name': 'Main'}}],
+            'credits': [{'code': 'ABC', 'status': 'active', 'items': '["Item"]', 'reason': 'Test',
+                         'date_of_issue': '2026-01-01', 'customer_name': 'John Doe',
+                         'customer_phone': '555-1234', 'claimed_at': None, 'claimed_by': None,
+                         'claimed_by_user': '4757', 'created_by': '4757',
+                         'users': {'display_name': 'Admin'}}],
+        }
+        self.rows.update(rows or {})
+        self.selects = []
+        self.executed = []
+
+    def table(self, name):
+        return RecordingQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return RecordingQuery(self, f'rpc:{name}')
 
 
 class TestClaimCredit(unittest.TestCase):
@@ -56,7 +132,7 @@ class TestClaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/claim-credit', data={
@@ -117,7 +193,7 @@ class TestClaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/claim-credit', data={
@@ -235,7 +311,7 @@ class TestUnclaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/unclaim-credit', data={
@@ -264,7 +340,7 @@ class TestUnclaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/unclaim-credit', data={
@@ -351,7 +427,7 @@ class TestUnclaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/unclaim-credit', data={
@@ -425,7 +501,7 @@ class TestUnclaimCredit(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/unclaim-credit', data={
@@ -572,7 +648,7 @@ class TestClaimCreditNoCustomerInput(unittest.TestCase):
         
         mock_table = Mock()
         mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
-        mock_table.update.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_update_result
         mock_supabase.table.return_value = mock_table
         
         response = self.client.post('/claim-credit', data={
@@ -597,6 +673,12 @@ class TestSessionValidation(unittest.TestCase):
         self.app.config['SECRET_KEY'] = 'test-secret-key'
         self.app.config['WTF_CSRF_ENABLED'] = False
         self.client = self.app.test_client()
+        
+        # No cached dashboards to fall back on
+        patcher = patch('app.dashboard_cache', app_module.StaleWhileRevalidateCache(
+            app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(2)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _create_session(self, user_code='1234', display_name='Test User', is_admin=False, selected_store='STORE1'):
         """Helper to create a session"""
@@ -953,5 +1035,2728 @@ class TestEditUser(unittest.TestCase):
         self.assertIn(response.status_code, [302, 403])
 
 
+class TestCreditCodeFormat(unittest.TestCase):
+    """Test cases for checked credit codes and local code validation"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+
+    def _create_session(self, user_code='1234', display_name='Test User', is_admin=False, selected_store='STORE1'):
+        """Helper to create a session"""
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = user_code
+            sess['display_name'] = display_name
+            sess['is_admin'] = is_admin
+            sess['selected_store'] = selected_store
+
+    def _checked_code(self, body='K7Q2M'):
+        """Helper to build a checked code from a 5-character body"""
+        return body + app_module.code_check_character(body)
+
+    def test_legacy_codes_are_valid(self):
+        """Test that 3-character legacy codes are still accepted"""
+        self.assertTrue(app_module.is_valid_credit_code('ABC'))
+        self.assertTrue(app_module.is_valid_credit_code('7Z0'))
+
+    def test_checked_code_is_valid(self):
+        """Test that a code with a matching check character is accepted"""
+        self.assertTrue(app_module.is_valid_credit_code(self._checked_code()))
+
+    def test_single_character_typos_are_rejected(self):
+        """Test that every single-character substitution is caught"""
+        code = self._checked_code()
+        for position in range(len(code)):
+            for char in app_module.CODE_ALPHABET:
+                if char == code[position]:
+                    continue
+                typo = code[:position] + char + code[position + 1:]
+                self.assertFalse(app_module.is_valid_credit_code(typo), typo)
+
+    def test_adjacent_transposition_is_rejected(self):
+        """Test that swapping two adjacent characters is caught"""
+        code = self._checked_code()
+        swapped = code[1] + code[0] + code[2:]
+        self.assertFalse(app_module.is_valid_credit_code(swapped))
+
+    def test_malformed_codes_are_rejected(self):
+        """Test that wrong lengths and characters outside the alphabet are rejected"""
+        for code in ['', 'AB', 'ABCD', 'AB-', 'abc', 'ABCDEFG']:
+            self.assertFalse(app_module.is_valid_credit_code(code), code)
+
+    @patch('app.supabase')
+    def test_generate_checked_code(self, mock_supabase):
+        """Test that the checked format generates valid 6-character codes"""
+        mock_result = Mock()
+        mock_result.data = []
+        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value \
+            .execute.return_value = mock_result
+
+        with patch.object(app_module, 'CREDIT_CODE_FORMAT', 'checked'):
+            code = app_module.generate_code('STORE1')
+
+        self.assertEqual(len(code), app_module.CHECKED_CODE_LENGTH)
+        self.assertTrue(app_module.is_valid_credit_code(code))
+
+    @patch('app.supabase')
+    def test_claim_typo_skips_database(self, mock_supabase):
+        """Test that a mistyped code is rejected without querying credits"""
+        self._create_session()
+        code = self._checked_code()
+        typo = code[:-1] + ('A' if code[-1] != 'A' else 'B')
+
+        mock_user_result = Mock()
+        mock_user_result.data = [{'code': '1234'}]
+        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value = mock_user_result
+
+        response = self.client.post('/claim-credit', data={'code': typo}, follow_redirects=False)
+
+        self.assertEqual(response.status_code, 302)
+        queried_tables = [c.args[0] for c in mock_supabase.table.call_args_list]
+        self.assertNotIn('credits', queried_tables)
+
+    @patch('app.supabase')
+    def test_claim_checked_code_queries_database(self, mock_supabase):
+        """Test that a valid checked code goes on to the claim lookup"""
+        self._create_session()
+        code = self._checked_code()
+
+        mock_select_result = Mock()
+        mock_select_result.data = []
+        mock_table = Mock()
+        mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = mock_select_result
+        mock_supabase.table.return_value = mock_table
+
+        response = self.client.post('/claim-credit', data={'code': code.lower()}, follow_redirects=False)
+
+        self.assertEqual(response.status_code, 302)
+        mock_table.select.return_value.eq.assert_called_with('code', code)
+
+
+class TestCreditReports(unittest.TestCase):
+    """Test cases for the rollup-backed admin reports"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+
+    def _create_admin_session(self, user_code='4757', display_name='Admin'):
+        """Helper to create an admin session"""
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = user_code
+            sess['display_name'] = display_name
+            sess['is_admin'] = True
+
+    def _mock_tables(self, mock_supabase, rollups):
+        """Helper to route table() calls to per-table mocks"""
+        admin_check = Mock()
+        admin_check.data = [{'code': '4757', 'is_admin': True}]
+        users = Mock()
+        users.data = [{'code': '1234', 'display_name': 'Test User'}]
+        users_table = Mock()
+        users_table.select.return_value.eq.return_value.execute.return_value = admin_check
+        users_table.select.return_value.in_.return_value.execute.return_value = users
+
+        rollup_result = Mock()
+        rollup_result.data = rollups
+        rollups_table = Mock()
+        query = rollups_table.select.return_value.gte.return_value.lte.return_value
+        query.order.return_value.order.return_value.execute.return_value = rollup_result
+        query.eq.return_value.order.return_value.order.return_value.execute.return_value = rollup_result
+
+        stores = Mock()
+        stores.data = [{'store_id': 'STORE1', 'name': 'Main'}]
+        stores_table = Mock()
+        stores_table.select.return_value.order.return_value.execute.return_value = stores
+
+        tables = {'users': users_table, 'credit_daily_rollups': rollups_table, 'stores': stores_table}
+        mock_supabase.table.side_effect = lambda name: tables[name]
+        return rollups_table
+
+    @patch('app.supabase')
+    def test_report_json_aggregates_rollups(self, mock_supabase):
+        """Test that the JSON report sums rollup rows per store and day"""
+        self._create_admin_session()
+        self._mock_tables(mock_supabase, [
+            {'store_id': 'STORE1', 'day': '2026-01-02', 'user_code': '1234', 'issued': 3, 'claimed': 1},
+            {'store_id': 'STORE1', 'day': '2026-01-02', 'user_code': '', 'issued': 0, 'claimed': 2},
+            {'store_id': 'STORE1', 'day': '2026-01-01', 'user_code': '1234', 'issued': 0, 'claimed': 0},
+        ])
+
+        response = self.client.get('/admin/reports.json?start=2026-01-01&end=2026-01-31')
+
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual(report['total_issued'], 3)
+        self.assertEqual(report['total_claimed'], 3)
+        self.assertEqual(len(report['days']), 1)
+        self.assertEqual(report['days'][0]['users'][0]['display_name'], 'Test User')
+
+    @patch('app.supabase')
+    def test_report_reads_only_rollups(self, mock_supabase):
+        """Test that the report page never queries the credits table"""
+        self._create_admin_session()
+        rollups_table = self._mock_tables(mock_supabase, [])
+
+        response = self.client.get('/admin/reports?store_id=STORE1&start=bad-date')
+
+        self.assertEqual(response.status_code, 200)
+        queried_tables = [c.args[0] for c in mock_supabase.table.call_args_list]
+        self.assertNotIn('credits', queried_tables)
+        rollups_table.select.return_value.gte.return_value.lte.return_value.eq.assert_called_with('store_id', 'STORE1')
+
+    def test_report_requires_admin(self):
+        """Test that non-admin users cannot access reports"""
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '1234'
+            sess['is_admin'] = False
+
+        response = self.client.get('/admin/reports.json')
+
+        self.assertIn(response.status_code, [302, 403])
+
+
+class TestAdminLists(unittest.TestCase):
+    """Test cases for paginated admin lists and type-ahead lookups"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '4757'
+            sess['display_name'] = 'Admin'
+            sess['is_admin'] = True
+
+    def _mock_admin_check(self, mock_table):
+        """Helper to make the admin_required check pass"""
+        admin_check = Mock()
+        admin_check.data = [{'code': '4757', 'is_admin': True}]
+        mock_table.select.return_value.eq.return_value.execute.return_value = admin_check
+
+    @patch('app.supabase')
+    def test_users_page_is_paginated_and_projected(self, mock_supabase):
+        """Test that the users list fetches one page of display columns"""
+        mock_table = Mock()
+        self._mock_admin_check(mock_table)
+        page_result = Mock()
+        page_result.data = [
+            {'code': str(1000 + i), 'display_name': f'User {i}', 'is_admin': False, 'created_at': '2026-01-01T00:00:00'}
+            for i in range(app_module.ADMIN_PAGE_SIZE + 1)
+        ]
+        mock_table.select.return_value.order.return_value.range.return_value.execute.return_value = page_result
+        mock_supabase.table.return_value = mock_table
+
+        response = self.client.get('/admin/users?page=2')
+
+        self.assertEqual(response.status_code, 200)
+        mock_table.select.assert_called_with('code, display_name, is_admin, created_at')
+        size = app_module.ADMIN_PAGE_SIZE
+        mock_table.select.return_value.order.return_value.range.assert_called_once_with(size, 2 * size)
+        html = response.get_data(as_text=True)
+        self.assertIn('page=3', html)
+        self.assertNotIn(f'User {size}<', html)
+
+    @patch('app.supabase')
+    def test_users_search_is_sanitised(self, mock_supabase):
+        """Test that search terms cannot inject PostgREST filter syntax"""
+        mock_table = Mock()
+        self._mock_admin_check(mock_table)
+        page_result = Mock()
+        page_result.data = []
+        mock_table.select.return_value.or_.return_value.order.return_value.range.return_value.execute.return_value = page_result
+        mock_supabase.table.return_value = mock_table
+
+        response = self.client.get('/admin/users?q=ann),is_admin.eq.true')
+
+        self.assertEqual(response.status_code, 200)
+        mock_table.select.return_value.or_.assert_called_once_with(
+            'code.ilike.*annis_admineqtrue*,display_name.ilike.*annis_admineqtrue*')
+
+    @patch('app.supabase')
+    def test_assignments_embed_only_names(self, mock_supabase):
+        """Test that assignments skip the full users and stores tables"""
+        mock_table = Mock()
+        self._mock_admin_check(mock_table)
+        page_result = Mock()
+        page_result.data = [{'id': 1, 'user_code': '1234', 'store_id': 'STORE1',
+                             'users': {'display_name': 'Test User'}, 'stores': {'name': 'Main'}}]
+        mock_table.select.return_value.order.return_value.range.return_value.execute.return_value = page_result
+        mock_supabase.table.return_value = mock_table
+
+        response = self.client.get('/admin/assignments')
+
+        self.assertEqual(response.status_code, 200)
+        mock_table.select.assert_called_with('id, user_code, store_id, users(display_name), stores(name)')
+        queried_tables = [c.args[0] for c in mock_supabase.table.call_args_list]
+        self.assertEqual(queried_tables.count('users'), 1)  # admin check only
+        self.assertNotIn('stores', queried_tables)
+        self.assertIn('Test User', response.get_data(as_text=True))
+
+    @patch('app.supabase')
+    def test_store_lookup_returns_limited_matches(self, mock_supabase):
+        """Test that the store type-ahead returns a bounded JSON list"""
+        mock_table = Mock()
+        self._mock_admin_check(mock_table)
+        lookup_result = Mock()
+        lookup_result.data = [{'store_id': 'STORE1', 'name': 'Main'}]
+        mock_table.select.return_value.or_.return_value.order.return_value.limit.return_value.execute.return_value = lookup_result
+        mock_supabase.table.return_value = mock_table
+
+        response = self.client.get('/admin/lookup/stores?q=sto')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), [{'value': 'STORE1', 'label': 'STORE1 - Main'}])
+        mock_table.select.return_value.or_.return_value.order.return_value.limit.assert_called_once_with(
+            app_module.LOOKUP_LIMIT)
+
+
+class TestColumnProjection(unittest.TestCase):
+    """Test that every route selects explicit, minimal column sets"""
+
+    # (method, path, form data) for every route that reads the database
+    routes = [
+        ('POST', '/login', {'code': '4757', 'password': '4757'}),
+        ('GET', '/', None),
+        ('GET', '/dashboard', None),
+        ('GET', '/dashboard/all', None),
+        ('POST', '/select-store', {'store_id': 'STORE1'}),
+        ('POST', '/create-credit', {'items': '["Item"]', 'reason': 'Test',
+                                    'customer_name': 'John Doe', 'customer_phone': '555-1234'}),
+        ('POST', '/claim-credit', {'code': 'ABC'}),
+        ('POST', '/unclaim-credit', {'code': 'ABC'}),
+        ('POST', '/change-password', {'current_password': '4757', 'new_password': 'abcd',
+                                      'confirm_password': 'abcd'}),
+        ('GET', '/admin', None),
+        ('GET', '/admin/users', None),
+        ('GET', '/admin/users/4757/edit', None),
+        ('POST', '/admin/users/1234/update', {'code': '5678', 'display_name': 'Renamed'}),
+        ('GET', '/admin/stores', None),
+        ('GET', '/admin/assignments', None),
+        ('GET', '/admin/lookup/users?q=47', None),
+        ('GET', '/admin/lookup/stores?q=ST', None),
+        ('GET', '/admin/reports', None),
+    ]
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+
+    def _request(self, method, path, data):
+        """Helper to run one request as a logged-in admin and record its selects"""
+        client = RecordingClient()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '4757'
+            sess['display_name'] = 'Admin'
+            sess['is_admin'] = True
+            sess['selected_store'] = 'STORE1'
+        with patch('app.supabase', client), patch('app.generate_code', return_value='XYZ'):
+            response = self.client.open(path, method=method, data=data)
+        self.assertLess(response.status_code, 500, path)
+        return client.selects
+
+    def test_no_route_selects_star_or_password(self):
+        """Test that no route fetches every column or the password column"""
+        for method, path, data in self.routes:
+            with self.subTest(route=path):
+                selects = self._request(method, path, data)
+                self.assertTrue(selects, path)
+                for table, columns in selects:
+                    names = [column.strip() for column in columns.replace('(', ',').replace(')', ',').split(',')]
+                    self.assertNotIn('*', names, f'{path} selects * from {table}')
+                    self.assertNotIn('password', names, f'{path} selects password from {table}')
+
+    def test_claim_checks_use_shared_projections(self):
+        """Test that claim and unclaim pre-checks fetch only what they read"""
+        claim = self._request('POST', '/claim-credit', {'code': 'ABC'})
+        self.assertIn(('credits', app_module.CREDIT_CLAIM_CHECK_COLUMNS), claim)
+        unclaim = self._request('POST', '/unclaim-credit', {'code': 'ABC'})
+        self.assertIn(('credits', app_module.CREDIT_UNCLAIM_CHECK_COLUMNS), unclaim)
+
+    def test_dashboard_uses_tile_projection(self):
+        """Test that the dashboard fetches the tile projection and renders from it"""
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '4757'
+            sess['display_name'] = 'Admin'
+            sess['is_admin'] = True
+            sess['selected_store'] = 'STORE1'
+        client = RecordingClient()
+        with patch('app.supabase', client):
+            response = self.client.get('/dashboard')
+
+        self.assertIn(('credits', app_module.CREDIT_TILE_COLUMNS), client.selects)
+        html = response.get_data(as_text=True)
+        self.assertIn('John Doe', html)
+        self.assertIn('Created By:</strong> Admin', html)
+
+
+class TestCreditRecords(unittest.TestCase):
+    """Test cases for the slotted Credit records the dashboards render"""
+
+    def _row(self, **fields):
+        row = {'code': 'ABC', 'status': 'active', 'items': '["Shoes", "Bag"]', 'created_by': '1234',
+               'users': {'display_name': 'Test User'}}
+        row.update(fields)
+        return row
+
+    def test_credits_have_no_instance_dict(self):
+        """Test that records are slotted and keep the row's fields"""
+        credit = app_module.Credit(self._row())
+        self.assertFalse(hasattr(credit, '__dict__'))
+        self.assertEqual((credit.code, credit.status, credit.customer_name), ('ABC', 'active', None))
+
+    @patch('app.format_items', return_value='Shoes, Bag')
+    def test_items_are_formatted_lazily_once(self, mock_format):
+        """Test that items are only parsed when first read"""
+        credit = app_module.Credit(self._row())
+        mock_format.assert_not_called()
+
+        self.assertEqual(credit.items_display, 'Shoes, Bag')
+        self.assertEqual(credit.items_display, 'Shoes, Bag')
+        mock_format.assert_called_once_with('["Shoes", "Bag"]')
+
+    def test_creator_name_falls_back_to_code(self):
+        """Test that credits without an embedded creator show the creator code"""
+        credits = app_module.credits_from_rows([self._row(), self._row(users=None)])
+        self.assertEqual([c.creator_display_name for c in credits], ['Test User', '1234'])
+
+
+class TestStaleDashboard(unittest.TestCase):
+    """Test cases for the dashboard's fallback to its last good copy"""
+
+    def setUp(self):
+        """Set up test client, a session and an empty dashboard cache"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '1234'
+            sess['display_name'] = 'Test User'
+            sess['is_admin'] = False
+            sess['selected_store'] = 'STORE1'
+        
+        self.cache = app_module.StaleWhileRevalidateCache(app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(4))
+        for patcher in (patch('app.dashboard_cache', self.cache),
+                        patch('app.DASHBOARD_LATENCY_BUDGET', 0.05),
+                        patch('app.supabase'),
+                        patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'}])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _credits(self, code):
+        return app_module.credits_from_rows([{'code': code, 'status': 'active', 'items': 'Item', 'created_by': '1234'}])
+
+    def _load_dashboard(self):
+        """Load the dashboard once with fresh data so there is a copy to fall back on"""
+        with patch('app.fetch_store_credits', return_value=self._credits('OLD')):
+            html = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('data-code="OLD"', html)
+        self.assertNotIn('Showing credits as of', html)
+
+    def test_slow_load_serves_cached_copy_and_refreshes(self):
+        """Test that a load past the budget shows the old copy and still updates the cache"""
+        self._load_dashboard()
+        release = threading.Event()
+        
+        def slow_fetch(store_id):
+            release.wait(5)
+            return self._credits('NEW')
+        
+        with patch('app.fetch_store_credits', side_effect=slow_fetch):
+            html = self.client.get('/dashboard').get_data(as_text=True)
+            self.assertIn('data-code="OLD"', html)
+            self.assertIn('Showing credits as of', html)
+            
+            refresh = self.cache._loading[('credits:STORE1', 'tiles')]
+            release.set()
+            refresh.result(5)
+        
+        self.assertEqual(self.cache.peek('credits:STORE1', 'tiles')[0][0].code, 'NEW')
+
+    def test_concurrent_loads_share_one_query(self):
+        """Test that requests arriving during a slow load join it"""
+        release = threading.Event()
+        loads = []
+        
+        def slow_load():
+            loads.append(1)
+            release.wait(5)
+            return 'value'
+        
+        first = self.cache.refresh('ns', 'key', slow_load)
+        second = self.cache.refresh('ns', 'key', slow_load)
+        release.set()
+        
+        self.assertIs(first, second)
+        self.assertEqual(self.cache.get('ns', 'key', first, time.monotonic() + 5), ('value', None))
+        self.assertEqual(len(loads), 1)
+
+    def test_unchanged_loads_are_not_rewritten(self):
+        """Test that a load is stored again only after an invalidation, an eviction, or the rewrite interval"""
+        cache = app_module.StaleWhileRevalidateCache(app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(1), 60)
+        
+        with patch.object(cache.backend, 'set', wraps=cache.backend.set) as set_value:
+            def load(value):
+                cache.refresh('ns', 'key', lambda: value).result(5)
+                return cache.peek('ns', 'key')[0]
+            
+            self.assertEqual(load('first'), 'first')
+            self.assertEqual(load('first'), 'first')
+            self.assertEqual(set_value.call_count, 1)
+            
+            cache.invalidate('ns')
+            self.assertEqual(load('second'), 'second')
+            self.assertEqual(set_value.call_count, 2)
+            
+            cache.backend._entries.clear()
+            self.assertEqual(load('second'), 'second')
+            self.assertEqual(set_value.call_count, 3)
+            
+            with patch('app.time.monotonic', return_value=time.monotonic() + 61):
+                load('second')
+            self.assertEqual(set_value.call_count, 4)
+
+    def test_failed_load_serves_cached_copy(self):
+        """Test that a database error shows the old copy instead of an error page"""
+        self._load_dashboard()
+        
+        with patch('app.fetch_store_credits', side_effect=Exception('timeout')):
+            response = self.client.get('/dashboard')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('data-code="OLD"', response.get_data(as_text=True))
+
+    def test_session_check_error_serves_cached_copy(self):
+        """Test that a database outage keeps the session and shows the old copy"""
+        self._load_dashboard()
+        app_module.supabase.table.return_value.select.return_value.eq.return_value.execute.side_effect = \
+            Exception('Database error')
+        
+        response = self.client.get('/dashboard', follow_redirects=False)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Showing credits as of', response.get_data(as_text=True))
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess['user_code'], '1234')
+
+
+class TestDashboardPrefetch(unittest.TestCase):
+    """Test cases for loading the dashboard's data during login and store switches"""
+
+    def setUp(self):
+        """Set up a SQLite stand-in with two stores, fresh caches, and a test client"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert([{'store_id': 'STORE1', 'name': 'A Main'},
+                                        {'store_id': 'STORE2', 'name': 'B Second'}]).execute()
+        self.db.table('credits').insert([
+            {'code': 'ONE', 'items': '["Item"]', 'reason': 'Test', 'store_id': 'STORE1', 'created_by': '4757'},
+            {'code': 'TWO', 'items': '["Item"]', 'reason': 'Test', 'store_id': 'STORE2', 'created_by': '4757'},
+        ]).execute()
+        self.cache = app_module.StaleWhileRevalidateCache(app_module.LocalCacheBackend(10),
+                                                          app_module.ThreadPoolExecutor(4))
+        for patcher in (patch('app.supabase', self.db),
+                        patch('app.dashboard_cache', self.cache),
+                        patch('app.dashboard_prefetch', app_module.DashboardPrefetch(10, 10))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+
+    def _dashboard(self):
+        """Load the dashboard once its prefetch is done; returns (html, database calls)"""
+        for future in list(self.cache._loading.values()):
+            future.result(5)
+        before = self.backend.request_count
+        html = self.client.get('/dashboard').get_data(as_text=True)
+        return html, self.backend.request_count - before
+
+    def test_dashboard_after_login_uses_prefetched_data(self):
+        """Test that only the session check is left for the first dashboard"""
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        html, calls = self._dashboard()
+        self.assertIn('data-code="ONE"', html)
+        self.assertEqual(calls, 1)
+        
+        # The prefetch is used once; a reload fetches fresh data
+        _, calls = self._dashboard()
+        self.assertEqual(calls, 3)
+
+    def test_store_switch_prefetches_new_store(self):
+        """Test that switching stores prefetches the new store's credits"""
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        self.client.post('/select-store', data={'store_id': 'STORE2'})
+        html, calls = self._dashboard()
+        self.assertIn('data-code="TWO"', html)
+        self.assertNotIn('data-code="ONE"', html)
+        self.assertEqual(calls, 1)
+
+    def test_changes_after_prefetch_are_not_hidden(self):
+        """Test that a credit change between login and dashboard discards the prefetch"""
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        with patch('app.generate_code', return_value='NEW'):
+            self.client.post('/create-credit', data={'items': '["Item"]', 'reason': 'Test',
+                                                     'customer_name': 'John Doe', 'customer_phone': '555-1234'})
+        html, _ = self._dashboard()
+        self.assertIn('data-code="NEW"', html)
+        self.assertIn('data-code="ONE"', html)
+
+
+    def test_store_changes_during_login_are_not_hidden(self):
+        """Test that a store list fetched across an invalidation is not served afterwards"""
+        fetch = app_module.get_user_stores
+
+        def fetch_then_change(*args, **kwargs):
+            stores = fetch(*args, **kwargs)
+            # An admin renames a store after the login's query has read it
+            self.db.table('stores').update({'name': 'A Renamed'}).eq('store_id', 'STORE1').execute()
+            app_module.stores_changed()
+            return stores
+
+        with patch('app.get_user_stores', side_effect=fetch_then_change):
+            self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        self.assertIsNone(self.cache.peek('stores', '4757:1'))
+        html, _ = self._dashboard()
+        self.assertIn('A Renamed', html)
+
+class TestStreamedDashboard(unittest.TestCase):
+    """Test cases for the dashboard streamed with STREAM_RENDERING"""
+
+    def setUp(self):
+        """Set up a SQLite stand-in with five credits, streaming on, and log in"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert({'store_id': 'STORE1', 'name': 'Main'}).execute()
+        self.codes = [f'S{i:02d}' for i in range(5)]
+        self.db.table('credits').insert([
+            {'code': code, 'items': '["Item"]', 'reason': 'Test', 'store_id': 'STORE1', 'created_by': '4757'}
+            for code in self.codes
+        ]).execute()
+        for patcher in (patch('app.supabase', self.db),
+                        patch('app.STREAM_RENDERING', True),
+                        patch('app.STREAM_PAGE_SIZE', 2),
+                        patch('app.dashboard_cache', app_module.StaleWhileRevalidateCache(
+                            app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(2)))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+
+    def test_header_and_form_are_sent_before_credits_are_fetched(self):
+        """Test that the first chunk holds the create form and nothing has been paged in yet"""
+        before = self.backend.request_count
+        response = self.client.get('/dashboard')
+        self.assertTrue(response.is_streamed)
+        chunks = (chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in response.response)
+        
+        first = next(chunks)
+        self.assertIn('create-credit-form', first)
+        self.assertNotIn('credit-tile', first)
+        # Session check and store list only
+        self.assertEqual(self.backend.request_count - before, 2)
+        
+        html = first + ''.join(chunks)
+        response.close()
+        positions = [html.index(f'data-code="{code}"') for code in reversed(self.codes)]
+        self.assertEqual(positions, sorted(positions))
+        # Pages of 2, 2 and 1 credits; the short page ends the scan
+        self.assertEqual(self.backend.request_count - before, 5)
+
+    def test_credits_stream_in_created_at_order(self):
+        """Test that restored credits, whose ids do not follow created_at, stream like the cached view"""
+        self.db.table('credits').insert([
+            {'code': code, 'items': '["Item"]', 'reason': 'Restored', 'store_id': 'STORE1', 'created_by': '4757',
+             'created_at': created_at}
+            for code, created_at in [('R3', '2020-01-03T00:00:00+00:00'), ('R1', '2020-01-01T00:00:00+00:00'),
+                                     ('R2', '2020-01-02T00:00:00+00:00'), ('R0', '2020-01-02T00:00:00+00:00')]
+        ]).execute()
+        codes = lambda html: [part[:part.index('"')] for part in html.split('data-code="')[1:]]
+        streamed = codes(self.client.get('/dashboard').get_data(as_text=True))
+        with patch('app.STREAM_RENDERING', False):
+            cached = codes(self.client.get('/dashboard').get_data(as_text=True))
+        self.assertEqual(streamed, cached)
+        self.assertEqual(streamed[-4:], ['R3', 'R0', 'R2', 'R1'])
+
+    def test_undated_credits_at_a_page_boundary(self):
+        """Test that a page ending on a legacy credit without a created_at continues with the rest"""
+        self.db.table('credits').insert([
+            {'code': code, 'items': '["Item"]', 'reason': 'Legacy', 'store_id': 'STORE1', 'created_by': '4757',
+             'created_at': None}
+            for code in ('L1', 'L2', 'L3')
+        ]).execute()
+        codes = lambda html: [part[:part.index('"')] for part in html.split('data-code="')[1:]]
+        streamed = codes(self.client.get('/dashboard').get_data(as_text=True))
+        with patch('app.STREAM_RENDERING', False):
+            cached = codes(self.client.get('/dashboard').get_data(as_text=True))
+        self.assertEqual(streamed, cached)
+        self.assertEqual(streamed, ['L3', 'L2', 'L1'] + self.codes[::-1])
+
+    def test_flashes_are_shown_once(self):
+        """Test that messages shown on a streamed page are not shown again"""
+        self.assertIn('Login successful!', self.client.get('/dashboard').get_data(as_text=True))
+        self.assertNotIn('Login successful!', self.client.get('/dashboard').get_data(as_text=True))
+
+    def test_empty_store_shows_empty_message(self):
+        """Test that a store without credits streams the empty-store message"""
+        self.db.table('stores').insert({'store_id': 'STORE2', 'name': 'Empty'}).execute()
+        self.client.post('/select-store', data={'store_id': 'STORE2'})
+        html = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('No credits found for this store', html)
+        self.assertNotIn('stream-flush', html)
+
+
+class TestCacheBackends(unittest.TestCase):
+    """Test cases for the local and SQLite cache backends"""
+
+    def setUp(self):
+        """Set up a temporary directory for SQLite cache files"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'cache.db')
+
+    def _backends(self, max_entries=10):
+        return [app_module.LocalCacheBackend(max_entries), app_module.SQLiteCacheBackend(self.path, max_entries)]
+
+    def test_invalidation_discards_values(self):
+        """Test that values loaded before an invalidation are never returned after it"""
+        for backend in self._backends():
+            with self.subTest(backend=backend.name):
+                before = backend.version('stores')
+                backend.set('stores', 'a', ['STORE1'], before)
+                self.assertEqual(backend.get('stores', 'a'), ['STORE1'])
+                
+                backend.invalidate('stores')
+                self.assertIsNone(backend.get('stores', 'a'))
+                # A load that started before the change finishes afterwards
+                backend.set('stores', 'a', ['STORE1'], before)
+                self.assertIsNone(backend.get('stores', 'a'))
+                
+                backend.set('stores', 'a', ['STORE2'], backend.version('stores'))
+                self.assertEqual(backend.get('stores', 'a'), ['STORE2'])
+
+    def test_least_recent_values_are_dropped(self):
+        """Test that the backends hold at most max_entries values"""
+        for backend in self._backends(max_entries=2):
+            with self.subTest(backend=backend.name):
+                for key in ('a', 'b', 'c'):
+                    backend.set('ns', key, key, 0)
+                self.assertIsNone(backend.get('ns', 'a'))
+                self.assertEqual(backend.get('ns', 'c'), 'c')
+                self.assertEqual(backend.size(), 2)
+
+    def test_sqlite_is_shared_between_processes(self):
+        """Test that values and invalidations written by one worker reach another"""
+        worker_a = app_module.SQLiteCacheBackend(self.path, 10)
+        worker_b = app_module.SQLiteCacheBackend(self.path, 10)
+        credits = app_module.credits_from_rows([{'code': 'ABC', 'status': 'active', 'items': 'Item'}])
+        
+        worker_a.set('credits:STORE1', 'tiles', credits, worker_a.version('credits:STORE1'))
+        self.assertEqual(worker_b.get('credits:STORE1', 'tiles')[0].code, 'ABC')
+        
+        worker_b.invalidate('credits:STORE1')
+        self.assertIsNone(worker_a.get('credits:STORE1', 'tiles'))
+
+    def test_sqlite_values_round_trip_as_json(self):
+        """Test that Credits and load times come back intact, and other stored data is never unpickled"""
+        backend = app_module.SQLiteCacheBackend(self.path, 10)
+        loaded_at = datetime.now(timezone.utc)
+        credits = app_module.credits_from_rows([{'code': 'ABC', 'status': 'active', 'items': '["Widget"]',
+                                                 'created_by': '1234', 'users': {'display_name': 'Jane'}}])
+        
+        backend.set('credits:STORE1', 'tiles', (credits, loaded_at), 0)
+        (cached,), as_of = backend.get('credits:STORE1', 'tiles')
+        self.assertEqual((cached.code, cached.items_display, cached.creator_display_name),
+                         ('ABC', 'Widget', 'Jane'))
+        self.assertEqual(as_of, loaded_at)
+        
+        backend._db().execute("UPDATE cache_entries SET value = ?", (pickle.dumps(['STORE1']),))
+        with patch('pickle.loads') as loads:
+            self.assertIsNone(backend.get('credits:STORE1', 'tiles'))
+        loads.assert_not_called()
+
+    def test_default_sqlite_path_is_private(self):
+        """Test that the default cache file sits in a directory only this user can open"""
+        with patch('app.tempfile.gettempdir', return_value=self.tmpdir.name):
+            path = app_module.private_cache_path()
+            self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+            
+            os.chmod(os.path.dirname(path), 0o777)
+            with self.assertRaises(RuntimeError):
+                app_module.private_cache_path()
+
+    def test_stats_report_hit_rate(self):
+        """Test that hits, misses and invalidations are counted"""
+        backend = app_module.LocalCacheBackend(10)
+        self.assertIsNone(backend.stats()['hit_rate'])
+        
+        backend.set('ns', 'a', 1, 0)
+        backend.get('ns', 'a')
+        backend.get('ns', 'b')
+        backend.get('ns', 'a')
+        backend.invalidate('ns')
+        
+        stats = backend.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (2, 1, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+    def test_credit_changes_invalidate_the_store(self):
+        """Test that a credit change drops only that store's cached credits"""
+        cache = app_module.StaleWhileRevalidateCache(app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(2))
+        with patch('app.dashboard_cache', cache):
+            for store_id in ('STORE1', 'STORE2'):
+                cache.refresh(f'credits:{store_id}', 'tiles', lambda: []).result(5)
+            app_module.credits_changed('STORE1', {'type': 'claim', 'code': 'ABC'})
+        
+        self.assertIsNone(cache.peek('credits:STORE1', 'tiles'))
+        self.assertIsNotNone(cache.peek('credits:STORE2', 'tiles'))
+
+
+class TestItemSuggestions(unittest.TestCase):
+    """Test cases for per-store item suggestions"""
+
+    def setUp(self):
+        """Set up a SQLite stand-in with two stores and log in as the default admin"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert([{'store_id': 'STORE1', 'name': 'Main'},
+                                        {'store_id': 'STORE2', 'name': 'Second'}]).execute()
+        self.db.table('credits').insert([
+            {'code': 'A01', 'items': '["Blue Shirt", "Socks"]', 'reason': 'Test', 'store_id': 'STORE1'},
+            {'code': 'A02', 'items': '["blue  shirt"]', 'reason': 'Test', 'store_id': 'STORE1'},
+            {'code': 'A03', 'items': '["Blue Shirt", "Blue Hat"]', 'reason': 'Test', 'store_id': 'STORE1'},
+            {'code': 'A04', 'items': 'Boots', 'reason': 'Test', 'store_id': 'STORE1'},
+            {'code': 'B01', 'items': '["Blue Jeans"]', 'reason': 'Test', 'store_id': 'STORE2'},
+        ]).execute()
+        for patcher in (patch('app.supabase', self.db),
+                        patch('app.item_suggestions', app_module.ItemSuggestions(10, 900))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        self.client.post('/select-store', data={'store_id': 'STORE1'})
+
+    def _suggest(self, q):
+        return [option['value'] for option in self.client.get(f'/items/suggest?q={q}').get_json()]
+
+    def test_suggestions_rank_by_use_within_store(self):
+        """Test that past items under the prefix come back most used first, in their usual spelling"""
+        self.assertEqual(self._suggest('BLU'), ['Blue Shirt', 'Blue Hat'])
+        self.assertEqual(self._suggest('b'), ['Blue Shirt', 'Blue Hat', 'Boots'])
+        self.assertEqual(self._suggest('blue  s'), ['Blue Shirt'])
+        self.assertEqual(self._suggest('x'), [])
+        
+        label = self.client.get('/items/suggest?q=socks').get_json()[0]['label']
+        self.assertEqual(label, 'Socks (on 1 credit)')
+
+    def test_created_credits_update_the_index(self):
+        """Test that items on new credits are suggested without another database read"""
+        self.assertEqual(self._suggest('bo'), ['Boots'])
+        
+        for _ in range(2):
+            self.client.post('/create-credit', data={'items': '["Bow Tie"]', 'reason': 'Test',
+                                                     'customer_name': 'John Doe', 'customer_phone': '555-1234'})
+        before = self.backend.request_count
+        self.assertEqual(self._suggest('bo'), ['Bow Tie', 'Boots'])
+        # Only the session check reaches the database
+        self.assertEqual(self.backend.request_count - before, 1)
+
+    def test_index_is_rebuilt_when_old(self):
+        """Test that credits created elsewhere show up once the index is rebuilt"""
+        self.assertEqual(self._suggest('bo'), ['Boots'])
+        self.db.table('credits').insert({'code': 'A05', 'items': '["Bowl"]', 'reason': 'Test',
+                                         'store_id': 'STORE1'}).execute()
+        self.assertEqual(self._suggest('bo'), ['Boots'])
+        
+        app_module.item_suggestions.max_age = 0
+        self.assertEqual(self._suggest('bo'), ['Boots', 'Bowl'])
+
+    def test_index_memo_follows_additions(self):
+        """Test that remembered best names for a prefix change when an item under it is added"""
+        index = app_module.ItemIndex(2)
+        for name in ['Apple', 'Apricot', 'Apricot', 'Avocado']:
+            index.add(name)
+        self.assertEqual(index.suggest('a'), [('Apricot', 2), ('Apple', 1)])
+        
+        index.add('Avocado')
+        index.add('avocado')
+        self.assertEqual(index.suggest('A'), [('Avocado', 3), ('Apricot', 2)])
+        self.assertEqual(index.suggest('ap'), [('Apricot', 2), ('Apple', 1)])
+        self.assertEqual(len(index), 3)
+
+
+class TestPostgresQueries(unittest.TestCase):
+    """Test the SQL pgbackend.py builds for the requests app.py makes"""
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.run.return_value = [[]]
+
+    def _sql(self, query):
+        return [(' '.join(sql.split()), params) for sql, params in query.statements()]
+
+    def test_minimal_writes_do_not_fetch_a_result(self):
+        """Test that writes without RETURNING are run without reading a row, as psycopg would refuse"""
+        class ProgrammingError(Exception):
+            pass
+        
+        def execute(sql, params):
+            cursor = Mock(description=[('coalesce',)] if 'RETURNING' in sql else None)
+            cursor.fetchone.side_effect = (lambda: ['[]']) if cursor.description else ProgrammingError(
+                "the last operation didn't produce a result")
+            return cursor
+        
+        client = pgbackend.PostgresClient.__new__(pgbackend.PostgresClient)
+        client._errors = ProgrammingError
+        client.pool = MagicMock()
+        client.pool.connection.return_value.__enter__.return_value.execute.side_effect = execute
+        for query in (client.table('credits').insert({'code': 'ABC'}, returning='minimal'),
+                      client.table('credits').upsert({'code': 'ABC'}, returning='minimal'),
+                      client.table('credits').update({'status': 'claimed'}, returning='minimal').eq('code', 'ABC'),
+                      client.table('credits').delete(returning='minimal').eq('code', 'ABC')):
+            with self.subTest(method=query.method):
+                self.assertEqual(query.execute().data, [])
+        self.assertEqual(client.run([('SELECT 1 RETURNING', []), ('DELETE', [])]), ['[]', None])
+
+    def test_claim_update_is_one_conditional_statement(self):
+        """Test that the claim's update filters on status and returns the updated rows"""
+        query = pgbackend.PostgresQuery(self.client, 'credits').update(
+            {'status': 'claimed', 'claimed_by_user': '4757'}).eq('code', 'ABC').eq('status', 'active')
+        self.assertEqual(self._sql(query), [(
+            'WITH q AS (UPDATE "credits" AS t SET "status" = %s, "claimed_by_user" = %s '
+            'WHERE t."code" = %s AND t."status" = %s RETURNING t.*) '
+            "SELECT coalesce(json_agg(q), '[]') FROM q",
+            ['claimed', '4757', 'ABC', 'active'])])
+
+    def test_select_with_embed_order_and_range(self):
+        """Test embeds, ordering and ranges, aggregated to JSON by the database"""
+        query = pgbackend.PostgresQuery(self.client, 'credits') \
+            .select('code, users!credits_created_by_fkey(display_name)') \
+            .eq('store_id', 'STORE1').order('created_at', desc=True).range(50, 100)
+        self.assertEqual(self._sql(query), [(
+            "SELECT coalesce(json_agg(q), '[]') FROM (SELECT t.\"code\", "
+            "(SELECT json_build_object('display_name', e.\"display_name\") FROM \"users\" e "
+            'WHERE e."code" = t."created_by") AS "users" FROM "credits" t WHERE t."store_id" = %s '
+            'ORDER BY t."created_at" DESC LIMIT 51 OFFSET 50) q',
+            ['STORE1'])])
+
+    def test_lookup_alternatives_and_counts(self):
+        """Test or_ ilike alternatives and head-only exact counts"""
+        query = pgbackend.PostgresQuery(self.client, 'users').select('code') \
+            .or_('code.ilike.47*,display_name.ilike.*47*')
+        self.assertEqual(self._sql(query)[0][1], ['47%', '%47%'])
+        self.assertIn('WHERE (t."code" ILIKE %s OR t."display_name" ILIKE %s)', self._sql(query)[0][0])
+        
+        self.client.run.return_value = [3]
+        result = pgbackend.PostgresQuery(self.client, 'users').select('id', count='exact', head=True).execute()
+        self.assertEqual((result.count, result.data), (3, []))
+        self.assertEqual(self.client.run.call_args[0][0], [('SELECT count(*) FROM "users" t', [])])
+
+    def test_negated_conditions_in_alternatives(self):
+        """Test the condition the streamed dashboard pages past undated credits with"""
+        query = pgbackend.PostgresQuery(self.client, 'credits').select('id') \
+            .or_('and(created_at.is.null,id.lt.42),created_at.not.is.null')
+        sql, params = self._sql(query)[0]
+        self.assertIn('WHERE ((t."created_at" IS NULL AND t."id" < %s) OR NOT t."created_at" IS NULL)', sql)
+        self.assertEqual(params, ['42'])
+
+    def test_nested_and_groups_in_alternatives(self):
+        """Test the (created_at, id) keyset condition the streamed dashboard pages with"""
+        query = pgbackend.PostgresQuery(self.client, 'credits').select('id') \
+            .or_('created_at.lt."2026-01-01T00:00:00+00:00",'
+                 'and(created_at.eq."2026-01-01T00:00:00+00:00",id.lt.42)')
+        sql, params = self._sql(query)[0]
+        self.assertIn('WHERE (t."created_at" < %s OR (t."created_at" = %s AND t."id" < %s))', sql)
+        self.assertEqual(params, ['2026-01-01T00:00:00+00:00', '2026-01-01T00:00:00+00:00', '42'])
+
+    def test_bulk_upsert_fills_missing_columns_with_defaults(self):
+        """Test that rows missing a column get its default, and conflicts merge"""
+        query = pgbackend.PostgresQuery(self.client, 'users').upsert(
+            [{'code': '1111', 'password': 'x'}, {'code': '2222', 'display_name': 'Two'}],
+            on_conflict='code', returning='minimal')
+        self.assertEqual(self._sql(query), [(
+            'INSERT INTO "users" AS t ("code", "password", "display_name") '
+            'VALUES (%s, %s, DEFAULT), (%s, DEFAULT, %s) ON CONFLICT ("code") '
+            'DO UPDATE SET "password" = EXCLUDED."password", "display_name" = EXCLUDED."display_name"',
+            ['1111', 'x', '2222', 'Two'])])
+
+    def test_rejects_unsafe_names(self):
+        """Test that identifiers are never interpolated unchecked"""
+        with self.assertRaises(ValueError):
+            pgbackend.PostgresQuery(self.client, 'credits').eq('code; DROP TABLE credits', 'x')
+
+
+class TestIdempotencyKeys(unittest.TestCase):
+    """Test cases for idempotent create and claim submissions"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '1234'
+            sess['display_name'] = 'Test User'
+            sess['is_admin'] = False
+            sess['selected_store'] = 'STORE1'
+
+        patcher = patch('app.idempotency_keys', app_module.IdempotencyStore(max_keys=3, ttl_seconds=60))
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self, key):
+        data = {'items': '["Item"]', 'reason': 'Test', 'customer_name': 'John Doe',
+                'customer_phone': '555-1234', 'idempotency_key': key}
+        self.client.post('/create-credit', data=data)
+        with self.client.session_transaction() as sess:
+            return sess.pop('_flashes', [])
+
+    @patch('app.insert_credit', return_value='ABC')
+    @patch('app.supabase')
+    def test_resubmitted_create_is_applied_once(self, mock_supabase, mock_insert):
+        """Test that a double-submitted create inserts one credit and repeats its result"""
+        first = self._create('key-1')
+        second = self._create('key-1')
+        
+        self.assertEqual(mock_insert.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertIn('Code: ABC', first[0][1])
+
+    @patch('app.insert_credit', return_value='ABC')
+    @patch('app.supabase')
+    def test_new_key_creates_again(self, mock_supabase, mock_insert):
+        """Test that distinct keys and missing keys are processed every time"""
+        self._create('key-1')
+        self._create('key-2')
+        self._create('')
+        self._create('')
+        
+        self.assertEqual(mock_insert.call_count, 4)
+
+    @patch('app.insert_credit', side_effect=[Exception('timeout'), 'ABC'])
+    @patch('app.supabase')
+    def test_failed_create_can_be_retried(self, mock_supabase, mock_insert):
+        """Test that a failed submission releases its key"""
+        failed = self._create('key-1')
+        retried = self._create('key-1')
+        
+        self.assertIn('Error creating credit', failed[0][1])
+        self.assertIn('Code: ABC', retried[0][1])
+        self.assertEqual(mock_insert.call_count, 2)
+
+    @patch('app.claim_active_credit', return_value=(True, 'Credit claimed'))
+    @patch('app.supabase')
+    def test_claim_keys_are_scoped_by_code(self, mock_supabase, mock_claim):
+        """Test that one page's key dedupes repeat claims of a code but not other codes"""
+        for code in ('ABC', 'ABC', 'DEF'):
+            self.client.post('/claim-credit', data={'code': code, 'idempotency_key': 'page-1'})
+        
+        self.assertEqual([c.args[0] for c in mock_claim.call_args_list], ['ABC', 'DEF'])
+
+    def test_store_is_bounded_and_expires(self):
+        """Test TTL expiry and eviction of the oldest keys"""
+        with patch('app.time.monotonic', return_value=1000.0):
+            for key in ('a', 'b', 'c', 'd'):
+                self.assertEqual(self.store.begin(key), (True, None))
+                self.store.finish(key, ('done', 'success'))
+            # 'a' was evicted to stay within three keys
+            self.assertEqual(self.store.begin('a'), (True, None))
+            self.assertEqual(self.store.begin('d'), (False, ('done', 'success')))
+        
+        with patch('app.time.monotonic', return_value=1061.0):
+            self.assertEqual(self.store.begin('d'), (True, None))
+
+    @patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'}])
+    @patch('app.supabase')
+    def test_dashboard_renders_a_key_per_render(self, mock_supabase, mock_stores):
+        """Test that each dashboard render carries a fresh idempotency key"""
+        keys = []
+        for _ in range(2):
+            html = self.client.get('/dashboard').get_data(as_text=True)
+            start = html.index('name="idempotency_key" value="') + len('name="idempotency_key" value="')
+            keys.append(html[start:html.index('"', start)])
+        
+        self.assertTrue(all(keys))
+        self.assertNotEqual(keys[0], keys[1])
+
+
+class TestConsolidatedDashboard(unittest.TestCase):
+    """Test cases for the all-stores dashboard"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+
+    def _create_session(self, is_admin=False):
+        """Helper to create a valid session"""
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '4757' if is_admin else '1234'
+            sess['display_name'] = 'Test User'
+            sess['is_admin'] = is_admin
+            sess['selected_store'] = 'STORE1'
+
+    def _client(self, store_count):
+        """Helper for a recording client with store_count assigned stores"""
+        stores = [{'store_id': f'STORE{i}', 'name': f'Store {i}'} for i in range(1, store_count + 1)]
+        return RecordingClient({
+            'users': [{'code': '1234', 'display_name': 'Test User', 'is_admin': False}],
+            'user_stores': [{'store_id': store['store_id'], 'stores': store} for store in stores],
+            'rpc:credit_store_counts': [
+                {'store_id': 'STORE1', 'active': 3, 'claimed': 4},
+                {'store_id': 'STORE2', 'active': 5, 'claimed': 0}
+            ]
+        })
+
+    def test_query_count_does_not_grow_with_stores(self):
+        """Test that listing and counting credits costs the same for 2 or 300 stores"""
+        self._create_session()
+        executed = []
+        for store_count in (2, 300):
+            client = self._client(store_count)
+            with patch('app.supabase', client):
+                response = self.client.get('/dashboard/all')
+            self.assertEqual(response.status_code, 200)
+            executed.append(client.executed)
+        
+        self.assertEqual(executed[0], executed[1])
+        self.assertEqual(executed[0].count('credits'), 1)
+        self.assertEqual(executed[0].count('rpc:credit_store_counts'), 1)
+
+    def test_counts_and_credits_are_rendered(self):
+        """Test that per-store counts, totals and credits appear on the page"""
+        self._create_session()
+        with patch('app.supabase', self._client(2)):
+            response = self.client.get('/dashboard/all')
+        
+        html = response.get_data(as_text=True)
+        self.assertIn('<h3>8</h3>', html)
+        self.assertIn('<h3>4</h3>', html)
+        self.assertIn('John Doe', html)
+        self.assertIn('Store 2', html)
+
+    @patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'},
+                                                {'store_id': 'STORE2', 'name': 'Second'}])
+    @patch('app.supabase')
+    def test_staff_credits_are_limited_to_their_stores(self, mock_supabase, mock_stores):
+        """Test that non-admins only list credits from their assigned stores"""
+        self._create_session()
+        
+        response = self.client.get('/dashboard/all')
+        
+        self.assertEqual(response.status_code, 200)
+        mock_supabase.table.return_value.select.return_value.in_.assert_called_with('store_id', ['STORE1', 'STORE2'])
+        mock_supabase.rpc.assert_called_with('credit_store_counts', {'p_store_ids': ['STORE1', 'STORE2']})
+
+    @patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'}])
+    @patch('app.supabase')
+    def test_store_filter_ignores_inaccessible_store(self, mock_supabase, mock_stores):
+        """Test that filtering on a store the user cannot access shows their own stores"""
+        self._create_session()
+        
+        self.client.get('/dashboard/all?store=STORE9')
+        
+        select = mock_supabase.table.return_value.select.return_value
+        self.assertNotIn(call('store_id', 'STORE9'), select.eq.call_args_list)
+        select.in_.assert_called_with('store_id', ['STORE1'])
+
+    @patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'}])
+    @patch('app.supabase')
+    def test_admin_lists_all_credits_without_store_list(self, mock_supabase, mock_stores):
+        """Test that admins query every store without an IN list"""
+        self._create_session(is_admin=True)
+        
+        self.client.get('/dashboard/all')
+        
+        mock_supabase.table.return_value.select.return_value.in_.assert_not_called()
+        mock_supabase.rpc.assert_called_with('credit_store_counts', {'p_store_ids': None})
+
+
+class TestOfflineSync(unittest.TestCase):
+    """Test cases for replaying queued offline actions through /api/sync"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '1234'
+            sess['display_name'] = 'Test User'
+            sess['is_admin'] = False
+            sess['selected_store'] = 'STORE1'
+
+        patcher = patch('app.get_user_stores', return_value=[{'store_id': 'STORE1', 'name': 'Main'}])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _mock_lookup(self, mock_supabase, client_ref_rows=None, claimed_rows=None):
+        """Helper for the user check, client_ref lookup and claimed-by-me lookup"""
+        user_check = Mock()
+        user_check.data = [{'code': '1234'}]
+        client_ref_result = Mock()
+        client_ref_result.data = client_ref_rows
+        claimed_result = Mock()
+        claimed_result.data = claimed_rows or []
+
+        mock_table = Mock()
+        mock_table.select.return_value.eq.return_value.execute.return_value = user_check
+        # Creates look up client_ref together with the creator
+        mock_table.select.return_value.eq.return_value.eq.return_value.execute.return_value = client_ref_result
+        mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = claimed_result
+        mock_supabase.table.return_value = mock_table
+        return mock_table
+
+    def _sync(self, actions):
+        response = self.client.post('/api/sync', json={'actions': actions})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['results']
+
+    @patch('app.insert_credit', return_value='ABC')
+    @patch('app.supabase')
+    def test_create_is_applied_once_with_client_ref(self, mock_supabase, mock_insert):
+        """Test that a queued create is inserted tagged with its action id"""
+        self._mock_lookup(mock_supabase, client_ref_rows=[])
+
+        results = self._sync([{'id': 'a1', 'user_code': '1234', 'type': 'create', 'store_id': 'STORE1', 'items': '["Item"]',
+                               'reason': 'Broken', 'customer_name': 'John Doe', 'customer_phone': '555'}])
+
+        self.assertEqual(results, [{'id': 'a1', 'status': 'ok', 'code': 'ABC',
+                                    'message': 'Credit created successfully! Code: ABC'}])
+        self.assertEqual(mock_insert.call_args.kwargs['client_ref'], 'a1')
+
+    @patch('app.insert_credit')
+    @patch('app.supabase')
+    def test_replayed_create_returns_original_code(self, mock_supabase, mock_insert):
+        """Test that replaying a create never issues a second credit"""
+        self._mock_lookup(mock_supabase, client_ref_rows=[{'code': 'XYZ'}])
+
+        results = self._sync([{'id': 'a1', 'user_code': '1234', 'type': 'create', 'store_id': 'STORE1', 'items': '["Item"]',
+                               'reason': 'Broken', 'customer_name': 'John Doe', 'customer_phone': '555'}])
+
+        self.assertEqual(results[0]['status'], 'duplicate')
+        self.assertEqual(results[0]['code'], 'XYZ')
+        mock_insert.assert_not_called()
+        lookup = mock_supabase.table.return_value.select.return_value.eq
+        lookup.assert_called_with('client_ref', 'a1')
+        lookup.return_value.eq.assert_called_with('created_by', '1234')
+
+    @patch('app.insert_credit', side_effect=APIError({'message': 'duplicate key', 'code': '23505'}))
+    @patch('app.supabase')
+    def test_another_users_action_id_is_not_revealed(self, mock_supabase, mock_insert):
+        """Test that an action id already used by another user's credit fails without its code"""
+        self._mock_lookup(mock_supabase, client_ref_rows=[])
+
+        results = self._sync([{'id': 'a1', 'user_code': '1234', 'type': 'create', 'store_id': 'STORE1', 'items': '["Item"]',
+                               'reason': 'Broken', 'customer_name': 'John Doe', 'customer_phone': '555'}])
+
+        self.assertEqual(results, [{'id': 'a1', 'status': 'error', 'message': 'Action id is already in use'}])
+
+    @patch('app.claim_active_credit', return_value=(False, 'Credit ABC not found or already claimed'))
+    @patch('app.supabase')
+    def test_replayed_claim_is_not_a_conflict(self, mock_supabase, mock_claim):
+        """Test that a claim this user already made reports a duplicate"""
+        self._mock_lookup(mock_supabase, claimed_rows=[{'code': 'ABC'}])
+
+        results = self._sync([{'id': 'c1', 'user_code': '1234', 'type': 'claim', 'store_id': 'STORE1', 'code': 'abc'}])
+
+        self.assertEqual(results[0]['status'], 'duplicate')
+        mock_claim.assert_called_once_with('ABC', 'STORE1', '1234', 'Test User')
+
+    @patch('app.claim_active_credit', side_effect=Exception('timeout'))
+    @patch('app.supabase')
+    def test_transient_failure_asks_for_retry(self, mock_supabase, mock_claim):
+        """Test that database errors leave the action queued"""
+        self._mock_lookup(mock_supabase)
+
+        results = self._sync([{'id': 'c1', 'user_code': '1234', 'type': 'claim', 'store_id': 'STORE1', 'code': 'ABC'},
+                              {'id': 'c2', 'user_code': '1234', 'type': 'claim', 'store_id': 'OTHER', 'code': 'ABC'}])
+
+        self.assertEqual([r['status'] for r in results], ['retry', 'error'])
+
+    @patch('app.insert_credit')
+    @patch('app.claim_active_credit')
+    @patch('app.supabase')
+    def test_actions_wait_for_the_user_who_queued_them(self, mock_supabase, mock_claim, mock_insert):
+        """Test that another cashier's queued actions are not applied under this session"""
+        self._mock_lookup(mock_supabase)
+
+        results = self._sync([{'id': 'c1', 'user_code': '5678', 'type': 'claim', 'store_id': 'STORE1',
+                               'code': 'ABC'},
+                              {'id': 'a1', 'type': 'create', 'store_id': 'STORE1', 'items': '["Item"]',
+                               'reason': 'Broken', 'customer_name': 'John Doe', 'customer_phone': '555'}])
+
+        self.assertEqual([r['status'] for r in results], ['retry', 'error'])
+        mock_claim.assert_not_called()
+        mock_insert.assert_not_called()
+
+    @patch('app.supabase')
+    def test_oversized_batch_is_rejected(self, mock_supabase):
+        """Test that one request cannot replay an unbounded batch"""
+        self._mock_lookup(mock_supabase)
+        actions = [{'id': str(i), 'type': 'claim'} for i in range(app_module.SYNC_BATCH_LIMIT + 1)]
+
+        response = self.client.post('/api/sync', json={'actions': actions})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_service_worker_is_served_from_root(self):
+        """Test that the service worker script is served at /sw.js"""
+        response = self.client.get('/sw.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        response.close()
+
+
+class TestCreditEvents(unittest.TestCase):
+    """Test cases for the live credit event stream"""
+
+    def setUp(self):
+        """Set up test client and mock environment"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_code'] = '1234'
+            sess['display_name'] = 'Test User'
+            sess['is_admin'] = False
+            sess['selected_store'] = 'STORE1'
+
+        self.broadcaster = app_module.CreditEventBroadcaster(buffer_size=2)
+        patcher = patch('app.credit_events', self.broadcaster)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish_fans_out_to_store_subscribers(self):
+        """Test that every subscriber of a store gets the event and no other store does"""
+        first = self.broadcaster.subscribe('STORE1')
+        second = self.broadcaster.subscribe('STORE1')
+        other = self.broadcaster.subscribe('STORE2')
+        
+        self.broadcaster.publish('STORE1', {'type': 'claim', 'code': 'ABC'})
+        
+        self.assertEqual(first.get_nowait()[1]['code'], 'ABC')
+        self.assertEqual(second.get_nowait()[1]['code'], 'ABC')
+        self.assertTrue(other.empty())
+
+    def test_slow_subscriber_is_evicted(self):
+        """Test that a full subscriber is dropped without blocking the others"""
+        slow = self.broadcaster.subscribe('STORE1')
+        fast = self.broadcaster.subscribe('STORE1')
+        
+        for code in ('AAA', 'BBB'):
+            self.broadcaster.publish('STORE1', {'type': 'claim', 'code': code})
+            fast.get_nowait()
+        self.broadcaster.publish('STORE1', {'type': 'claim', 'code': 'CCC'})
+        
+        self.assertTrue(slow.evicted)
+        self.assertFalse(fast.evicted)
+        self.assertEqual(fast.get_nowait()[1]['code'], 'CCC')
+        self.assertEqual(self.broadcaster.subscriber_count('STORE1'), 1)
+
+    @patch('app.supabase')
+    def test_claim_publishes_event(self, mock_supabase):
+        """Test that a successful claim is broadcast to the store"""
+        subscriber = self.broadcaster.subscribe('STORE1')
+        
+        user_check = Mock()
+        user_check.data = [{'code': '1234'}]
+        select_result = Mock()
+        select_result.data = [{'code': 'ABC', 'customer_name': 'John Doe'}]
+        update_result = Mock()
+        update_result.data = [{'code': 'ABC', 'status': 'claimed'}]
+        
+        mock_table = Mock()
+        mock_table.select.return_value.eq.return_value.execute.return_value = user_check
+        mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = select_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = update_result
+        mock_supabase.table.return_value = mock_table
+        
+        self.client.post('/claim-credit', data={'code': 'ABC'})
+        
+        _, event = subscriber.get_nowait()
+        self.assertEqual(event['type'], 'claim')
+        self.assertEqual(event['code'], 'ABC')
+        self.assertEqual(event['claimed_by_user'], '1234')
+
+    @patch('app.supabase')
+    def test_failed_claim_publishes_nothing(self, mock_supabase):
+        """Test that a claim that loses the race is not broadcast"""
+        subscriber = self.broadcaster.subscribe('STORE1')
+        
+        select_result = Mock()
+        select_result.data = [{'code': 'ABC', 'customer_name': 'John Doe'}]
+        update_result = Mock()
+        update_result.data = []
+        
+        mock_table = Mock()
+        mock_table.select.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = select_result
+        mock_table.update.return_value.eq.return_value.eq.return_value.eq.return_value.execute.return_value = update_result
+        mock_supabase.table.return_value = mock_table
+        
+        self.client.post('/claim-credit', data={'code': 'ABC'})
+        
+        self.assertTrue(subscriber.empty())
+
+    @patch('app.generate_code', return_value='XYZ')
+    @patch('app.supabase')
+    def test_create_publishes_tile_data(self, mock_supabase, mock_generate_code):
+        """Test that a new credit is broadcast with what its tile needs"""
+        subscriber = self.broadcaster.subscribe('STORE1')
+        
+        self.client.post('/create-credit', data={
+            'items': '["Widget", "Gadget"]',
+            'reason': 'Damaged',
+            'customer_name': 'Jane Doe',
+            'customer_phone': '555-1234'
+        })
+        
+        _, event = subscriber.get_nowait()
+        self.assertEqual(event['type'], 'create')
+        self.assertEqual(event['credit']['code'], 'XYZ')
+        self.assertEqual(event['credit']['items_display'], 'Widget, Gadget')
+        self.assertEqual(event['credit']['creator_display_name'], 'Test User')
+
+    @patch('app.supabase')
+    def test_event_stream_delivers_store_events(self, mock_supabase):
+        """Test that /events streams the selected store's events and cleans up on close"""
+        response = self.client.get('/events')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(self.broadcaster.subscriber_count('STORE1'), 1)
+        
+        self.broadcaster.publish('STORE1', {'type': 'unclaim', 'code': 'ABC'})
+        chunks = iter(response.response)
+        self.assertIn(b'retry:', next(chunks))
+        event_id = f'{self.broadcaster.process_id}-1'.encode()
+        self.assertEqual(next(chunks), b'id: ' + event_id + b'\ndata: {"type": "unclaim", "code": "ABC"}\n\n')
+        
+        response.close()
+        self.assertEqual(self.broadcaster.subscriber_count('STORE1'), 0)
+
+    def test_reconnect_resumes_after_the_last_event_seen(self):
+        """Test that events published between streams are replayed, and lost ones force a refresh"""
+        first = self.broadcaster.subscribe('STORE1')
+        self.broadcaster.publish('STORE1', {'type': 'claim', 'code': 'AAA'})
+        sequence, _ = first.get_nowait()
+        self.broadcaster.unsubscribe('STORE1', first)
+        self.broadcaster.publish('STORE1', {'type': 'claim', 'code': 'BBB'})
+        
+        resumed = self.broadcaster.subscribe('STORE1', f'{self.broadcaster.process_id}-{sequence}')
+        self.assertEqual(resumed.get_nowait()[1]['code'], 'BBB')
+        self.assertFalse(resumed.evicted)
+        
+        # Older than the buffer, or issued by another process
+        self.broadcaster.publish('STORE1', {'type': 'claim', 'code': 'CCC'})
+        self.assertTrue(self.broadcaster.subscribe('STORE1', f'{self.broadcaster.process_id}-0').evicted)
+        self.assertTrue(self.broadcaster.subscribe('STORE1', 'restarted-1').evicted)
+
+    @patch('app.supabase')
+    def test_streams_are_capped_and_bounded(self, mock_supabase):
+        """Test that streams beyond the cap are sent away and open streams end in time"""
+        broadcaster = app_module.CreditEventBroadcaster(buffer_size=2, max_streams=1)
+        with patch('app.credit_events', broadcaster), patch('app.SSE_MAX_STREAM_SECONDS', 0.05):
+            response = self.client.get('/events')
+            busy = self.client.get('/events')
+            self.assertEqual(list(busy.response), [b'retry: 30000\n\n'])
+            
+            # The open stream ends on its own, freeing its slot
+            chunks = list(response.response)
+            self.assertEqual(len(chunks), 1)
+            self.assertIn(b'retry: 5000', chunks[0])
+            response.close()
+            self.assertEqual(broadcaster.subscriber_count('STORE1'), 0)
+
+    def test_close_ends_open_streams(self):
+        """Test that shutting down ends streams and refuses new ones"""
+        subscriber = self.broadcaster.subscribe('STORE1')
+        
+        self.broadcaster.close()
+        
+        self.assertIsNone(subscriber.get_nowait())
+        self.assertIsNone(self.broadcaster.subscribe('STORE1'))
+
+
+class TestLocalBackend(unittest.TestCase):
+    """Test the app end to end against the SQLite stand-in in localbackend.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = LocalBackend().start()
+        cls.db = create_client(cls.backend.url, 'local-key')
+        cls.db.table('stores').insert([{'store_id': 'STORE1', 'name': 'Main'},
+                                       {'store_id': 'STORE2', 'name': 'Second'}]).execute()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.backend.stop()
+
+    def setUp(self):
+        """Set up test client logged in as the default admin"""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        patcher = patch('app.supabase', self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        self.client.post('/select-store', data={'store_id': 'STORE1'})
+
+    def test_credit_lifecycle(self):
+        """Test create, claim, a losing second claim and unclaim through the routes"""
+        with patch('app.generate_code', return_value='LIF'):
+            self.client.post('/create-credit', data={
+                'items': '["Item"]', 'reason': 'Test',
+                'customer_name': 'John Doe', 'customer_phone': '555-1234'
+            })
+        
+        self.client.post('/claim-credit', data={'code': 'LIF'})
+        second = self.client.post('/claim-credit', data={'code': 'LIF'}, follow_redirects=True)
+        self.assertIn('not found or already claimed', second.get_data(as_text=True))
+        
+        credit = self.db.table('credits').select('status, claimed_by_user').eq('code', 'LIF').execute().data[0]
+        self.assertEqual(credit, {'status': 'claimed', 'claimed_by_user': '4757'})
+        
+        self.client.post('/unclaim-credit', data={'code': 'LIF'})
+        credit = self.db.table('credits').select('status').eq('code', 'LIF').execute().data[0]
+        self.assertEqual(credit['status'], 'active')
+
+    def test_pages_render(self):
+        """Test that the dashboard and admin pages render from real query results"""
+        for path in ('/dashboard', '/dashboard/all', '/admin', '/admin/users', '/admin/stores',
+                     '/admin/assignments', '/admin/reports'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 200)
+
+    def _credit(self, code, store_id):
+        self.db.table('credits').insert({'code': code, 'items': '["Item"]', 'reason': 'Test',
+                                         'store_id': store_id, 'created_by': '4757'}).execute()
+
+    def test_codes_are_unique_per_store(self):
+        """Test that two stores may issue the same code but one store may not reuse it"""
+        self._credit('PER', 'STORE1')
+        self._credit('PER', 'STORE2')
+        with self.assertRaises(APIError) as raised:
+            self._credit('PER', 'STORE1')
+        self.assertEqual(raised.exception.code, '23505')
+
+    def test_claim_and_unclaim_stay_in_the_selected_store(self):
+        """Test that claiming a code shared by two stores only changes the selected store's credit"""
+        self._credit('TWN', 'STORE1')
+        self._credit('TWN', 'STORE2')
+
+        def statuses():
+            rows = self.db.table('credits').select('store_id, status').eq('code', 'TWN').execute().data
+            return {row['store_id']: row['status'] for row in rows}
+
+        self.client.post('/claim-credit', data={'code': 'TWN'})
+        self.assertEqual(statuses(), {'STORE1': 'claimed', 'STORE2': 'active'})
+
+        self.client.post('/select-store', data={'store_id': 'STORE2'})
+        self.client.post('/claim-credit', data={'code': 'TWN'})
+        self.client.post('/select-store', data={'store_id': 'STORE1'})
+        self.client.post('/unclaim-credit', data={'code': 'TWN'})
+        self.assertEqual(statuses(), {'STORE1': 'active', 'STORE2': 'claimed'})
+
+    def test_generated_codes_only_avoid_the_stores_own_codes(self):
+        """Test that a code taken in another store can still be generated"""
+        self._credit('GEN', 'STORE1')
+        with patch('app.random.choices', side_effect=[list('GEN'), list('NXT')]):
+            self.assertEqual(app_module.generate_code('STORE2'), 'GEN')
+        with patch('app.random.choices', side_effect=[list('GEN'), list('NXT')]):
+            self.assertEqual(app_module.generate_code('STORE1'), 'NXT')
+
+    def test_resubmissions_to_another_worker_are_applied_once(self):
+        """Test that a create or claim resubmitted to a process that never saw its key is recognised"""
+        def submit(path, data):
+            # A fresh store per request, as if each landed on a different worker
+            with patch('app.idempotency_keys', app_module.IdempotencyStore(max_keys=10, ttl_seconds=60)):
+                self.client.post(path, data=dict(data, idempotency_key='page-9'))
+            with self.client.session_transaction() as sess:
+                return sess.pop('_flashes', [])
+
+        with self.client.session_transaction() as sess:
+            sess.pop('_flashes', None)
+        form = {'items': '["Item"]', 'reason': 'Test', 'customer_name': 'John Doe', 'customer_phone': '555-1234'}
+        with patch('app.generate_code', side_effect=['WK1', 'WK2']):
+            first = submit('/create-credit', form)
+            second = submit('/create-credit', form)
+        self.assertEqual(first, [('success', 'Credit created successfully! Code: WK1')])
+        self.assertEqual(second, first)
+        self.assertEqual(self.db.table('credits').select('code').eq('client_ref', 'form-page-9').execute().data,
+                         [{'code': 'WK1'}])
+
+        submit('/claim-credit', {'code': 'WK1'})
+        self.assertEqual(submit('/claim-credit', {'code': 'WK1'}),
+                         [('success', 'Credit WK1 was already claimed by you')])
+
+    def test_constraint_violations_raise_api_errors(self):
+        """Test that unique violations reach the app as PostgREST errors"""
+        with self.assertRaises(APIError) as raised:
+            self.db.table('users').insert({'code': '4757', 'password': 'x'}).execute()
+        self.assertEqual(raised.exception.code, '23505')
+
+
+class TestClaimRaces(unittest.TestCase):
+    """Race claims and unclaims of the same codes from many threads
+
+    Each thread is a separate terminal with its own test client and login;
+    they share one SQLite stand-in from localbackend.py, whose conditional
+    updates are atomic like Postgres's.
+    """
+
+    codes = ['R%02d' % i for i in range(12)]
+    users = ['%04d' % (1001 + i) for i in range(7)]
+    # The default admin races too; it can unclaim credits others claimed
+    racers = users + ['4757']
+
+    def setUp(self):
+        """Set up a store, its credits and one assigned user per thread"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert({'store_id': 'STORE1', 'name': 'Main'}).execute()
+        self.db.table('users').insert([{'code': code, 'password': code, 'display_name': f'User {code}'}
+                                       for code in self.users]).execute()
+        self.db.table('user_stores').insert([{'user_code': code, 'store_id': 'STORE1'}
+                                             for code in self.users]).execute()
+        self.db.table('credits').insert([{'code': code, 'items': '["Item"]', 'reason': 'Race',
+                                          'store_id': 'STORE1', 'created_by': '4757', 'customer_name': 'John Doe'}
+                                         for code in self.codes]).execute()
+        patcher = patch('app.supabase', self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.config['TESTING'] = True
+        app.config['SECRET_KEY'] = 'test-secret-key'
+
+    def _terminal(self, user_code):
+        client = app.test_client()
+        client.post('/login', data={'code': user_code, 'password': user_code})
+        with client.session_transaction() as sess:
+            sess.pop('_flashes', None)
+        return client
+
+    def _post(self, client, path, code):
+        """Post a claim or unclaim and return whether it reported success"""
+        client.post(path, data={'code': code})
+        with client.session_transaction() as sess:
+            flashes = sess.pop('_flashes', [])
+        return any(category == 'success' for category, _ in flashes)
+
+    def _race(self, work):
+        """Run work(user_code, client) on one thread per user, all starting together"""
+        clients = {code: self._terminal(code) for code in self.racers}
+        start = threading.Barrier(len(self.racers))
+        results, errors = {}, []
+        
+        def run(user_code):
+            try:
+                start.wait()
+                results[user_code] = work(user_code, clients[user_code])
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=run, args=(code,)) for code in self.racers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(errors, [])
+        return results
+
+    def _credits(self):
+        rows = self.db.table('credits').select('code, status, claimed_at, claimed_by_user').execute().data
+        return {row['code']: row for row in rows}
+
+    def _assert_consistent(self, credits):
+        for row in credits.values():
+            if row['status'] == 'claimed':
+                self.assertTrue(row['claimed_at'] and row['claimed_by_user'], row)
+            else:
+                self.assertEqual((row['status'], row['claimed_at'], row['claimed_by_user']),
+                                 ('active', None, None))
+
+    def test_exactly_one_claim_wins_per_code(self):
+        """Test that every code is claimed by exactly one of the racing terminals"""
+        def claim_all(user_code, client):
+            codes = list(self.codes)
+            random.shuffle(codes)
+            return [code for code in codes if self._post(client, '/claim-credit', code)]
+        
+        won = self._race(claim_all)
+        
+        winners = {}
+        for user_code, codes in won.items():
+            for code in codes:
+                winners.setdefault(code, []).append(user_code)
+        self.assertEqual(sorted(winners), self.codes)
+        credits = self._credits()
+        for code, users in winners.items():
+            self.assertEqual(len(users), 1, f'{code} was claimed by {users}')
+            self.assertEqual(credits[code]['claimed_by_user'], users[0])
+        self._assert_consistent(credits)
+
+    def test_claim_unclaim_churn_stays_consistent(self):
+        """Test that racing claims and unclaims leave every credit in a consistent state"""
+        def churn(user_code, client):
+            tally = {code: 0 for code in self.codes}
+            for _ in range(2):
+                for code in random.sample(self.codes, len(self.codes)):
+                    if self._post(client, '/claim-credit', code):
+                        tally[code] += 1
+                    if self._post(client, '/unclaim-credit', code):
+                        tally[code] -= 1
+            return tally
+        
+        tallies = self._race(churn)
+        
+        credits = self._credits()
+        self._assert_consistent(credits)
+        for code in self.codes:
+            # Successful claims and unclaims of a code alternate, whoever
+            # makes them, so they differ by one exactly when it ends up claimed
+            net = sum(tally[code] for tally in tallies.values())
+            self.assertEqual(net, 1 if credits[code]['status'] == 'claimed' else 0, code)
+
+
+class TestQueryBudgets(unittest.TestCase):
+    """Hold every route to the database call budget it declares with query_budget()
+
+    Calls are counted as requests reaching the SQLite stand-in in
+    localbackend.py, so they include every round trip the real client makes.
+    """
+
+    # The live update stream and offline sync make calls in proportion to
+    # how long they stay open or how many queued actions they carry
+    unbudgeted = {'static', 'credit_event_stream', 'sync_actions'}
+
+    # (endpoint, method, path, form data), run in order as the default admin;
+    # each request takes its route's successful path
+    requests = [
+        ('login', 'POST', '/login', {'code': '4757', 'password': '4757'}),
+        ('index', 'GET', '/', None),
+        ('select_store', 'POST', '/select-store', {'store_id': 'STORE1'}),
+        ('dashboard', 'GET', '/dashboard', None),
+        ('consolidated_dashboard', 'GET', '/dashboard/all', None),
+        ('create_credit', 'POST', '/create-credit', {'items': '["Item"]', 'reason': 'Test',
+                                                     'customer_name': 'John Doe', 'customer_phone': '555-1234'}),
+        ('suggest_items', 'GET', '/items/suggest?q=it', None),
+        ('claim_credit', 'POST', '/claim-credit', {'code': 'BUD'}),
+        ('unclaim_credit', 'POST', '/unclaim-credit', {'code': 'BUD'}),
+        ('change_password', 'POST', '/change-password', {'current_password': '4757', 'new_password': '4757',
+                                                         'confirm_password': '4757'}),
+        ('service_worker', 'GET', '/sw.js', None),
+        ('admin_index', 'GET', '/admin', None),
+        ('admin_cache_json', 'GET', '/admin/cache.json', None),
+        ('admin_reports', 'GET', '/admin/reports', None),
+        ('admin_reports_json', 'GET', '/admin/reports.json', None),
+        ('admin_users', 'GET', '/admin/users', None),
+        ('admin_users_create', 'POST', '/admin/users/create', {'code': '1234', 'password': '1234',
+                                                               'display_name': 'Budget'}),
+        ('admin_users_edit', 'GET', '/admin/users/1234/edit', None),
+        ('admin_users_update', 'POST', '/admin/users/1234/update', {'code': '5678', 'display_name': 'Renamed'}),
+        ('admin_users_delete', 'POST', '/admin/users/5678/delete', None),
+        ('admin_stores', 'GET', '/admin/stores', None),
+        ('admin_stores_create', 'POST', '/admin/stores/create', {'store_id': 'STORE2', 'name': 'Second'}),
+        ('admin_assignments', 'GET', '/admin/assignments', None),
+        ('admin_assignments_create', 'POST', '/admin/assignments/create', {'user_code': '4757', 'store_id': 'STORE2'}),
+        ('admin_assignments_delete', 'POST', '/admin/assignments/delete', {'assignment_id': '1'}),
+        ('admin_lookup_users', 'GET', '/admin/lookup/users?q=47', None),
+        ('admin_lookup_stores', 'GET', '/admin/lookup/stores?q=ST', None),
+        ('admin_stores_delete', 'POST', '/admin/stores/STORE2/delete', None),
+        ('logout', 'GET', '/logout', None),
+    ]
+
+    def setUp(self):
+        """Set up a fresh SQLite stand-in with one store and one active credit"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert({'store_id': 'STORE1', 'name': 'Main'}).execute()
+        self.db.table('credits').insert({'code': 'BUD', 'items': '["Item"]', 'reason': 'Test',
+                                         'store_id': 'STORE1', 'created_by': '4757'}).execute()
+        patcher = patch('app.supabase', self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+
+    def _wait_for_background_loads(self):
+        # Loads started by a request count towards its budget
+        deadline = time.monotonic() + 5
+        while app_module.dashboard_cache._loading and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_every_route_declares_a_budget(self):
+        """Test that every route has a budget and a request exercising it"""
+        budgeted = {endpoint for endpoint, view in app.view_functions.items() if hasattr(view, 'query_budget')}
+        self.assertEqual(budgeted, set(app.view_functions) - self.unbudgeted)
+        self.assertEqual({endpoint for endpoint, *_ in self.requests}, budgeted)
+
+    def test_routes_stay_within_budget(self):
+        """Test that no route makes more database calls than its budget"""
+        for endpoint, method, path, data in self.requests:
+            with self.subTest(route=path):
+                before = self.backend.request_count
+                response = self.client.open(path, method=method, data=data)
+                self._wait_for_background_loads()
+                calls = self.backend.request_count - before
+                with self.client.session_transaction() as sess:
+                    errors = [message for category, message in sess.pop('_flashes', []) if category == 'error']
+                
+                self.assertLess(response.status_code, 400, path)
+                self.assertEqual(errors, [], path)
+                budget = app.view_functions[endpoint].query_budget
+                self.assertLessEqual(calls, budget, f'{path} made {calls} database calls, budget {budget}')
+
+
+class TestBackup(unittest.TestCase):
+    """Test dumping and restoring every table with backup.py"""
+
+    def setUp(self):
+        """Set up a primary and one shard holding one store's credits, and empty targets"""
+        self.backends = [LocalBackend().start() for _ in range(4)]
+        for backend in self.backends:
+            self.addCleanup(backend.stop)
+        self.primary, self.shard, self.new_primary, self.new_shard = [
+            create_client(backend.url, 'local-key') for backend in self.backends]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'backup.jsonl.gz')
+        
+        for db in (self.primary, self.shard):
+            db.table('users').insert({'code': '1001', 'password': '' if db is self.shard else 'pw',
+                                      'display_name': 'Cashier'}).execute()
+            db.table('stores').insert([{'store_id': 'WEST1', 'name': 'West'},
+                                       {'store_id': 'EAST1', 'name': 'East'}]).execute()
+        self.primary.table('user_stores').insert({'user_code': '1001', 'store_id': 'WEST1'}).execute()
+        for db, store_id in ((self.primary, 'WEST1'), (self.shard, 'EAST1')):
+            db.table('credits').insert([
+                {'code': f'{store_id[0]}{i:02d}', 'items': '["Item"]', 'reason': 'Test', 'store_id': store_id,
+                 'created_by': '1001', 'claimed_by_user': '4757' if i % 2 else None,
+                 'status': 'claimed' if i % 2 else 'active', 'claimed_at': '2024-01-02T00:00:00+00:00' if i % 2 else None}
+                for i in range(7)
+            ]).execute()
+
+    def _rows(self, db, table):
+        rows = db.table(table).select('*').execute().data
+        # Shard copies of users and stores are mirrors for foreign keys;
+        # their passwords and timestamps are their own
+        if db in (self.shard, self.new_shard) and table in ('users', 'stores'):
+            rows = [dict(row, password=None, created_at=None) for row in rows]
+        return sorted((dict(row, id=None) for row in rows), key=lambda row: json.dumps(row, sort_keys=True))
+
+    def _restore(self, **options):
+        new_dbs = {'EAST1': self.new_shard}
+        return backup.restore(self.path, self.new_primary, [self.new_shard],
+                              lambda store_id: new_dbs.get(store_id, self.new_primary),
+                              batch_size=3, out=io.StringIO(), **options)
+
+    def test_round_trip_restores_every_table(self):
+        """Test that a restore reproduces every table on the primary and the shard"""
+        dumped = backup.dump(self.path, self.primary, [self.primary, self.shard], batch_size=3,
+                             out=io.StringIO())
+        self.assertEqual(dumped, 2 + 2 + 1 + 14)
+        
+        self.assertEqual(self._restore(), dumped)
+        for source, target in ((self.primary, self.new_primary), (self.shard, self.new_shard)):
+            for table in ('users', 'stores', 'user_stores', 'credits', 'credit_daily_rollups'):
+                with self.subTest(table=table, shard=source is self.shard):
+                    self.assertEqual(self._rows(target, table), self._rows(source, table))
+
+    def test_restore_can_run_again(self):
+        """Test that restoring over already restored rows leaves one copy of each"""
+        backup.dump(self.path, self.primary, [self.primary, self.shard], out=io.StringIO())
+        self._restore()
+        self._restore()
+        self.assertEqual(len(self._rows(self.new_primary, 'credits')), 7)
+        self.assertEqual(len(self._rows(self.new_shard, 'users')), 2)
+
+    def test_restored_credits_are_not_sent_to_the_outbox(self):
+        """Test that a restore records no events for the sinks unless asked to"""
+        backup.dump(self.path, self.primary, [self.primary, self.shard], out=io.StringIO())
+        self._restore()
+        self.assertEqual(self.new_primary.table('credit_outbox').select('id').execute().data, [])
+        self.assertEqual(self.new_shard.table('credit_outbox').select('id').execute().data, [])
+
+    def test_restore_can_emit_events(self):
+        """Test that emit_events records a create for every restored credit"""
+        backup.dump(self.path, self.primary, [self.primary, self.shard], out=io.StringIO())
+        self._restore(emit_events=True)
+        events = self.new_shard.table('credit_outbox').select('event_type, code').execute().data
+        self.assertEqual(sorted(event['code'] for event in events), [f'E{i:02d}' for i in range(7)])
+        self.assertEqual({event['event_type'] for event in events}, {'create'})
+
+    def test_pages_use_keyset_cursors(self):
+        """Test that each table is read a page at a time, ending on an empty page"""
+        before = self.backends[0].request_count
+        rows = list(backup.page_rows(self.primary, 'credits', 3))
+        self.assertEqual([row['code'] for row in rows], [f'W{i:02d}' for i in range(7)])
+        self.assertEqual(self.backends[0].request_count - before, 4)
+
+    def test_rejects_other_files(self):
+        """Test that restore refuses a file that is not a backup archive"""
+        with gzip.open(self.path, 'wt') as archive:
+            archive.write('{"table": "users"}\n')
+        with self.assertRaises(ValueError):
+            self._restore()
+
+
+class TestOutbox(unittest.TestCase):
+    """Test the credit event outbox and its dispatcher against localbackend.py and a stand-in sink"""
+
+    def setUp(self):
+        """Set up a store, a logged-in admin and a receiver that accepts every batch"""
+        self.backend = LocalBackend().start()
+        self.addCleanup(self.backend.stop)
+        self.db = create_client(self.backend.url, 'local-key')
+        self.db.table('stores').insert({'store_id': 'STORE1', 'name': 'Main'}).execute()
+        self.responses = []
+        self.receiver = outbox.LocalReceiver(
+            respond=lambda events: self.responses.pop(0) if self.responses else (200, {})).start()
+        self.addCleanup(self.receiver.stop)
+        self.sink = outbox.HttpSink('pos', self.receiver.url, timeout=5)
+
+    def _credits(self, *codes):
+        self.db.table('credits').insert([{'code': code, 'items': '["Scarf", "Hat"]', 'reason': 'Test',
+                                          'store_id': 'STORE1', 'created_by': '4757'}
+                                         for code in codes]).execute()
+
+    def _lane(self, **options):
+        return outbox.OutboxLane('primary', self.db, self.sink, out=io.StringIO(), **options)
+
+    def _drain(self, lane, steps=20):
+        """Step until the lane has nothing left, returning the delays it asked for"""
+        delays = []
+        for _ in range(steps):
+            delay = lane.step()
+            if delay == lane.poll_seconds and not lane.pending():
+                return delays
+            delays.append(delay)
+        self.fail(f'Lane still busy after {steps} steps')
+
+    def _cursor(self):
+        return self.db.table('credit_outbox_cursors').select('last_id, last_error').eq('sink', 'pos').execute().data[0]
+
+    def test_credit_changes_write_events_with_the_change(self):
+        """Test that create, claim and unclaim routes each record one event, and failed claims none"""
+        app.config['TESTING'] = True
+        app.config['SECRET_KEY'] = 'test-secret-key'
+        client = app.test_client()
+        with patch('app.supabase', self.db), patch('app.generate_code', return_value='EVT'):
+            client.post('/login', data={'code': '4757', 'password': '4757'})
+            client.post('/select-store', data={'store_id': 'STORE1'})
+            client.post('/create-credit', data={'items': '["Item"]', 'reason': 'Test',
+                                                'customer_name': 'John Doe', 'customer_phone': '555-1234'})
+            client.post('/claim-credit', data={'code': 'EVT'})
+            client.post('/claim-credit', data={'code': 'EVT'})
+            client.post('/unclaim-credit', data={'code': 'EVT'})
+
+        rows = self.db.table('credit_outbox').select('event_type, code, payload').order('id').execute().data
+        self.assertEqual([(row['event_type'], row['code']) for row in rows],
+                         [('create', 'EVT'), ('claim', 'EVT'), ('unclaim', 'EVT')])
+        claim = json.loads(rows[1]['payload'])
+        self.assertEqual((claim['status'], claim['claimed_by_user'], claim['customer_name']),
+                         ('claimed', '4757', 'John Doe'))
+
+    def test_events_are_delivered_in_batches_and_in_order(self):
+        """Test that events go out batch_size at a time, in id order, and are then pruned"""
+        self._credits('B01', 'B02', 'B03', 'B04', 'B05')
+        lane = self._lane(batch_size=2)
+
+        self.assertEqual(self._drain(lane), [0, 0, 0])
+
+        self.assertEqual([len(events) for events, _ in self.receiver.batches], [2, 2, 1])
+        delivered = self.receiver.delivered()
+        self.assertEqual([event['code'] for event in delivered], ['B01', 'B02', 'B03', 'B04', 'B05'])
+        self.assertEqual(delivered[0]['type'], 'create')
+        self.assertEqual(delivered[0]['credit']['items'], ['Scarf', 'Hat'])
+        self.assertEqual(self._cursor()['last_id'], int(delivered[-1]['id'].split(':')[1]))
+        self.assertEqual(self.db.table('credit_outbox').select('id').execute().data, [])
+
+    def test_failures_back_off_and_honour_retry_after(self):
+        """Test that failed deliveries wait longer each time and resend the same events"""
+        self._credits('R01', 'R02')
+        self.responses = [(503, {}), (500, {}), (429, {'Retry-After': '30'})]
+        lane = self._lane()
+
+        delays = [lane.step() for _ in range(3)]
+        self.assertTrue(0.5 <= delays[0] <= 1 <= delays[1] <= 2, delays)
+        self.assertEqual(delays[2], 30)
+        self.assertEqual(self._cursor(), {'last_id': 0, 'last_error': 'HTTP 429: '})
+
+        self.assertEqual(lane.step(), 0)
+        self.assertEqual([event['code'] for event in self.receiver.delivered()], ['R01', 'R02'])
+        self.assertEqual(len(self.receiver.batches), 4)
+        self.assertEqual(self._cursor()['last_id'], 2)
+
+    def test_unreachable_sink_is_retried(self):
+        """Test that connection failures are retried without moving the cursor"""
+        self._credits('U01')
+        lane = outbox.OutboxLane('primary', self.db, outbox.HttpSink('down', 'http://127.0.0.1:1/', timeout=1),
+                                 out=io.StringIO())
+        self.assertGreater(lane.step(), 0)
+        self.assertEqual(lane.cursor, 0)
+
+    def test_rejected_event_is_isolated_and_skipped(self):
+        """Test that a batch refused over one event is split until only that event is skipped"""
+        self._credits('K01', 'K02', 'BAD', 'K04', 'K05')
+        self.receiver.respond = lambda events: (
+            (422, {}) if any(event['code'] == 'BAD' for event in events) else (200, {}))
+        lane = self._lane(batch_size=4)
+
+        self._drain(lane)
+
+        self.assertEqual([event['code'] for event in self.receiver.delivered()], ['K01', 'K02', 'K04', 'K05'])
+        self.assertIn('skipped', self._cursor()['last_error'])
+
+    def test_gap_waits_until_settled(self):
+        """Test that a lane stops at a missing id until the event after it is old enough"""
+        self._credits('G01')
+        first = self.db.table('credit_outbox').select('*').execute().data[0]
+        # An id left unused by a transaction that may still commit
+        self.db.table('credit_outbox').insert(dict(first, id=first['id'] + 2)).execute()
+        lane = self._lane(settle_seconds=60)
+
+        self._drain(lane)
+        self.assertEqual(len(self.receiver.delivered()), 1)
+
+        lane.settle_seconds = 0
+        self._drain(lane)
+        self.assertEqual(len(self.receiver.delivered()), 2)
+
+    def test_dispatcher_runs_lanes_in_the_background(self):
+        """Test that the dispatcher's threads deliver events and stop when closed"""
+        self._credits('D01', 'D02')
+        dispatcher = outbox.OutboxDispatcher([('primary', self.db)], [self.sink], poll_seconds=0.05,
+                                             out=io.StringIO()).start()
+        deadline = time.monotonic() + 10
+        while len(self.receiver.delivered()) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        dispatcher.close(timeout=5)
+        self.assertEqual([event['id'] for event in self.receiver.delivered()], ['primary:1', 'primary:2'])
+
+
+class TestStoreSharding(unittest.TestCase):
+    """Test store-based sharding against two SQLite stand-ins from localbackend.py"""
+
+    def setUp(self):
+        """Set up a primary and one shard, and log in as the default admin"""
+        self.primary_backend = LocalBackend().start()
+        self.shard_backend = LocalBackend().start()
+        self.addCleanup(self.primary_backend.stop)
+        self.addCleanup(self.shard_backend.stop)
+        self.primary = create_client(self.primary_backend.url, 'local-key')
+        self.shard = create_client(self.shard_backend.url, 'local-key')
+        
+        for patcher in (patch('app.supabase', self.primary),
+                        patch('app.shard_clients', {'east': self.shard}),
+                        patch('app.STORE_SHARDS', {'EAST1': 'east'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        for store_id in ('WEST1', 'EAST1'):
+            self.client.post('/admin/stores/create', data={'store_id': store_id, 'name': store_id.title()})
+
+    def _create_credit(self, store_id, code):
+        self.client.post('/select-store', data={'store_id': store_id})
+        with patch('app.generate_code', return_value=code):
+            self.client.post('/create-credit', data={
+                'items': '["Item"]', 'reason': 'Test',
+                'customer_name': 'John Doe', 'customer_phone': '555-1234'
+            })
+
+    def _codes(self, db):
+        return sorted(row['code'] for row in db.table('credits').select('code').execute().data)
+
+    def test_stores_are_mirrored_to_shards(self):
+        """Test that store rows reach the shard so credits can reference them"""
+        shard_stores = self.shard.table('stores').select('store_id').execute().data
+        self.assertEqual(sorted(row['store_id'] for row in shard_stores), ['EAST1', 'WEST1'])
+
+    def test_credits_are_routed_by_store(self):
+        """Test that create, claim and unclaim go to the selected store's database"""
+        self._create_credit('WEST1', 'WWW')
+        self._create_credit('EAST1', 'EEE')
+        
+        self.assertEqual(self._codes(self.primary), ['WWW'])
+        self.assertEqual(self._codes(self.shard), ['EEE'])
+        
+        self.client.post('/claim-credit', data={'code': 'EEE'})
+        claimed = self.shard.table('credits').select('status').eq('code', 'EEE').execute().data
+        self.assertEqual(claimed, [{'status': 'claimed'}])
+        
+        html = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('data-code="EEE"', html)
+        self.assertNotIn('data-code="WWW"', html)
+
+    def test_admin_views_gather_from_every_database(self):
+        """Test that cross-store admin views include credits from all databases"""
+        self._create_credit('WEST1', 'WWW')
+        self._create_credit('EAST1', 'EEE')
+        
+        html = self.client.get('/dashboard/all').get_data(as_text=True)
+        self.assertIn('<td><strong>WWW</strong></td>', html)
+        self.assertIn('<td><strong>EEE</strong></td>', html)
+        
+        report = self.client.get('/admin/reports.json').get_json()
+        self.assertEqual(report['total_issued'], 2)
+        self.assertEqual(sorted(day['store_id'] for day in report['days']), ['EAST1', 'WEST1'])
+        
+        self.assertIn('<h3>2</h3>', self.client.get('/admin').get_data(as_text=True))
+
+    def test_merged_pages_are_ordered_newest_first(self):
+        """Test that paging across databases keeps global created_at order"""
+        for i, store_id in enumerate(['WEST1', 'EAST1', 'EAST1', 'WEST1', 'EAST1']):
+            self._create_credit(store_id, f'C{i}X')
+        
+        pages = [app_module.fetch_credit_page(None, page, page_size=2) for page in (1, 2, 3)]
+        
+        self.assertEqual([[row['code'] for row in rows] for rows, _ in pages],
+                         [['C4X', 'C3X'], ['C2X', 'C1X'], ['C0X']])
+        self.assertEqual([has_next for _, has_next in pages], [True, True, False])
+
+    def test_user_changes_are_mirrored(self):
+        """Test that user create, rename and delete reach the shard copy"""
+        self.client.post('/admin/users/create', data={
+            'code': '1234', 'password': 'secret', 'display_name': 'Shard User'
+        })
+        copy = self.shard.table('users').select('code, password, display_name').eq('code', '1234').execute().data
+        self.assertEqual(copy, [{'code': '1234', 'password': '', 'display_name': 'Shard User'}])
+        
+        self.client.post('/admin/users/1234/update', data={'code': '1234', 'display_name': 'Renamed'})
+        copy = self.shard.table('users').select('display_name').eq('code', '1234').execute().data
+        self.assertEqual(copy, [{'display_name': 'Renamed'}])
+        
+        self.client.post('/admin/users/1234/delete')
+        self.assertEqual(self.shard.table('users').select('code').eq('code', '1234').execute().data, [])
+
+
+# Tests that need a real database run against the PostgreSQL instance named by
+# TEST_DATABASE_URL. Each test class works in its own scratch schema, which is
+# dropped afterwards, so any disposable database will do.
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and psycopg, 'TEST_DATABASE_URL and psycopg are required')
+class PostgresTestCase(unittest.TestCase):
+    """Base class that loads schema.sql into a scratch schema"""
+
+    schema_name = 'domcredsys_test'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg.connect(TEST_DATABASE_URL, autocommit=True)
+        cls.conn.execute(f'DROP SCHEMA IF EXISTS {cls.schema_name} CASCADE')
+        cls.conn.execute(f'CREATE SCHEMA {cls.schema_name}')
+        cls.conn.execute(f'SET search_path TO {cls.schema_name}')
+        with open(SCHEMA_PATH) as f:
+            cls.conn.execute(f.read())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.execute(f'DROP SCHEMA IF EXISTS {cls.schema_name} CASCADE')
+        cls.conn.close()
+
+
+class TestQueryPlans(PostgresTestCase):
+    """Plan regression tests for the hot queries issued by app.py
+
+    Loads a synthetic dataset (1M credits by default, override with
+    PLAN_TEST_CREDITS) and fails if any hot query plans a sequential scan
+    over a large table.
+    """
+
+    schema_name = 'domcredsys_plan_test'
+    large_tables = {'credits', 'user_stores'}
+
+    # SQL equivalents of the PostgREST requests made by the routes
+    hot_queries = {
+        'claim_check': """
+            SELECT * FROM credits
+            WHERE code = 'C500000' AND store_id = 'S0042' AND status = 'active'
+        """,
+        'claim_update': """
+            UPDATE credits SET status = 'claimed'
+            WHERE code = 'C500000' AND store_id = 'S0042' AND status = 'active'
+        """,
+        'unclaim_check': """
+            SELECT * FROM credits
+            WHERE code = 'C500000' AND store_id = 'S0042' AND status = 'claimed'
+        """,
+        'generate_code': """
+            SELECT code FROM credits WHERE code = 'ZZZ' AND store_id = 'S0042'
+        """,
+        'dashboard': """
+            SELECT c.*, u.display_name FROM credits c
+            LEFT JOIN users u ON u.code = c.created_by
+            WHERE c.store_id = 'S0042'
+            ORDER BY c.created_at DESC
+        """,
+        'dashboard_stream_page': """
+            SELECT c.*, u.display_name FROM credits c
+            LEFT JOIN users u ON u.code = c.created_by
+            WHERE c.store_id = 'S0042' AND c.created_at <= now() - interval '30 days'
+              AND (c.created_at < now() - interval '30 days'
+                   OR (c.created_at = now() - interval '30 days' AND c.id < 900000))
+            ORDER BY c.created_at DESC, c.id DESC LIMIT 500
+        """,
+        'consolidated_all': """
+            SELECT c.*, u.display_name FROM credits c
+            LEFT JOIN users u ON u.code = c.created_by
+            ORDER BY c.created_at DESC LIMIT 51
+        """,
+        'consolidated_stores': """
+            SELECT c.*, u.display_name FROM credits c
+            LEFT JOIN users u ON u.code = c.created_by
+            WHERE c.store_id IN ('S0042', 'S0043', 'S0044')
+            ORDER BY c.created_at DESC LIMIT 51
+        """,
+        'get_user_stores': """
+            SELECT us.store_id, s.* FROM user_stores us
+            LEFT JOIN stores s ON s.store_id = us.store_id
+            WHERE us.user_code = '1042'
+        """,
+        'rename_user_credits': """
+            UPDATE credits SET created_by = created_by WHERE created_by = '1042'
+        """,
+        'rename_user_claims': """
+            UPDATE credits SET claimed_by_user = claimed_by_user WHERE claimed_by_user = '1042'
+        """,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        credits = int(os.environ.get('PLAN_TEST_CREDITS', '1000000'))
+        cls.conn.execute("""
+            INSERT INTO users (code, password, display_name)
+            SELECT (1000 + g)::text, 'x', 'User ' || g FROM generate_series(0, 1999) g
+            ON CONFLICT (code) DO NOTHING
+        """)
+        cls.conn.execute("""
+            INSERT INTO stores (store_id, name)
+            SELECT 'S' || lpad(g::text, 4, '0'), 'Store ' || g FROM generate_series(0, 199) g
+        """)
+        cls.conn.execute("""
+            INSERT INTO user_stores (user_code, store_id)
+            SELECT (1000 + u)::text, 'S' || lpad(((u * 7 + k) % 200)::text, 4, '0')
+            FROM generate_series(0, 1999) u, generate_series(0, 2) k
+        """)
+        # Rollup triggers are not under test here and would only slow the load
+        cls.conn.execute('ALTER TABLE credits DISABLE TRIGGER USER')
+        cls.conn.execute("""
+            INSERT INTO credits (code, items, reason, store_id, status, created_at,
+                                 claimed_at, claimed_by, claimed_by_user, created_by,
+                                 customer_name, customer_phone)
+            SELECT 'C' || g, '["Item"]', 'Synthetic', 'S' || lpad((g %% 200)::text, 4, '0'),
+                   CASE WHEN g %% 5 = 0 THEN 'active' ELSE 'claimed' END,
+                   now() - (g %% 1000) * interval '1 day',
+                   CASE WHEN g %% 5 = 0 THEN NULL ELSE now() END,
+                   CASE WHEN g %% 5 = 0 THEN NULL ELSE 'User' END,
+                   CASE WHEN g %% 5 = 0 THEN NULL ELSE (1000 + g %% 2000)::text END,
+                   (1000 + g %% 2000)::text, 'Customer ' || g, '555-' || g
+            FROM generate_series(1, %s) g
+        """, (credits,))
+        cls.conn.execute('ALTER TABLE credits ENABLE TRIGGER USER')
+        cls.conn.execute('ANALYZE')
+
+    def _plan(self, sql):
+        # EXPLAIN without ANALYZE so UPDATEs are planned but not executed
+        row = self.conn.execute('EXPLAIN (FORMAT JSON) ' + sql).fetchone()
+        plan = row[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def _seq_scans(self, node):
+        found = []
+        if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') in self.large_tables:
+            found.append(node['Relation Name'])
+        for child in node.get('Plans', []):
+            found.extend(self._seq_scans(child))
+        return found
+
+    def test_hot_queries_use_indexes(self):
+        """Test that no hot query falls back to a sequential scan"""
+        for name, sql in self.hot_queries.items():
+            with self.subTest(query=name):
+                self.assertEqual(self._seq_scans(self._plan(sql)), [])
+
+    def _indexes(self, node):
+        found = set()
+        if node.get('Index Name'):
+            found.add(node['Index Name'])
+        for child in node.get('Plans', []):
+            found |= self._indexes(child)
+        return found
+
+    def test_hot_queries_use_composite_indexes(self):
+        """Test that the claim and dashboard queries use the indexes built for them"""
+        self.assertIn('credits_store_id_code_key',
+                      self._indexes(self._plan(self.hot_queries['claim_check'])))
+        self.assertIn('idx_credits_store_created',
+                      self._indexes(self._plan(self.hot_queries['dashboard'])))
+        self.assertIn('idx_credits_store_created',
+                      self._indexes(self._plan(self.hot_queries['dashboard_stream_page'])))
+        self.assertIn('idx_credits_created_at',
+                      self._indexes(self._plan(self.hot_queries['consolidated_all'])))
+
+
+class TestPartitionedQueryPlans(TestQueryPlans):
+    """Plan tests for the hot queries once partition_credits() has run
+
+    Loads the same synthetic dataset (spread over about 33 months), converts
+    credits to monthly partitions and reruns the plan checks, then checks
+    that created_at bounds prune partitions.
+    """
+
+    schema_name = 'domcredsys_partition_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A legacy credit from before created_at had a default
+        cls.conn.execute("""
+            INSERT INTO credits (code, items, reason, store_id, created_at, created_by)
+            VALUES ('LEGACY', '["Item"]', 'Legacy', 'S0042', NULL, '1042')
+        """)
+        cls.conn.execute('SELECT partition_credits()')
+        cls.conn.execute('ANALYZE')
+        partitions = cls.conn.execute("""
+            SELECT c.relname, c.reltuples > 0 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'credits'::regclass
+        """).fetchall()
+        cls.partitions = {name for name, _ in partitions}
+        # The months ahead are empty until they start, and a sequential scan
+        # of an empty partition costs nothing
+        cls.large_tables = cls.large_tables | {name for name, has_rows in partitions if has_rows}
+
+    def _parent_indexes(self, node):
+        """Map the partition indexes a plan uses to the indexes declared on credits"""
+        rows = self.conn.execute("""
+            SELECT p.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relname = ANY(%s)
+        """, (list(self._indexes(node)),)).fetchall()
+        return {name for name, in rows}
+
+    def _partitions_scanned(self, node, with_rows=False):
+        """Partitions a plan reads; with_rows, those an analyzed plan read rows from"""
+        found = set()
+        if node.get('Relation Name') in self.partitions and (not with_rows or node.get('Actual Rows')):
+            found.add(node['Relation Name'])
+        for child in node.get('Plans', []):
+            found |= self._partitions_scanned(child, with_rows)
+        return found
+
+    def test_rows_are_spread_over_monthly_partitions(self):
+        """Test that every credit was kept and the months ahead exist"""
+        credits = int(os.environ.get('PLAN_TEST_CREDITS', '1000000'))
+        self.assertEqual(self.conn.execute('SELECT count(*) FROM credits').fetchone()[0], credits + 1)
+        self.assertGreaterEqual(len(self.partitions), 1000 // 31 + 3)
+        ahead = self.conn.execute(
+            "SELECT to_regclass(credit_partition_name(now() + interval '3 months'))").fetchone()[0]
+        self.assertIsNotNone(ahead)
+
+    def test_credits_without_created_at_are_dated_to_the_oldest(self):
+        """Test that conversion dates legacy credits instead of failing on them, and counts them in rollups"""
+        created_at, oldest = self.conn.execute(
+            "SELECT created_at, (SELECT min(created_at) FROM credits) FROM credits WHERE code = 'LEGACY'").fetchone()
+        self.assertEqual(created_at, oldest)
+        issued = self.conn.execute("""
+            SELECT issued FROM credit_daily_rollups
+            WHERE store_id = 'S0042' AND user_code = '1042' AND day = (%s AT TIME ZONE 'UTC')::date
+        """, (created_at,)).fetchone()
+        self.assertEqual(issued, (1,))
+
+    def test_hot_queries_use_composite_indexes(self):
+        """Test that the claim and dashboard queries use the indexes built for them"""
+        self.assertIn('idx_credits_store_code',
+                      self._parent_indexes(self._plan(self.hot_queries['claim_check'])))
+        self.assertIn('idx_credits_store_created',
+                      self._parent_indexes(self._plan(self.hot_queries['dashboard'])))
+        self.assertIn('idx_credits_store_created',
+                      self._parent_indexes(self._plan(self.hot_queries['dashboard_stream_page'])))
+        self.assertIn('idx_credits_created_at',
+                      self._parent_indexes(self._plan(self.hot_queries['consolidated_all'])))
+
+    def test_claim_update_is_pruned_to_one_partition(self):
+        """Test that matching the checked credit's created_at updates a single partition"""
+        code, store_id, created_at = self.conn.execute(
+            "SELECT code, store_id, created_at FROM credits WHERE status = 'active' LIMIT 1").fetchone()
+        for status in ('active', 'claimed'):
+            with self.subTest(status=status):
+                plan = self._plan(f"""
+                    UPDATE credits SET status = status
+                    WHERE code = '{code}' AND store_id = '{store_id}' AND status = '{status}'
+                      AND created_at = '{created_at.isoformat()}'
+                """)
+                self.assertEqual(len(self._partitions_scanned(plan)), 1)
+
+    def test_latest_credits_read_only_the_newest_partitions(self):
+        """Test that the all-stores dashboard stops before reaching older months"""
+        row = self.conn.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + self.hot_queries['consolidated_all']).fetchone()
+        plan = row[0] if not isinstance(row[0], str) else json.loads(row[0])
+        # Newest months first: the rows come from this month (and the last
+        # one early in a month) and older partitions are never executed
+        self.assertLessEqual(len(self._partitions_scanned(plan[0]['Plan'], with_rows=True)), 2)
+
+    def test_codes_stay_unique_per_store_across_partitions(self):
+        """Test that a store cannot reuse a code in another month, but another store can"""
+        insert = """
+            INSERT INTO credits (code, items, reason, store_id, created_at)
+            VALUES ('DUPX', '["Item"]', 'Test', %s, now() - %s * interval '1 day')
+        """
+        self.conn.execute(insert, ('S0001', 0))
+        self.addCleanup(self.conn.execute, "DELETE FROM credits WHERE code = 'DUPX'")
+        with self.assertRaises(psycopg.errors.UniqueViolation):
+            self.conn.execute(insert, ('S0001', 400))
+        self.conn.execute(insert, ('S0002', 400))
+
+    def test_create_credit_partitions_is_idempotent(self):
+        """Test that maintenance adds further months and can run repeatedly"""
+        self.conn.execute('SELECT create_credit_partitions(6)')
+        self.conn.execute('SELECT create_credit_partitions(6)')
+        ahead = self.conn.execute(
+            "SELECT to_regclass(credit_partition_name(now() + interval '6 months'))").fetchone()[0]
+        self.assertIsNotNone(ahead)
+
+
+class TestPartitionedRestore(PostgresTestCase):
+    """Test restoring a backup.py archive into partitioned credits on the direct backend"""
+
+    schema_name = 'domcredsys_restore_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.conn.execute('SELECT partition_credits()')
+        dsn = psycopg.conninfo.make_conninfo(TEST_DATABASE_URL, options=f'-csearch_path={cls.schema_name}')
+        cls.db = pgbackend.PostgresClient(dsn, pool_size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        super().tearDownClass()
+
+    def test_restore_inserts_credits_the_store_does_not_have(self):
+        """Test that a restore, and a second run over it, leave one copy of every credit"""
+        source_backend = LocalBackend().start()
+        self.addCleanup(source_backend.stop)
+        source = create_client(source_backend.url, 'local-key')
+        source.table('stores').insert({'store_id': 'WEST1', 'name': 'West'}).execute()
+        source.table('credits').insert([
+            {'code': f'W{i:02d}', 'items': '["Item"]', 'reason': 'Test', 'store_id': 'WEST1',
+             'created_by': '4757', 'created_at': f'2024-0{i % 3 + 1}-01T00:00:00+00:00'}
+            for i in range(7)
+        ]).execute()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'backup.jsonl.gz')
+        backup.dump(path, source, [source], out=io.StringIO())
+        
+        for _ in range(2):
+            backup.restore(path, self.db, [], lambda store_id: self.db, batch_size=3, out=io.StringIO())
+        codes = self.conn.execute("SELECT code FROM credits WHERE store_id = 'WEST1' ORDER BY code").fetchall()
+        self.assertEqual([code for code, in codes], [f'W{i:02d}' for i in range(7)])
+        held = self.conn.execute("SELECT count(*) FROM credit_codes WHERE store_id = 'WEST1'").fetchone()
+        self.assertEqual(held, (7,))
+        self.assertEqual(self.conn.execute('SELECT count(*) FROM credit_outbox').fetchone(), (0,))
+
+
+class TestCreditRollupTriggers(PostgresTestCase):
+    """Test that the rollup triggers keep credit_daily_rollups in sync"""
+
+    schema_name = 'domcredsys_rollup_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.conn.execute("""
+            INSERT INTO users (code, password, display_name)
+            VALUES ('1111', 'x', 'One'), ('2222', 'x', 'Two')
+        """)
+        cls.conn.execute("INSERT INTO stores (store_id, name) VALUES ('S1', 'One'), ('S2', 'Two')")
+
+    def _rollups(self):
+        rows = self.conn.execute("""
+            SELECT store_id, day, user_code, issued, claimed FROM credit_daily_rollups
+            WHERE issued <> 0 OR claimed <> 0
+        """).fetchall()
+        return sorted(rows)
+
+    def _recomputed(self):
+        rows = self.conn.execute("""
+            SELECT store_id, day, user_code, SUM(issued)::int, SUM(claimed)::int FROM (
+                SELECT store_id, (created_at AT TIME ZONE 'UTC')::date AS day,
+                       COALESCE(created_by, '') AS user_code, 1 AS issued, 0 AS claimed
+                FROM credits WHERE created_at IS NOT NULL
+                UNION ALL
+                SELECT store_id, (COALESCE(claimed_at, created_at) AT TIME ZONE 'UTC')::date,
+                       COALESCE(claimed_by_user, ''), 0, 1
+                FROM credits WHERE status = 'claimed' AND created_at IS NOT NULL
+            ) c GROUP BY 1, 2, 3
+        """).fetchall()
+        return sorted(rows)
+
+    def test_rollups_follow_credit_lifecycle(self):
+        """Test create, claim, unclaim, reassignment and delete against a full recompute"""
+        self.conn.execute("""
+            INSERT INTO credits (code, items, reason, store_id, created_by, created_at)
+            VALUES ('AAA', 'i', 'r', 'S1', '1111', '2026-01-01T10:00:00Z'),
+                   ('BBB', 'i', 'r', 'S1', '1111', '2026-01-01T11:00:00Z'),
+                   ('CCC', 'i', 'r', 'S2', '2222', '2026-01-02T09:00:00Z'),
+                   ('DDD', 'i', 'r', 'S2', NULL, '2026-01-02T09:00:00Z')
+        """)
+        self.assertEqual(self._rollups(), self._recomputed())
+
+        self.conn.execute("""
+            UPDATE credits SET status = 'claimed', claimed_at = '2026-01-03T12:00:00Z',
+                               claimed_by = 'Two', claimed_by_user = '2222'
+            WHERE code IN ('AAA', 'CCC')
+        """)
+        self.assertEqual(self._rollups(), self._recomputed())
+
+        self.conn.execute("""
+            UPDATE credits SET status = 'active', claimed_at = NULL, claimed_by = NULL,
+                               claimed_by_user = NULL
+            WHERE code = 'AAA'
+        """)
+        self.assertEqual(self._rollups(), self._recomputed())
+
+        # Untracked columns leave the rollups untouched
+        self.conn.execute("UPDATE credits SET customer_name = 'Someone' WHERE code = 'CCC'")
+        self.conn.execute("UPDATE credits SET created_by = '2222' WHERE code = 'BBB'")
+        self.assertEqual(self._rollups(), self._recomputed())
+
+        self.conn.execute("DELETE FROM credits WHERE code IN ('CCC', 'DDD')")
+        self.assertEqual(self._rollups(), self._recomputed())
+
+    def test_legacy_credits_without_created_at(self):
+        """Test that the first-run backfill and the triggers leave out credits until they are dated"""
+        self.conn.execute("""
+            INSERT INTO credits (code, items, reason, store_id, created_by, created_at, status,
+                                 claimed_at, claimed_by_user)
+            VALUES ('LG1', 'i', 'r', 'S1', '1111', NULL, 'claimed', '2026-02-01T12:00:00Z', '2222'),
+                   ('LG2', 'i', 'r', 'S1', '1111', NULL, 'active', NULL, NULL)
+        """)
+        self.assertEqual(self._rollups(), self._recomputed())
+        
+        # Run the first-run backfill over them
+        self.conn.execute('TRUNCATE credit_daily_rollups')
+        with open(SCHEMA_PATH) as f:
+            self.conn.execute(f.read())
+        self.assertEqual(self._rollups(), self._recomputed())
+        
+        self.conn.execute("""
+            UPDATE credits SET status = 'active', claimed_at = NULL, claimed_by_user = NULL WHERE code = 'LG1'
+        """)
+        self.assertEqual(self._rollups(), self._recomputed())
+        
+        self.conn.execute("""
+            UPDATE credits SET created_at = '2026-01-05T00:00:00Z', status = 'claimed',
+                               claimed_at = NULL, claimed_by_user = '2222'
+            WHERE code IN ('LG1', 'LG2')
+        """)
+        self.conn.execute("UPDATE credits SET status = 'active', claimed_by_user = NULL WHERE code = 'LG2'")
+        self.assertEqual(self._rollups(), self._recomputed())
+        
+        self.conn.execute("DELETE FROM credits WHERE code IN ('LG1', 'LG2')")
+        self.assertEqual(self._rollups(), self._recomputed())
+
+    def test_store_counts_match_credits(self):
+        """Test that credit_store_counts() agrees with counting credits directly"""
+        self.conn.execute("""
+            INSERT INTO credits (code, items, reason, store_id, created_by, status,
+                                 claimed_at, claimed_by_user)
+            VALUES ('EEE', 'i', 'r', 'S1', '1111', 'active', NULL, NULL),
+                   ('FFF', 'i', 'r', 'S1', '2222', 'claimed', now(), '1111'),
+                   ('GGG', 'i', 'r', 'S2', '2222', 'claimed', now(), NULL)
+        """)
+        expected = sorted(self.conn.execute("""
+            SELECT store_id, COUNT(*) FILTER (WHERE status = 'active'),
+                   COUNT(*) FILTER (WHERE status = 'claimed')
+            FROM credits GROUP BY store_id
+        """).fetchall())
+        
+        counts = self.conn.execute('SELECT * FROM credit_store_counts()').fetchall()
+        self.assertEqual(sorted(counts), expected)
+        
+        only_s2 = self.conn.execute("SELECT * FROM credit_store_counts(ARRAY['S2'])").fetchall()
+        self.assertEqual(only_s2, [row for row in expected if row[0] == 'S2'])
+
+
+class TestPostgresBackend(PostgresTestCase):
+    """Test the routes end to end on the direct PostgreSQL backend in pgbackend.py"""
+
+    schema_name = 'domcredsys_direct_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.conn.execute("INSERT INTO stores (store_id, name) VALUES ('STORE1', 'Main')")
+        dsn = psycopg.conninfo.make_conninfo(TEST_DATABASE_URL, options=f'-csearch_path={cls.schema_name}')
+        cls.db = pgbackend.PostgresClient(dsn, pool_size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        """Set up test client logged in as the default admin"""
+        for patcher in (patch('app.supabase', self.db),
+                        patch('app.dashboard_cache', app_module.StaleWhileRevalidateCache(
+                            app_module.LocalCacheBackend(10), app_module.ThreadPoolExecutor(2)))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret-key'
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'code': '4757', 'password': '4757'})
+        self.client.post('/select-store', data={'store_id': 'STORE1'})
+
+    def test_credit_lifecycle(self):
+        """Test create, claim, a losing second claim and unclaim through the routes"""
+        with patch('app.generate_code', return_value='PGD'):
+            self.client.post('/create-credit', data={
+                'items': '["Item"]', 'reason': 'Test',
+                'customer_name': 'John Doe', 'customer_phone': '555-1234'
+            })
+        html = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('data-code="PGD"', html)
+        
+        self.client.post('/claim-credit', data={'code': 'PGD'})
+        second = self.client.post('/claim-credit', data={'code': 'PGD'}, follow_redirects=True)
+        self.assertIn('not found or already claimed', second.get_data(as_text=True))
+        credit = self.db.table('credits').select('status, claimed_by_user').eq('code', 'PGD').execute().data[0]
+        self.assertEqual(credit, {'status': 'claimed', 'claimed_by_user': '4757'})
+        
+        self.client.post('/unclaim-credit', data={'code': 'PGD'})
+        credit = self.db.table('credits').select('status').eq('code', 'PGD').execute().data[0]
+        self.assertEqual(credit['status'], 'active')
+
+    def test_streamed_dashboard_matches_the_cached_one(self):
+        """Test that keyset pages over tied and out-of-id-order created_at values match the unpaged query"""
+        self.db.table('credits').insert([
+            {'code': code, 'items': '["Item"]', 'reason': 'Restored', 'store_id': 'STORE1', 'created_by': '4757',
+             'created_at': created_at}
+            for code, created_at in [('PR3', '2020-01-03T00:00:00+00:00'), ('PR1', '2020-01-01T00:00:00+00:00'),
+                                     ('PR2', '2020-01-02T00:00:00.5+00:00'), ('PR0', '2020-01-02T00:00:00.5+00:00')]
+        ]).execute()
+        codes = lambda html: [part[:part.index('"')] for part in html.split('data-code="')[1:]]
+        with patch('app.STREAM_RENDERING', True), patch('app.STREAM_PAGE_SIZE', 1):
+            streamed = codes(self.client.get('/dashboard').get_data(as_text=True))
+        self.assertEqual(streamed, [credit.code for credit in app_module.fetch_store_credits('STORE1')])
+        self.assertEqual([code for code in streamed if code.startswith('PR')], ['PR3', 'PR0', 'PR2', 'PR1'])
+
+    def test_minimal_writes(self):
+        """Test that writes with returning='minimal' land and return no rows"""
+        row = {'code': 'PGM', 'items': '["Item"]', 'reason': 'Test', 'store_id': 'STORE1', 'created_by': '4757'}
+        self.assertEqual(self.db.table('credits').insert(row, returning='minimal').execute().data, [])
+        self.assertEqual(self.db.table('credits').upsert(dict(row, reason='Upserted'), on_conflict='store_id,code',
+                                                         returning='minimal').execute().data, [])
+        credits = self.db.table('credits').select('reason').eq('code', 'PGM').execute().data
+        self.assertEqual(credits, [{'reason': 'Upserted'}])
+        
+        self.db.table('credits').delete(returning='minimal').eq('code', 'PGM').execute()
+        self.assertEqual(self.db.table('credits').select('code').eq('code', 'PGM').execute().data, [])
+
+    def test_streamed_dashboard_pages_past_undated_credits(self):
+        """Test that keyset pages continue past legacy credits without a created_at, which come first"""
+        self.db.table('credits').insert([
+            {'code': code, 'items': '["Item"]', 'reason': 'Legacy', 'store_id': 'STORE1', 'created_by': '4757',
+             'created_at': None}
+            for code in ('PL1', 'PL2')
+        ]).execute()
+        self.addCleanup(lambda: self.db.table('credits').delete().in_('code', ['PL1', 'PL2']).execute())
+        codes = lambda html: [part[:part.index('"')] for part in html.split('data-code="')[1:]]
+        with patch('app.STREAM_RENDERING', True), patch('app.STREAM_PAGE_SIZE', 1):
+            streamed = codes(self.client.get('/dashboard').get_data(as_text=True))
+        self.assertEqual(streamed, [credit.code for credit in app_module.fetch_store_credits('STORE1')])
+        self.assertEqual(streamed[:2], ['PL2', 'PL1'])
+        self.assertGreater(len(streamed), 2)
+
+    def test_restore_upserts_without_events(self):
+        """Test that restore_credits() updates existing credits and leaves the outbox alone"""
+        self.addCleanup(lambda: self.db.table('credits').delete().eq('code', 'RST').execute())
+        rows = [{'code': 'RST', 'items': '["Item"]', 'reason': reason, 'date_of_issue': '2024-01-01',
+                 'store_id': 'STORE1', 'status': 'claimed', 'created_at': '2024-01-01T00:00:00+00:00',
+                 'claimed_at': '2024-01-02T00:00:00+00:00', 'claimed_by': 'Admin', 'claimed_by_user': '4757',
+                 'created_by': '4757', 'customer_name': None, 'customer_phone': None, 'client_ref': None}
+                for reason in ('First', 'Second')]
+        events = self.db.table('credit_outbox').select('id').execute().data
+        for row in rows:
+            self.db.rpc('restore_credits', {'p_rows': [row]}).execute()
+        credit = self.db.table('credits').select('reason, status').eq('code', 'RST').execute().data
+        self.assertEqual(credit, [{'reason': 'Second', 'status': 'claimed'}])
+        self.assertEqual(self.db.table('credit_outbox').select('id').execute().data, events)
+
+    def test_pages_render(self):
+        """Test that the dashboard and admin pages render from direct query results"""
+        for path in ('/dashboard', '/dashboard/all', '/admin', '/admin/users', '/admin/stores',
+                     '/admin/assignments', '/admin/reports', '/admin/lookup/users?q=47'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 200)
+
+    def test_constraint_violations_raise_api_errors(self):
+        """Test that unique violations reach the app as PostgREST errors"""
+        with self.assertRaises(APIError) as raised:
+            self.db.table('users').insert({'code': '4757', 'password': 'x'}).execute()
+        self.assertEqual(raised.exception.code, '23505')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,9 @@
+"""Production WSGI entry point
+
+Serve the app with gunicorn, which picks up its settings from
+gunicorn.conf.py:
+
+    gunicorn wsgi:app
+"""
+
+from app import app